@@ -1,120 +1,32 @@
 import streamlit as st
-import random
-import pandas as pd
-import plotly.express as px
 import time  # ⬅️ DÒNG NÀY
-from datetime import datetime
-from db import supabase, PLAYER_ID
+import json
+import tempfile
+from datetime import datetime, timedelta
+from functools import wraps
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import metrics
+from db import storage, PLAYER_ID
+from eventlog import EVENT_LABELS, SNAPSHOT_EVERY, apply_event, new_event, replay
+from game import (
+    ACHIEVEMENTS, CHEST_COST, FORGE_PRICES, HISTORY_DATE_FMT, ITEMS, MAX_NAME, SELL_PRICE,
+    TAVERN_ITEMS, ActionError, achievement_progress, check_action, current_energy, game_now,
+    inventory_size, leaderboard_stats, new_player, slot_price, task_modifiers, tavern_cost
+)
+from game import max_energy as get_max_energy
+from migrations import migrate, needs_migration
+from transfer import EXPORT_FORMATS, IMPORT_KINDS, ImportFileError, export_history, parse_import
 
-DEFAULT_DATA = {
-    "points": 0,
-    "energy": 100,
-    "boss_hp": 1000,
-    "boss_kills": 0,
-
-    "tasks": {},
-    "task_history": [],
-    "tasks_done": 0,
-
-    "treats": {},
-
-    "inventory": [],
-    "max_slots": 3,
-
-    "equips": {
-        "sword": 1,
-        "boots": 1
-    },
-
-    "debuffs": [],
-    "achievements": [],
-
-    "last_updated": time.time()
-}
-
-ACHIEVEMENTS = {
-    "dragon_slayer": {
-        "name": "Kẻ Diệt Rồng",
-        "emoji": "🐉",
-        "desc": "Hạ gục 10 Boss",
-        "condition": lambda d: d.get("boss_kills", 0) >= 7,
-        "reward": lambda d: d.update({
-            "bonus_damage": d.get("bonus_damage", 0) + 10
-        })
-    },
-
-    "millionaire": {
-        "name": "Triệu Phú",
-        "emoji": "💰",
-        "desc": "Tích lũy tổng cộng 5000 pts",
-        "condition": lambda d: d.get("total_points", 0) >= 5000,
-        "reward": lambda d: d.update({
-            "max_slots": d.get("max_slots", 3) + 2
-        })
-    },
-
-    "iron_discipline": {
-        "name": "Kỷ Luật Thép",
-        "emoji": "🛡️",
-        "desc": "Hoàn thành task liên tục 7 ngày",
-        "condition": lambda d: d.get("streak", 0) >= 7,
-        "reward": lambda d: d.update({
-            "bonus_max_energy": d.get("bonus_max_energy", 0) + 20
-        })
-    }
-}
-
-DEBUFFS = [
-    {
-        "name": "Mệt Mỏi",
-        "emoji": "😵",
-        "desc": "Task tiếp theo tốn +5 energy",
-        "apply": lambda d: d.__setitem__("next_task_penalty", 5)
-    },
-    {
-        "name": "Chấn Thương",
-        "emoji": "🩸",
-        "desc": "Giảm 20 energy ngay lập tức",
-        "apply": lambda d: d.__setitem__("energy", max(0, d["energy"] - 20))
-    },
-    {
-        "name": "Uể Oải",
-        "emoji": "🐌",
-        "desc": "Giảm 50% sát thương task kế tiếp",
-        "type": "half_damage"
-    },
-    {
-        "name": "Choáng",
-        "emoji": "💫",
-        "desc": "Không hồi energy trong 10 phút",
-        "apply": lambda d: d.__setitem__("energy_block_until", time.time() + 600)
-    },
-    {
-        "name": "Cám Dỗ",
-        "emoji": "🍩",
-        "desc": "Mất 10 pts vì xao nhãng",
-        "apply": lambda d: d.__setitem__("points", max(0, d["points"] - 10))
-    }
-]
-
-CHEST_ITEMS = [
-    {"name": "Mana Potion", "desc": "Hồi 50⚡ energy", "type": "energy", "value": 50},
-    {"name": "Greater Mana Potion", "desc": "Hồi 100⚡ energy", "type": "energy", "value": 100},
-    {"name": "Boss Bomb", "desc": "Gây 200 dmg lên Boss", "type": "damage", "value": 200},
-    {"name": "Mega Bomb", "desc": "Gây 400 dmg lên Boss", "type": "damage", "value": 400},
-    {"name": "Energy Scroll", "desc": "Tăng energy tối đa +10", "type": "max_energy", "value": 10},
-    {"name": "Lucky Coin", "desc": "Nhận thêm 100 pts", "type": "points", "value": 100},
-    {"name": "Cursed Coin", "desc": "Mất 50 pts (đen)", "type": "points", "value": -50},
-    {"name": "Boss Poison", "desc": "Boss mất 10% HP hiện tại", "type": "percent_damage", "value": 0.1},
-    {"name": "Stimulant", "desc": "Hồi 30⚡ energy ngay", "type": "energy", "value": 30},
-    {"name": "Empty Chest", "desc": "Không có gì… xui 😭", "type": "none", "value": 0},
-]
 if "chest_msg" not in st.session_state:
     st.session_state.chest_msg = None
 
+# task thiếu energy: giữ cảnh báo qua rerun sau khi commit
+if "energy_msg" not in st.session_state:
+    st.session_state.energy_msg = None
+
 
 def get_environment():
-    now = datetime.now()
+    now = game_now()
     hour = now.hour
     weekday = now.weekday()  # 0 = Mon, 6 = Sun
 
@@ -139,109 +51,264 @@ def get_environment():
     return env
 
 
-def check_achievements(data):
-    unlocked = data.setdefault("achievements", [])
-
-    for key, ach in ACHIEVEMENTS.items():
-        if key in unlocked:
-            continue
-
-        if ach["condition"](data):
-            unlocked.append(key)
-            ach["reward"](data)
-            st.toast(f"{ach['emoji']} Achievement unlocked: {ach['name']}!", icon="🏆")
+def snapshot(data):
+    # dạng chuẩn hoá để so sánh state đã lưu / state hiện tại
+    return json.dumps(data, sort_keys=True, ensure_ascii=False)
 
 
-def get_max_energy(data):
-    boots_lvl = data.get("equips", {}).get("boots", 1)
-    return 100 + (boots_lvl - 1) * 10
+# Trong khoảng này rerun dùng thẳng state trong session, không hỏi storage
+CACHE_TTL = 10  # giây
 
 
-def load_data():
+def fetch_data():
     try:
-        res = supabase.table("players") \
-            .select("data") \
-            .eq("id", PLAYER_ID) \
-            .execute()
+        row = storage.get_player(PLAYER_ID)
     except Exception as e:
-        st.error("❌ Không thể tải dữ liệu từ Supabase")
+        st.error("❌ Không thể tải dữ liệu")
         st.exception(e)
         st.stop()
 
     # ===== PLAYER TỒN TẠI =====
-    if res.data and len(res.data) > 0:
-        data = res.data[0]["data"]
+    if row is not None:
+        data, version = row
+        changed = False
 
     # ===== PLAYER CHƯA TỒN TẠI =====
     else:
-        data = DEFAULT_DATA.copy()
-        data["created_at"] = time.time()
+        data = new_player(time.time())
+        version = 0
+        # ghi snapshot đầu tiên để luôn có mốc khôi phục
+        changed = True
 
         try:
-            supabase.table("players").insert({
-                "id": PLAYER_ID,
-                "data": data
-            }).execute()
+            storage.insert_player(PLAYER_ID, data, version)
         except Exception as e:
             st.error("❌ Không thể tạo player mới")
             st.exception(e)
             st.stop()
 
-    # ===== DATA MIGRATION (LUÔN CHẠY) =====
-    data.setdefault("tasks", {})
-    data.setdefault("task_history", [])
-    data.setdefault("tasks_done", 0)
-    data.setdefault("total_points", 0)
-    data.setdefault("points", 0)
-    data.setdefault("energy", 100)
-    data.setdefault("boss_hp", 1000)
-    data.setdefault("boss_kills", 0)
-    data.setdefault("inventory", [])
-    data.setdefault("max_slots", 3)
-    data.setdefault("equips", {"sword": 1, "boots": 1})
-    data.setdefault("last_updated", time.time())
-
-    # ===== ENERGY REGEN =====
-    now = time.time()
-    elapsed_minutes = int((now - data["last_updated"]) // 60)
-
-    if time.time() < data.get("energy_block_until", 0):
-        return data
-
-    if elapsed_minutes >= 2:
-        regen = elapsed_minutes // 2
-        max_energy = 100 + (data["equips"]["boots"] - 1) * 20
-        data["energy"] = min(max_energy, data["energy"] + regen)
-        data["last_updated"] = now
-        save_data(data)
+    # ===== DATA MIGRATION: CHỈ CHẠY KHI SCHEMA CŨ, XONG THÌ LƯU LẠI =====
+    if needs_migration(data):
+        try:
+            changed = migrate(data, storage, PLAYER_ID)
+        except Exception as e:
+            st.error("❌ Không thể nâng cấp dữ liệu")
+            st.exception(e)
+            st.stop()
+
+    if changed:
+        save_snapshot(data, version, version)
+
+    # ===== STATE HIỆN TẠI = SNAPSHOT + REPLAY EVENT SAU NÓ =====
+    events = load_events(version)
+    replay(storage, PLAYER_ID, data, events)
+
+    # ===== CACHE =====
+    st.session_state.player_doc = snapshot(data)
+    st.session_state.player_version = events[-1]["seq"] if events else version
+    st.session_state.player_snapshot = version
+    st.session_state.player_checked_at = time.time()
+    st.session_state.leaderboard_stats = leaderboard_stats(data)
 
     return data
 
 
-def save_data(data):
+# ================= HISTORY =================
+# task_history / treat_history là bảng append-only, mỗi lần hoàn thành chỉ
+# insert 1 row. Document của player chỉ giữ counter + vài entry gần nhất.
+HISTORY_TABLES = ("task_history", "treat_history")
+
+
+def insert_history(table, rows):
     try:
-        data["last_updated"] = time.time()
+        storage.append_history(table, PLAYER_ID, rows)
+    except Exception as e:
+        st.error("❌ Không thể lưu lịch sử")
+        st.exception(e)
+        st.stop()
+
+
+def flush_history(history):
+    # history: (table, row) do action vừa commit tạo ra
+    for table in HISTORY_TABLES:
+        rows = [row for t, row in history if t == table]
+        if rows:
+            insert_history(table, rows)
+
+
+# ================= ACTION LOG =================
+def load_events(after_seq, upto_seq=None):
+    try:
+        return storage.read_events(PLAYER_ID, after_seq, upto_seq)
+    except Exception as e:
+        st.error("❌ Không thể tải nhật ký")
+        st.exception(e)
+        st.stop()
+
+
+def save_snapshot(data, expected, seq):
+    # snapshot chỉ để replay ngắn lại: session khác đã ghi snapshot mới hơn
+    # (CAS thất bại) thì bỏ qua, event vẫn đủ để dựng lại state
+    try:
+        if storage.update_player(PLAYER_ID, data, expected, seq):
+            storage.save_snapshot(PLAYER_ID, seq, data)
+            st.session_state.player_snapshot = seq
+    except Exception as e:
+        st.error("❌ Không thể lưu snapshot")
+        st.exception(e)
+        st.stop()
+
+
+def cache_is_fresh():
+    if "player_doc" not in st.session_state:
+        return False
+
+    # ===== TRONG TTL: KHÔNG CHECK =====
+    if time.time() - st.session_state.player_checked_at < CACHE_TTL:
+        return True
+
+    # ===== HẾT TTL: CHỈ HỎI SEQ CỦA EVENT MỚI NHẤT =====
+    try:
+        head = storage.get_head(PLAYER_ID)
+    except Exception as e:
+        # backend lỗi: chơi tiếp trên state trong session (journal giữ phần ghi),
+        # hết TTL thì hỏi lại
+        st.toast(f"Không kết nối được dữ liệu, đang dùng bản trong phiên: {e}", icon="⚠️")
+        head = st.session_state.player_version
+
+    if head != st.session_state.player_version:
+        return False
 
-        supabase.table("players").update({
-            "data": data
-        }).eq("id", PLAYER_ID).execute()
+    st.session_state.player_checked_at = time.time()
+    return True
 
+
+@metrics.timed("load_data")
+def load_data():
+    if cache_is_fresh():
+        data = json.loads(st.session_state.player_doc)
+    else:
+        data = fetch_data()
+
+    return data
+
+
+class VersionConflict(Exception):
+    # seq đã bị session khác ghi sau lần đọc của mình
+    pass
+
+
+@metrics.timed("save_event")
+def save_event(data, event):
+    seq = st.session_state.player_version + 1
+
+    try:
+        # ===== SEQ DUY NHẤT THAY CHO COMPARE-AND-SWAP =====
+        written = storage.append_event(PLAYER_ID, {**event, "seq": seq})
     except Exception as e:
         st.error("❌ Không thể lưu dữ liệu")
         st.exception(e)
         st.stop()
 
+    if not written:
+        raise VersionConflict()
+
+    if seq % SNAPSHOT_EVERY == 0:
+        save_snapshot(data, st.session_state.player_snapshot, seq)
+
+    st.session_state.player_doc = snapshot(data)
+    st.session_state.player_version = seq
+    st.session_state.player_checked_at = time.time()
+
+
+def update_leaderboard(data):
+    # chỉ ghi khi stat được xếp hạng thật sự đổi
+    stats = leaderboard_stats(data)
+    if stats == st.session_state.get("leaderboard_stats"):
+        return
+
+    try:
+        storage.update_leaderboard(PLAYER_ID, stats)
+    except Exception as e:
+        st.error("❌ Không thể cập nhật leaderboard")
+        st.exception(e)
+        st.stop()
+
+    st.session_state.leaderboard_stats = stats
+
+
+MAX_COMMIT_RETRIES = 5
+
+
+def action_error(type_, **args):
+    # tham số của form sai luật (cùng luật với API) → thông báo, hợp lệ → None
+    try:
+        check_action(type_, args)
+    except ActionError as e:
+        return str(e)
+    return None
+
+
+def commit(type_, **args):
+    # Mỗi action (game.ACTIONS) được ghi thành 1 event nhỏ kèm seed RNG.
+    # Seq đã bị session khác ghi → dựng lại state mới nhất rồi chạy lại
+    # đúng event đó, không khoá gì nên nhiều session cùng chơi không mất dữ liệu.
+    global data
+    event = new_event(type_, **args)
+
+    for _ in range(MAX_COMMIT_RETRIES):
+        before = snapshot(data)
+        unlocked = set(data.get("achievements", []))
+        result, history = apply_event(storage, PLAYER_ID, data, event)
+
+        # ===== KHÔNG ĐỔI GÌ → KHÔNG GHI =====
+        if snapshot(data) == before:
+            return result
+
+        data["last_updated"] = event["ts"]
+        try:
+            save_event(data, event)
+        except VersionConflict:
+            data = fetch_data()
+            continue
+
+        flush_history(history)
+        update_leaderboard(data)
+        toast_achievements(k for k in data.get("achievements", []) if k not in unlocked)
+        return result
+
+    st.error("❌ Dữ liệu đang bị ghi liên tục từ nơi khác, thử lại sau")
+    st.stop()
+
+
+def toast_achievements(keys):
+    for key in keys:
+        ach = ACHIEVEMENTS[key]
+        st.toast(f"{ach['emoji']} Achievement unlocked: {ach['name']}!", icon="🏆")
+
+
+def rerun():
+    # st.rerun() thoát script ngay → chốt số liệu của rerun này trước
+    metrics.finish_rerun()
+    st.rerun()
+
+
+def sidebar_stats(d):
+    # các số liệu sidebar hiển thị: đổi → phải rerun cả trang
+    return (
+        d["points"], d["energy"], d.get("energy_at"), d["boss_hp"], d.get("boss_kills", 0),
+        d.get("tasks_done", 0), d.get("debuffs", []),
+        d["equips"]["boots"], d.get("bonus_max_energy", 0)
+    )
+
 
 # ================= UI =================
+metrics.start_rerun()
 st.set_page_config("The Grind RPG", layout="wide")
 data = load_data()
-max_energy = get_max_energy(data)
-data["energy"] = min(data["energy"], max_energy)
-save_data(data)
 
 env = get_environment()
-bonus_energy = data.get("bonus_max_energy", 0)
-max_energy = 100 + (data['equips']['boots'] - 1) * 20 + bonus_energy
+max_energy = get_max_energy(data)
 
 st.markdown("""
 <style>
@@ -255,9 +322,11 @@ st.markdown("""
 st.sidebar.title("⚔️ from the ordinary to flee")
 
 # ===== CORE STATS =====
+st.session_state.sidebar_stats = sidebar_stats(data)
 st.sidebar.metric("💰 Points", data["points"])
-st.sidebar.write(f"⚡ Energy {int(data['energy'])}/{max_energy}")
-st.sidebar.progress(min(data["energy"] / max_energy, 1))
+energy = current_energy(data, time.time())
+st.sidebar.write(f"⚡ Energy {int(energy)}/{max_energy}")
+st.sidebar.progress(min(energy / max_energy, 1))
 
 st.sidebar.metric("🏆 Boss đã hạ", data.get("boss_kills", 0))
 st.sidebar.metric("📜 Task đã hoàn thành", data.get("tasks_done", 0))
@@ -265,14 +334,14 @@ st.sidebar.metric("📜 Task đã hoàn thành", data.get("tasks_done", 0))
 hp_pct = max(0, data["boss_hp"] / 1000)
 st.sidebar.progress(hp_pct, text=f"🐉 Boss HP {data['boss_hp']}/1000")
 
-year_prog = (datetime.now() - datetime(datetime.now().year, 1, 1)).days / 365
+year_prog = (game_now() - datetime(game_now().year, 1, 1)).days / 365
 st.sidebar.progress(year_prog, text=f"📅 Year {year_prog:.1%}")
 
 # ===== ENVIRONMENT BUFFS =====
 st.sidebar.divider()
 st.sidebar.subheader("🌍 Environment Buff")
 
-now = datetime.now()
+now = game_now()
 hour = now.hour
 weekday = now.weekday()  # 5 = Sat, 6 = Sun
 
@@ -324,26 +393,78 @@ if st.session_state.reset_confirm:
         st.session_state.reset_confirm = False
 
     if col2.button("✅ Xác nhận"):
-        data = DEFAULT_DATA.copy()
-        save_data(data)
+        commit("reset")
         st.session_state.reset_confirm = False
         st.success("Đã reset nhân vật!")
-        st.rerun()
+        rerun()
+
+# ================= NHẬT KÝ / KHÔI PHỤC =================
+EVENT_LOG_SIZE = 10
+
+# toggle thay cho expander: nội dung expander luôn bị chạy dù đang đóng
+if st.sidebar.toggle("📜 Nhật ký & khôi phục", key="show_event_log"):
+    head = st.session_state.player_version
+
+    for event in reversed(load_events(max(0, head - EVENT_LOG_SIZE))):
+        col1, col2 = st.sidebar.columns([4, 1])
+        col1.caption(
+            f"#{event['seq']} {EVENT_LABELS.get(event['type'], event['type'])} · "
+            f"{game_now(event['ts']).strftime(HISTORY_DATE_FMT)}"
+        )
+
+        if col2.button("⏪", key=f"restore_{event['seq']}", help="Khôi phục về trước event này"):
+            try:
+                commit("restore", seq=event["seq"] - 1)
+            except LookupError as e:
+                st.sidebar.error(f"❌ {e}")
+            else:
+                rerun()
+
+    st.sidebar.caption("Khôi phục về trước một lần Reset thì lịch sử chi tiết cũ hiện lại.")
 
 # ================= TABS =================
-tabs = st.tabs([
-    "⚔️ Task",
-    "🎁 Treat",
-    "📦 Rương",
-    "🎒 Túi đồ",
-    "🛠️ Rèn",
-    "🍻 Tavern",
-    "📊 Thống kê",
-    "⚙️ Forge", "🏆 ACHIEVEMENTS"
-])
+# Chỉ tab đang chọn được chạy. Mỗi tab là một st.fragment: bấm nút trong tab
+# chỉ chạy lại tab đó, sidebar chỉ vẽ lại khi số liệu của nó đổi.
+def rerun_tab():
+    if sidebar_stats(data) != st.session_state.get("sidebar_stats"):
+        rerun()
+
+    metrics.finish_rerun()
+    # fragment chạy trong lượt chạy cả app (lần đầu, sau rerun()) thì không
+    # rerun riêng fragment được → chạy lại cả app
+    ctx = get_script_run_ctx()
+    if ctx is None or not ctx.fragment_ids_this_run:
+        st.rerun()
+    st.rerun(scope="fragment")
+
+
+def tab_fragment(name):
+    def decorator(fn):
+        @st.fragment
+        @wraps(fn)
+        def wrapper():
+            global data
+
+            # fragment rerun không chạy phần đầu script → tự mở bản ghi
+            # metrics và lấy state mới nhất (cache session)
+            own_rerun = metrics.current() is None
+            if own_rerun:
+                metrics.start_rerun()
+                data = load_data()
+
+            try:
+                with metrics.span(f"tab:{name}"):
+                    fn()
+            finally:
+                if own_rerun:
+                    metrics.finish_rerun()
+        return wrapper
+    return decorator
+
 
 # ================= ACHIEVEMENTS TAB =================
-with tabs[-1]:
+@tab_fragment("achievements")
+def render_achievements_tab():
     st.subheader("🏆 ACHIEVEMENTS")
 
     if not data.get("achievements"):
@@ -362,95 +483,196 @@ with tabs[-1]:
                 unsafe_allow_html=True
             )
 
-# ================= TASK TAB =================
-with tabs[0]:
-    st.subheader("⚔️Fram þæm gemænan ætfleohan.")
+    # ===== ĐANG TIẾN TỚI =====
+    locked = [p for p in achievement_progress(data) if not p[3]]
+    if locked:
+        st.markdown("### 🔒 Đang tiến tới")
+        for key, ach, progress, _ in locked:
+            st.progress(
+                progress,
+                text=f"{ach['emoji']} {ach['name']} — {ach['desc']} ({progress:.0%})"
+            )
 
-    if not data.get("tasks"):
-        st.info("Chưa có task nào. Hãy tạo trong Forge.")
+# ================= HISTORY BROWSER =================
+# Chỉ tải đúng trang đang xem từ storage (keyset theo id, mới nhất trước).
+# history_cursors là stack before_id của các trang đã đi qua.
+def history_prev_page():
+    st.session_state.history_cursors.pop()
 
-    now = datetime.now()
-    hour = now.hour
 
-    # ===== ENVIRONMENT =====
-    env_damage_mult = 2 if 9 <= hour < 11 else 1
-    debuff_chance = 0.40 if hour >= 23 else 0.20
+def history_next_page(before_id):
+    st.session_state.history_cursors.append(before_id)
 
-    for name, pts in list(data["tasks"].items()):
-        base_dmg = (pts // 2) * data["equips"].get("sword", 1)
-        preview_dmg = base_dmg * env_damage_mult
 
-        col1, col2 = st.columns([4, 1])
-        col1.write(
-            f"**{name}** | +{pts} pts | ⚔️ {preview_dmg} dmg"
-            + (" ⚡x2" if env_damage_mult == 2 else "")
+def render_history_browser():
+    col_search, col_dates, col_size = st.columns([2, 2, 1])
+    search = col_search.text_input("🔍 Tên task", key="history_search").strip()
+    dates = col_dates.date_input("📅 Khoảng ngày", value=(), key="history_dates")
+    page_size = col_size.selectbox("Số dòng", [25, 50, 100], index=1, key="history_page_size")
+
+    date_from = dates[0].strftime("%Y-%m-%d") if len(dates) >= 1 else None
+    date_to = None
+    if len(dates) == 2:
+        date_to = (dates[1] + timedelta(days=1)).strftime("%Y-%m-%d")
+
+    # đổi bộ lọc (hay Reset / khôi phục) → quay về trang đầu
+    reset_at = data.get("reset_at", 0)
+    filters = (search, date_from, date_to, page_size, reset_at)
+    if st.session_state.get("history_filters") != filters:
+        st.session_state.history_filters = filters
+        st.session_state.history_cursors = [None]
+
+    cursors = st.session_state.history_cursors
+
+    try:
+        # lấy dư 1 row để biết còn trang sau hay không
+        rows = storage.query_history(
+            "task_history", PLAYER_ID,
+            before_id=cursors[-1],
+            limit=page_size + 1,
+            date_from=date_from,
+            date_to=date_to,
+            search=search or None,
+            reset_at=reset_at
         )
+    except Exception as e:
+        st.error("❌ Không thể tải lịch sử")
+        st.exception(e)
+        return
 
-        if col2.button("Hoàn thành", key=f"done_{name}"):
-            check_achievements(data)
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
 
-            # ===== ENERGY COST =====
-            energy_cost = 10 + data.get("next_task_penalty", 0)
+    if not rows:
+        st.info("Không có task nào khớp bộ lọc.")
+    else:
+        st.dataframe(
+            [{"name": r["name"], "points": r["points"], "date": r["date"]} for r in rows],
+            width="stretch"
+        )
 
-            if data["energy"] < energy_cost:
-                st.warning("⚡ Không đủ energy")
-                st.stop()
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    col_prev.button(
+        "⬅️ Mới hơn",
+        disabled=len(cursors) == 1,
+        on_click=history_prev_page,
+        key="history_prev"
+    )
+    col_page.caption(f"Trang {len(cursors)}")
+    col_next.button(
+        "Cũ hơn ➡️",
+        disabled=not has_next,
+        on_click=history_next_page,
+        args=(rows[-1]["id"] if rows else None,),
+        key="history_next"
+    )
+
+    render_history_export()
+
+
+def export_file(table, fmt):
+    # chỉ chạy khi bấm tải: ghi dần từng trang ra file tạm thay vì dựng cả
+    # lịch sử trong bộ nhớ
+    out = tempfile.TemporaryFile()
+    export_history(storage, table, PLAYER_ID, fmt, out, reset_at=data.get("reset_at", 0))
+    out.seek(0)
+    return out
+
+
+def render_history_export():
+    col_table, col_format, col_button = st.columns([2, 1, 1])
+    table = col_table.selectbox(
+        "Xuất lịch sử",
+        ["task_history", "treat_history"],
+        format_func={"task_history": "⚔️ Task", "treat_history": "🎁 Treat"}.get,
+        key="export_table"
+    )
+    fmt = col_format.selectbox("Định dạng", list(EXPORT_FORMATS), key="export_format")
+
+    mime, ext = EXPORT_FORMATS[fmt]
+    col_button.download_button(
+        "⬇️ Tải về",
+        data=lambda: export_file(table, fmt),
+        file_name=f"{table}.{ext}",
+        mime=mime,
+        on_click="ignore",
+        key="export_download"
+    )
 
-            # ===== APPLY COST =====
-            data["energy"] -= energy_cost
-            data.pop("next_task_penalty", None)
 
-            # ===== REWARD =====
-            data["points"] += pts
-            data["total_points"] = data.get("total_points", 0) + pts
-            dmg = base_dmg * env_damage_mult
+# ================= TASK TAB =================
+def show_task_results(results):
+    # toast achievement do commit() lo; cảnh báo energy hiện sau rerun
+    missing = [r["name"] for r in results if r.get("no_energy")]
+    st.session_state.energy_msg = (
+        f"⚡ Không đủ energy cho: {', '.join(missing)}" if missing else None
+    )
+
+    for r in results:
+        if r.get("no_energy"):
+            continue
 
-            # ===== RANDOM DEBUFF =====
-            debuff_msg = None
-            if random.random() < debuff_chance:
-                debuff = random.choice(DEBUFFS)
-                debuff_msg = f"{debuff['emoji']} {debuff['name']}: {debuff['desc']}"
+        if r["debuff"]:
+            debuff = r["debuff"]
+            st.toast(f"{debuff['emoji']} {debuff['name']}: {debuff['desc']}", icon="⚠️")  # tự biến sau ~3s
 
-                if debuff.get("type") == "half_damage":
-                    dmg //= 2
-                else:
-                    debuff["apply"](data)
+    if any(r.get("boss_killed") for r in results):
+        st.balloons()
 
-            # ===== DAMAGE =====
-            data["boss_hp"] -= dmg
 
-            # ===== HISTORY =====
-            data.setdefault("task_history", []).append({
-                "name": name,
-                "points": pts,
-                "date": now.strftime("%Y-%m-%d %H:%M")
-            })
-            data["tasks_done"] = data.get("tasks_done", 0) + 1
+@tab_fragment("task")
+def render_task_tab():
+    st.subheader("⚔️Fram þæm gemænan ætfleohan.")
 
-            # ===== REMOVE TASK =====
-            del data["tasks"][name]
+    if st.session_state.energy_msg:
+        st.warning(st.session_state.energy_msg)
+        st.session_state.energy_msg = None
 
-            # ===== BOSS DEAD =====
-            if data["boss_hp"] <= 0:
-                data["boss_kills"] += 1
-                data["boss_hp"] = 1000
-                st.balloons()
+    if not data.get("tasks"):
+        st.info("Chưa có task nào. Hãy tạo trong Forge.")
 
-            save_data(data)
+    now = game_now()
+    env_damage_mult, _ = task_modifiers(now)
 
-            if debuff_msg:
-                st.toast(debuff_msg, icon="⚠️")  # tự biến sau ~3s
+    for name, pts in list(data["tasks"].items()):
+        base_dmg = (pts // 2) * data["equips"].get("sword", 1)
+        preview_dmg = base_dmg * env_damage_mult
+
+        col1, col2 = st.columns([4, 1])
+        col1.write(
+            f"**{name}** | +{pts} pts | ⚔️ {preview_dmg} dmg"
+            + (" ⚡x2" if env_damage_mult == 2 else "")
+        )
+
+        if col2.button("Hoàn thành", key=f"done_{name}"):
+            # task có thể đã được hoàn thành ở session khác → None
+            results = commit("complete_tasks", names=[name])
+            show_task_results(results)
+            rerun_tab()
+
+    # ===== HOÀN THÀNH NHIỀU TASK MỘT LẦN =====
+    if len(data["tasks"]) > 1:
+        with st.form("batch_complete"):
+            selected = st.multiselect(
+                "Chọn nhiều task",
+                list(data["tasks"]),
+                key="batch_tasks"
+            )
 
-            st.rerun()
+            if st.form_submit_button("✅ Hoàn thành đã chọn") and selected:
+                # một lần commit cho cả danh sách, áp dụng đúng thứ tự đã chọn
+                results = commit("complete_tasks", names=selected)
+                show_task_results(results)
+                rerun_tab()
 
     # ===== TASK HISTORY VIEW =====
     st.divider()
     st.subheader("📜 Lịch sử Task đã hoàn thành")
 
-    if not data.get("task_history"):
+    if not data.get("recent_history"):
         st.info("Chưa hoàn thành task nào.")
     else:
-        for t in data["task_history"][-5:][::-1]:
+        for t in data["recent_history"][::-1]:
             st.markdown(
                 f"✅ **{t['name']}** — +{t['points']} pts  \n"
                 f"<small>{t['date']}</small>",
@@ -459,12 +681,13 @@ with tabs[0]:
 
         st.caption(f"📊 Tổng task đã hoàn thành: {data.get('tasks_done', 0)}")
 
-        with st.expander("📂 Xem toàn bộ lịch sử"):
-            df = pd.DataFrame(data["task_history"][::-1])
-            st.dataframe(df, use_container_width=True)
+        # toggle thay cho expander: nội dung expander luôn bị chạy dù đang đóng
+        if st.toggle("📂 Xem toàn bộ lịch sử"):
+            render_history_browser()
 
 # ================= TREAT TAB =================
-with tabs[1]:
+@tab_fragment("treat")
+def render_treat_tab():
     st.subheader("🎁 TREAT – Phần thưởng cho bản thân")
 
     if not data.get("treats"):
@@ -477,29 +700,20 @@ with tabs[1]:
 
             # ---- CLAIM ----
             if col2.button("Nhận", key=f"treat_{name}"):
-                if data["points"] >= cost:
-                    data["points"] -= cost
-
-                    data.setdefault("treat_history", []).append({
-                        "name": name,
-                        "cost": cost,
-                        "time": datetime.now().strftime("%Y-%m-%d %H:%M")
-                    })
-
-                    save_data(data)
+                if commit("claim_treat", name=name):
                     st.success(f"Đã nhận treat: {name}")
-                    st.rerun()
+                    rerun_tab()
                 else:
                     st.error("Không đủ points")
 
             # ---- DELETE TREAT ----
             if col3.button("🗑️", key=f"del_treat_{name}"):
-                del data["treats"][name]
-                save_data(data)
-                st.rerun()
+                commit("delete_treat", name=name)
+                rerun_tab()
 
 # ================= CHEST TAB =================
-with tabs[2]:
+@tab_fragment("chest")
+def render_chest_tab():
     st.subheader("📦 RƯƠNG MAY MẮN")
 
     # ---- HIỆN THÔNG BÁO CŨ ----
@@ -507,70 +721,51 @@ with tabs[2]:
         st.info(st.session_state.chest_msg)
         if st.button("OK"):
             st.session_state.chest_msg = None
-            st.rerun()
+            rerun_tab()
 
     # ---- MỞ RƯƠNG ----
-    if st.button("🔓 MỞ RƯƠNG"):
-        if data["points"] < 50:
-            st.error("Không đủ points")
-        elif len(data["inventory"]) >= data["max_slots"]:
-            st.error("Túi đồ đã đầy")
-        else:
-            data["points"] -= 50
-            item = random.choice(CHEST_ITEMS)
+    if st.button(f"🔓 MỞ RƯƠNG ({CHEST_COST} pts)"):
+        result = commit("open_chest")
 
-            msg = ""
-
-            # rủi ro mất thêm pts
-            if random.random() < 0.2:
-                lost = random.randint(10, 30)
-                data["points"] = max(0, data["points"] - lost)
-                msg += f"💀 Rương bị nguyền! Mất {lost} pts\n"
-
-            if item["type"] == "none":
-                msg += "😢 Rương trống..."
-            else:
-                data["inventory"].append(item)
-                msg += f"🎉 Nhận được: {item['name']}\n👉 {item['desc']}"
-
-            save_data(data)
-
-            st.session_state.chest_msg = msg
-            st.rerun()
+        if "error" in result:
+            st.error(result["error"])
+        else:
+            st.session_state.chest_msg = result["msg"]
+            rerun_tab()
 
 # ================= INVENTORY TAB =================
-with tabs[3]:
+@tab_fragment("inventory")
+def render_inventory_tab():
     st.subheader("🎒 Túi đồ")
 
     # ---- BUY INVENTORY SLOT (FIX) ----
-    max_slots = data.get("max_slots", 3)
-    slot_price = 100 + (max_slots - 3) * 50
-
     col_a, col_b = st.columns([3, 1])
     col_a.write(f"Số ô: {data['max_slots']}")
 
-    if col_b.button(f"➕ Mua ô ({slot_price} pts)"):
-        if data["points"] >= slot_price:
-            data["points"] -= slot_price
-            data["max_slots"] += 1
-            save_data(data)
+    if col_b.button(f"➕ Mua ô ({slot_price(data)} pts)"):
+        if commit("buy_slot"):
             st.success("Đã mở rộng kho đồ!")
-            st.rerun()
+            rerun_tab()
         else:
             st.error("Không đủ points")
-    st.subheader(f"🎒 Túi đồ ({len(data['inventory'])}/{data['max_slots']})")
+    used = inventory_size(data)
+    st.subheader(f"🎒 Túi đồ ({used}/{data['max_slots']})")
 
     cols = st.columns(3)
 
-    for i in range(data["max_slots"]):
+    # mỗi loại item một ô (kèm số lượng), phần còn lại là ô trống
+    cells = list(data["inventory"].items()) + [None] * max(0, data["max_slots"] - used)
+
+    for i, cell in enumerate(cells):
         with cols[i % 3]:
-            if i < len(data["inventory"]):
-                it = data["inventory"][i]
+            if cell is not None:
+                item_id, count = cell
+                it = ITEMS[item_id]
 
                 st.markdown(
                     f"""
                     <div class='card'>
-                        <b>{it['name']}</b><br>
+                        <b>{it['name']}</b>{f" ×{count}" if count > 1 else ""}<br>
                         <small style='color:#aaa'>Bấm xem công dụng</small>
                     </div>
                     """,
@@ -583,41 +778,16 @@ with tabs[3]:
                 col_use, col_sell = st.columns(2)
 
                 # ---- USE ITEM ----
-                if col_use.button("Dùng", key=f"use_{i}"):
-                    if it["type"] == "energy":
-                        data["energy"] = min(max_energy, data["energy"] + it["value"])
-
-                    elif it["type"] == "damage":
-                        data["boss_hp"] -= it["value"]
-
-                    elif it["type"] == "percent_damage":
-                        data["boss_hp"] -= int(data["boss_hp"] * it["value"])
-
-                    elif it["type"] == "points":
-                        data["points"] = max(0, data["points"] + it["value"])
-
-                    elif it["type"] == "max_energy":
-                        data.setdefault("bonus_max_energy", 0)
-                        data["bonus_max_energy"] += it["value"]
-
-                    data["inventory"].pop(i)
-
-                    if data["boss_hp"] <= 0:
-                        data["boss_kills"] += 1
-                        data["boss_hp"] = 1000
+                if col_use.button("Dùng", key=f"use_{item_id}"):
+                    if commit("use_item", item_id=item_id):
                         st.balloons()
-
-                    save_data(data)
-                    st.rerun()
+                    rerun_tab()
 
                 # ---- SELL ITEM ----
-                if col_sell.button("Bán", key=f"sell_{i}"):
-                    sell_price = max(5, int(0.3 * 50))  # bán rẻ
-                    data["points"] += sell_price
-                    data["inventory"].pop(i)
-                    save_data(data)
-                    st.success(f"Đã bán {it['name']} (+{sell_price} pts)")
-                    st.rerun()
+                if col_sell.button("Bán", key=f"sell_{item_id}"):
+                    if commit("sell_item", item_id=item_id):
+                        st.success(f"Đã bán {it['name']} (+{SELL_PRICE} pts)")
+                    rerun_tab()
 
             else:
                 st.markdown(
@@ -626,52 +796,40 @@ with tabs[3]:
                 )
 
 # ================= 5. ARMORY =================
-with tabs[4]:
+@tab_fragment("armory")
+def render_armory_tab():
     c1, c2 = st.columns(2)
     with c1:
         st.markdown("<div class='card'><div class='big'>⚔️</div>"
                     f"Sword Lv.{data['equips']['sword']}</div>", unsafe_allow_html=True)
-        cost = data["equips"]["sword"] * 100
+        cost = data["equips"]["sword"] * FORGE_PRICES["sword"]
         if st.button(f"Rèn kiếm ({cost} pts)"):
-            if data["points"] >= cost:
-                data["points"] -= cost
-                data["equips"]["sword"] += 1
-                save_data(data)
-                st.rerun()
+            if commit("forge", equip="sword"):
+                rerun_tab()
 
     with c2:
         st.markdown("<div class='card'><div class='big'>👞</div>"
                     f"Boots Lv.{data['equips']['boots']}</div>", unsafe_allow_html=True)
-        cost = data["equips"]["boots"] * 150
+        cost = data["equips"]["boots"] * FORGE_PRICES["boots"]
         if st.button(f"Rèn giày ({cost} pts)"):
-            if data["points"] >= cost:
-                data["points"] -= cost
-                data["equips"]["boots"] += 1
-                save_data(data)
-                st.rerun()
+            if commit("forge", equip="boots"):
+                rerun_tab()
 
 # ================= TAVERN TAB =================
-with tabs[5]:
+@tab_fragment("tavern")
+def render_tavern_tab():
     st.subheader("🍻 TAVERN – Hồi phục & Xa xỉ")
 
-    tavern_items = [
-        {"name": "Nước Lã", "emoji": "🥛", "cost": 10, "energy": 10},
-        {"name": "Trà Đậm", "emoji": "🍵", "cost": 25, "energy": 25},
-        {"name": "Cà Phê Đen", "emoji": "☕", "cost": 50, "energy": 40},
-        {"name": "Bữa Thịnh Soạn", "emoji": "🍖", "cost": 80, "energy": 70},
-        {"name": "Yến Tiệc Vương Giả", "emoji": "🍗", "cost": 120, "energy": 100},
-    ]
-
     # 🌍 Environment buff (đã gọi sẵn ở đầu file)
     if env["tavern_price_multiplier"] < 1:
         st.success("🍻 Ngày hội Tavern! Giá giảm 50%")
 
-    cols = st.columns(len(tavern_items))
+    cols = st.columns(len(TAVERN_ITEMS))
 
-    for idx, item in enumerate(tavern_items):
+    for idx, item in enumerate(TAVERN_ITEMS):
         with cols[idx]:
             # ✅ ÁP DỤNG GIẢM GIÁ
-            final_cost = int(item["cost"] * env["tavern_price_multiplier"])
+            final_cost = tavern_cost(item, game_now())
 
             st.markdown(
                 f"""
@@ -686,50 +844,125 @@ with tabs[5]:
             )
 
             if st.button("Mua", key=f"tavern_{idx}"):
-                if data["points"] >= final_cost:
-                    data["points"] -= final_cost
-                    data["energy"] = min(max_energy, data["energy"] + item["energy"])
-                    save_data(data)
+                if commit("buy_tavern", index=idx):
                     st.success(f"Đã dùng {item['name']}")
-                    st.rerun()
+                    rerun_tab()
                 else:
                     st.error("Không đủ points")
 
 
 # ================= 7. ANALYTICS =================
-with tabs[6]:
+@tab_fragment("analytics")
+def render_analytics_tab():
     st.subheader("📊 Analytics")
 
-    if not data.get("task_history"):
+    rollups = data.get("rollups")
+
+    if not rollups or not rollups["day"]:
         st.info("Chưa có dữ liệu để thống kê.")
     else:
-        df = pd.DataFrame(data["task_history"])
-
-        # convert date
-        df["date"] = pd.to_datetime(df["date"])
-
-        # group theo ngày
-        daily = (
-            df.groupby(df["date"].dt.date)["points"]
-            .sum()
-            .reset_index()
+        # vẽ thẳng từ rollup đã cộng dồn, không đụng tới lịch sử
+        view = st.radio(
+            "Xem theo",
+            ["Ngày", "Tuần", "Giờ trong ngày"],
+            horizontal=True,
+            key="analytics_view"
         )
 
-        daily["Day"] = pd.to_datetime(daily["date"]).dt.strftime("%d/%m")
+        if view == "Ngày":
+            keys = sorted(rollups["day"])
+            labels = [datetime.strptime(k, "%Y-%m-%d").strftime("%d/%m") for k in keys]
+            values = [rollups["day"][k] for k in keys]
+            title = "🔥 Points kiếm được mỗi ngày"
+        elif view == "Tuần":
+            labels = sorted(rollups["week"])
+            values = [rollups["week"][k] for k in labels]
+            title = "📅 Points kiếm được mỗi tuần"
+        else:
+            labels = [f"{h:02d}h" for h in range(24)]
+            values = rollups["hour"]
+            title = "⏰ Points theo giờ trong ngày"
+
+        # plotly (kéo theo pandas) mất cả giây để import: chỉ tải khi thật sự vẽ
+        import plotly.express as px
 
         fig = px.bar(
-            daily,
+            {
+                "Day": labels,
+                "points": [v[0] for v in values],
+                "tasks": [v[1] for v in values]
+            },
             x="Day",
             y="points",
-            title="🔥 Points kiếm được mỗi ngày"
+            hover_data=["tasks"],
+            title=title
         )
         fig.update_layout(template="plotly_dark")
 
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(fig, width="stretch")
+
+
+# ================= LEADERBOARD =================
+LEADERBOARD_VIEWS = {
+    "💰 Tổng points": "total_points",
+    "🐉 Boss đã hạ": "boss_kills",
+    "📜 Task đã hoàn thành": "tasks_done",
+}
+LEADERBOARD_SIZE = 10
+
+
+@st.cache_data(ttl=30)
+def load_top_players(stat):
+    # top-K giống nhau cho mọi session → dùng chung, 30s đọc lại một lần
+    return storage.top_players(stat, LEADERBOARD_SIZE)
+
+
+@tab_fragment("leaderboard")
+def render_leaderboard_tab():
+    st.subheader("🏅 Leaderboard")
+
+    label = st.radio(
+        "Xếp theo",
+        list(LEADERBOARD_VIEWS),
+        horizontal=True,
+        key="leaderboard_view"
+    )
+    stat = LEADERBOARD_VIEWS[label]
+
+    try:
+        top = load_top_players(stat)
+        mine = storage.player_rank(PLAYER_ID, stat)
+    except Exception as e:
+        st.error("❌ Không thể tải leaderboard")
+        st.exception(e)
+        return
+
+    if not top:
+        st.info("Chưa có ai trên bảng xếp hạng.")
+    else:
+        rows, rank = [], 0
+        for i, (pid, value) in enumerate(top, 1):
+            # bằng điểm thì cùng hạng, giống hạng của mình bên dưới
+            if not rows or value != rows[-1][label]:
+                rank = i
+            rows.append({
+                "Hạng": rank,
+                "Player": "🫵 Bạn" if pid == PLAYER_ID else pid[:8],
+                label: value
+            })
+
+        st.dataframe(rows, hide_index=True, width="stretch")
+
+    if mine is None:
+        st.caption("Hoàn thành task để có tên trên bảng xếp hạng.")
+    else:
+        st.metric("🫵 Hạng của bạn", f"#{mine[0]}")
+        st.caption(f"{label}: {mine[1]}")
 
 
 # ================= 8. FORGE =================
-with tabs[7]:
+@tab_fragment("forge")
+def render_forge_tab():
     st.subheader("⚙️ FORGE")
 
     col_task, col_treat = st.columns(2)
@@ -744,7 +977,7 @@ with tabs[7]:
         """, unsafe_allow_html=True)
 
         with st.form("task_forge"):
-            task_name = st.text_input("Tên Task")
+            task_name = st.text_input("Tên Task", max_chars=MAX_NAME)
             task_pts = st.slider(
                 "Points nhận được",
                 min_value=10,
@@ -756,11 +989,12 @@ with tabs[7]:
             if st.form_submit_button("⚔️ Tạo Task"):
                 if task_name.strip() == "":
                     st.error("Task phải có tên")
+                elif error := action_error("add_task", name=task_name, points=task_pts):
+                    st.error(f"❌ {error}")
                 else:
-                    data["tasks"][task_name] = task_pts
-                    save_data(data)
+                    commit("add_task", name=task_name, points=task_pts)
                     st.success(f"Đã tạo task: {task_name}")
-                    st.rerun()
+                    rerun_tab()
 
     # -------- TREAT FORGE --------
     with col_treat:
@@ -772,7 +1006,7 @@ with tabs[7]:
         """, unsafe_allow_html=True)
 
         with st.form("treat_forge"):
-            treat_name = st.text_input("Tên Treat")
+            treat_name = st.text_input("Tên Treat", max_chars=MAX_NAME)
             treat_cost = st.slider(
                 "Giá (points)",
                 min_value=50,
@@ -784,8 +1018,92 @@ with tabs[7]:
             if st.form_submit_button("🍬 Tạo Treat"):
                 if treat_name.strip() == "":
                     st.error("Treat phải có tên")
+                elif error := action_error("add_treat", name=treat_name, cost=treat_cost):
+                    st.error(f"❌ {error}")
                 else:
-                    data["treats"][treat_name] = treat_cost
-                    save_data(data)
+                    commit("add_treat", name=treat_name, cost=treat_cost)
                     st.success(f"Đã tạo treat: {treat_name}")
-                    st.rerun()
+                    rerun_tab()
+
+    # -------- NHẬP HÀNG LOẠT --------
+    # toggle thay cho expander: nội dung expander luôn bị chạy dù đang đóng
+    if st.toggle("📥 Nhập task / treat từ file"):
+        render_bulk_import()
+
+
+def render_bulk_import():
+    st.caption(
+        "CSV có header `name,points` (task) hoặc `name,cost` (treat), "
+        "hoặc JSON / NDJSON với cùng field. Points / giá như slider ở trên."
+    )
+
+    with st.form("bulk_import", clear_on_submit=True):
+        kind = st.radio(
+            "Loại",
+            list(IMPORT_KINDS),
+            format_func={"tasks": "📜 Task", "treats": "🎁 Treat"}.get,
+            horizontal=True
+        )
+        upload = st.file_uploader("File", type=["csv", "json", "ndjson", "jsonl"])
+
+        if st.form_submit_button("📥 Nhập") and upload is not None:
+            try:
+                items = parse_import(upload, upload.name, kind)
+            except ImportFileError as e:
+                st.error("❌ File không hợp lệ, chưa nhập gì:\n\n" + "\n".join(f"- {m}" for m in e.errors))
+                return
+
+            # cả file = một event
+            commit(f"add_{kind}", **{kind: items})
+            st.success(f"Đã nhập {len(items)} {'task' if kind == 'tasks' else 'treat'}")
+            rerun_tab()
+
+TABS = {
+    "⚔️ Task": render_task_tab,
+    "🎁 Treat": render_treat_tab,
+    "📦 Rương": render_chest_tab,
+    "🎒 Túi đồ": render_inventory_tab,
+    "🛠️ Rèn": render_armory_tab,
+    "🍻 Tavern": render_tavern_tab,
+    "📊 Thống kê": render_analytics_tab,
+    "⚙️ Forge": render_forge_tab,
+    "🏅 Leaderboard": render_leaderboard_tab,
+    "🏆 ACHIEVEMENTS": render_achievements_tab,
+}
+
+active_tab = st.radio(
+    "Tab",
+    list(TABS),
+    horizontal=True,
+    label_visibility="collapsed",
+    key="active_tab"
+)
+TABS[active_tab]()
+
+rerun_metrics = metrics.finish_rerun()
+
+# ================= DEBUG PANEL (ẩn, mở bằng ?debug=1) =================
+if st.query_params.get("debug") == "1" and rerun_metrics:
+    with st.sidebar.expander("🔧 Debug rerun", expanded=True):
+        st.write(f"⏱️ Tổng: {rerun_metrics['total_ms']:.1f} ms")
+        st.dataframe(
+            [{"phần": k, "ms": round(v, 2)} for k, v in rerun_metrics["spans"].items()],
+            width="stretch"
+        )
+        st.write(f"📡 Request: {sum(rerun_metrics['requests'].values())} {rerun_metrics['requests']}")
+        st.write(
+            f"📦 Gửi {rerun_metrics['bytes_sent']:,} B · "
+            f"Nhận {rerun_metrics['bytes_received']:,} B"
+        )
+        pending = getattr(storage, "pending", None)
+        if pending:
+            st.write(f"📝 Journal chờ đẩy: {pending()}")
+        stuck = getattr(storage, "stuck", None)
+        for pid, (count, error) in (stuck() if stuck else {}).items():
+            st.write(f"🧱 Journal kẹt: {pid[:8]} lỗi {count} lần ({error!r})")
+        st.download_button(
+            "⬇️ Prometheus metrics",
+            metrics.prometheus_text(),
+            file_name="grind_metrics.prom",
+            mime="text/plain"
+        )
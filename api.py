@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import game
+from engine import ActionError, ConflictError, dumps, read_player, run_actions
+from storage import make_storage_from_env
+
+# ================= JSON API =================
+# HTTP/JSON cục bộ cho tích hợp (habit tracker, script, bot): gọi action mà
+# không cần rerun Streamlit. Mỗi request = một lần tải state + một lần ghi.
+#
+#   GET  /players/<id>                 → {"seq", "data", "energy"}, chỉ đọc (404 nếu chưa có)
+#   POST /players/<id>/actions         body: {"type": "complete_tasks", "args": {"names": ["Gym"]}}
+#                                      hoặc batch: {"actions": [{...}, {...}]}
+#                                      → {"seq", "results", "unlocked"}
+#
+# Tên action + tham số giống game.ACTIONS. Có GRIND_API_TOKEN (hoặc --token)
+# thì mọi request phải gửi "Authorization: Bearer <token>".
+#
+#   python api.py --backend sqlite --path grind.db --port 8502
+#   curl -XPOST localhost:8502/players/$ID/actions -d '{"type": "open_chest"}'
+
+MAX_BATCH = 500
+MAX_BODY = 1 << 20
+
+PLAYER_PATH = re.compile(r"^/players/([^/]+)$")
+ACTIONS_PATH = re.compile(r"^/players/([^/]+)/actions$")
+
+# request cùng player xếp hàng thay vì đua nhau ghi rồi retry;
+# player_id → [lock, số request đang giữ / chờ], hết request thì bỏ khỏi dict
+_player_locks = {}
+_locks_guard = threading.Lock()
+
+
+@contextmanager
+def player_lock(player_id):
+    with _locks_guard:
+        entry = _player_locks.setdefault(player_id, [threading.Lock(), 0])
+        entry[1] += 1
+
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _player_locks[player_id]
+
+
+class Handler(BaseHTTPRequestHandler):
+    store = None
+    token = None
+
+    def send_json(self, status, body):
+        payload = dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def server_error(self, e):
+        # lỗi không lường trước (backend sập...): log đủ traceback, client chỉ nhận 500
+        traceback.print_exception(e, file=sys.stderr)
+        self.send_json(500, {"error": "Lỗi server, thử lại sau"})
+
+    def authorized(self):
+        if not self.token:
+            return True
+        if self.headers.get("Authorization") == f"Bearer {self.token}":
+            return True
+
+        self.send_json(401, {"error": "Sai hoặc thiếu token"})
+        return False
+
+    def read_body(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError as e:
+            raise ActionError("Content-Length không hợp lệ") from e
+        if length > MAX_BODY:
+            raise ActionError("Body quá lớn")
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            raise ActionError(f"JSON không hợp lệ: {e}") from e
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+
+        match = PLAYER_PATH.match(self.path)
+        if not match:
+            return self.send_json(404, {"error": "Không có endpoint này"})
+
+        try:
+            player = read_player(self.store, match.group(1))
+        except Exception as e:
+            return self.server_error(e)
+
+        if player is None:
+            return self.send_json(404, {"error": "Không có player này"})
+
+        self.send_json(200, {
+            "seq": player["head"],
+            "data": player["data"],
+            "energy": game.current_energy(player["data"], time.time())
+        })
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+
+        match = ACTIONS_PATH.match(self.path)
+        if not match:
+            return self.send_json(404, {"error": "Không có endpoint này"})
+        player_id = match.group(1)
+
+        try:
+            body = self.read_body()
+            if not isinstance(body, dict):
+                raise ActionError("Body phải là object")
+
+            actions = body["actions"] if "actions" in body else [body]
+            if not isinstance(actions, list) or not 0 < len(actions) <= MAX_BATCH:
+                raise ActionError(f"actions phải là list 1–{MAX_BATCH} phần tử")
+
+            with player_lock(player_id):
+                result = run_actions(self.store, player_id, actions)
+
+        except ActionError as e:
+            return self.send_json(400, {"error": str(e)})
+        except ConflictError as e:
+            return self.send_json(409, {"error": str(e)})
+        except Exception as e:
+            return self.server_error(e)
+
+        self.send_json(200, result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON API cho action của The Grind RPG")
+    parser.add_argument("--backend", choices=["supabase", "sqlite", "memory"], default="supabase")
+    parser.add_argument("--path", default="grind.db", help="file SQLite (backend sqlite)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--token", default=os.environ.get("GRIND_API_TOKEN"))
+    args = parser.parse_args()
+
+    Handler.store = make_storage_from_env(args.backend, args.path)
+    Handler.token = args.token
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"API chạy tại http://{args.host}:{args.port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
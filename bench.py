@@ -0,0 +1,299 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# ================= BENCHMARK RERUN =================
+# Chạy 3linhtinh.py headless bằng streamlit.testing.v1.AppTest trên một
+# storage local (SQLite tạm), đo thời gian từng rerun / từng action với
+# player giả có lịch sử từ 0 → 100k task. Kết quả ghi ra JSON.
+# Kèm thời gian import (python -X importtime) của những gì app tải lúc khởi
+# động và những gì chỉ tải khi cần.
+#
+#   python bench.py --sizes 0 1000 100000 --repeat 5 --out bench.json
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "3linhtinh.py")
+PLAYER_ID = "bench-player"
+DEFAULT_SIZES = [0, 100, 1000, 10000, 100000]
+
+# module 3linhtinh.py import ở đầu file / chỉ import khi render (Analytics) hoặc khi tạo storage
+STARTUP_IMPORTS = ["streamlit", "metrics", "storage", "codec", "game", "eventlog", "migrations"]
+LAZY_IMPORTS = ["plotly.express", "supabase"]
+
+
+def synthetic_player(repeat):
+    # document ở schema mới nhất (như sau migrations.MIGRATIONS): rollup dựng
+    # sẵn trong seed(), lần tải đầu không phải migrate / đọc cả lịch sử
+    from game import new_player
+
+    data = new_player(time.time())
+    data.update({
+        "points": 1_000_000,
+        "total_points": 1_000_000,
+        "energy": 290,
+        "tasks": {f"bench_{i}": 20 for i in range(repeat)},
+        "inventory": {"mana_potion": 2 * repeat},
+        "max_slots": 4 * repeat + 3,
+        "equips": {"sword": 1, "boots": 20},
+    })
+    return data
+
+
+def synthetic_history(size):
+    # trải đều trên ~1 năm để groupby theo ngày có nhiều nhóm
+    start = datetime.now() - timedelta(days=365)
+    step = timedelta(days=365) / max(size, 1)
+    return [
+        {
+            "name": f"task_{i % 50}",
+            "points": 10 + 5 * (i % 9),
+            "date": (start + step * i).strftime("%Y-%m-%d %H:%M"),
+        }
+        for i in range(size)
+    ]
+
+
+def seed(store, size, repeat):
+    from game import RECENT_HISTORY, build_rollups, rebuild_streak
+    from migrations import needs_migration
+
+    data = synthetic_player(repeat)
+    history = synthetic_history(size)
+
+    data["recent_history"] = history[-RECENT_HISTORY:]
+    data["tasks_done"] = size
+    data["rollups"] = build_rollups(history)
+    rebuild_streak(data)
+    assert not needs_migration(data)
+
+    store.delete_history(PLAYER_ID)
+    head = store.get_head(PLAYER_ID)
+    if head is None:
+        store.insert_player(PLAYER_ID, data)
+    else:
+        # snapshot mới đứng sau mọi event của lần seed trước → không bị replay
+        store.update_player(PLAYER_ID, data, store.get_version(PLAYER_ID), head + 1)
+    store.append_history("task_history", PLAYER_ID, history)
+
+
+def remote_completion(store):
+    # giả lập một session khác vừa ghi: thêm 1 row lịch sử + 1 event mới
+    from eventlog import new_event
+
+    head = store.get_head(PLAYER_ID)
+    store.append_history("task_history", PLAYER_ID, synthetic_history(1))
+    store.append_event(PLAYER_ID, {
+        **new_event("add_task", name=f"remote_{head}", points=20),
+        "seq": head + 1
+    })
+
+
+def timed(fn):
+    # → (ms, các bản ghi metrics của những rerun chạy trong lần đo này)
+    path = os.environ["METRICS_NDJSON"]
+    offset = os.path.getsize(path) if os.path.exists(path) else 0
+
+    start = time.perf_counter()
+    at = fn()
+    elapsed = (time.perf_counter() - start) * 1000
+
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+
+    with open(path, encoding="utf-8") as f:
+        f.seek(offset)
+        records = [json.loads(line) for line in f if line.strip()]
+    return elapsed, records
+
+
+def open_tab(at, label):
+    # chỉ tab đang chọn được render → chọn tab trước khi bấm nút trong đó
+    at.radio(key="active_tab").set_value(label).run()
+
+
+def button(at, label_prefix):
+    return next(b for b in at.button if b.label.startswith(label_prefix))
+
+
+def summarize(samples):
+    ordered = sorted(ms for ms, _ in samples)
+    stats = {
+        "runs": len(ordered),
+        "median_ms": round(statistics.median(ordered), 3),
+        "p90_ms": round(ordered[min(len(ordered) - 1, int(0.9 * len(ordered)))], 3),
+        "min_ms": round(ordered[0], 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+    # breakdown từ instrumentation: median theo từng lần đo (cộng mọi rerun trong lần đó)
+    per_run = []
+    for _, records in samples:
+        spans, requests = {}, 0
+        sent = received = 0
+        for r in records:
+            for name, ms in r["spans"].items():
+                spans[name] = spans.get(name, 0) + ms
+            requests += sum(r["requests"].values())
+            sent += r["bytes_sent"]
+            received += r["bytes_received"]
+        per_run.append((spans, requests, sent, received))
+
+    names = sorted({name for spans, *_ in per_run for name in spans})
+    stats["spans_median_ms"] = {
+        name: round(statistics.median(spans.get(name, 0) for spans, *_ in per_run), 3)
+        for name in names
+    }
+    stats["requests_median"] = statistics.median(r[1] for r in per_run)
+    stats["bytes_sent_median"] = statistics.median(r[2] for r in per_run)
+    stats["bytes_received_median"] = statistics.median(r[3] for r in per_run)
+    return stats
+
+
+def import_time(modules, top=10):
+    # import trong interpreter mới với -X importtime, tổng hợp từ stderr:
+    #   import time: self [us] | cumulative | imported package
+    code = (
+        "import importlib, sys\n"
+        f"for m in {modules!r}:\n"
+        "    try: importlib.import_module(m)\n"
+        "    except ImportError: print('missing', m, file=sys.stdout)\n"
+    )
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, cwd=os.path.dirname(APP)
+    )
+    wall = (time.perf_counter() - start) * 1000
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((name.rstrip(), int(self_us), int(cumulative)))
+
+    # package cấp cao nhất (không thụt lề) = cái thật sự được import từ đầu
+    roots = [(name.strip(), cum) for name, _, cum in rows if not name.startswith("  ")]
+    slowest = sorted(rows, key=lambda r: r[1], reverse=True)[:top]
+
+    return {
+        "process_ms": round(wall, 1),
+        "total_ms": round(sum(cum for _, cum in roots) / 1000, 1),
+        "modules": len(rows),
+        "missing": [line.split()[1] for line in proc.stdout.splitlines() if line.startswith("missing")],
+        "top_level_ms": {
+            name: round(cum / 1000, 1)
+            for name, cum in sorted(roots, key=lambda r: r[1], reverse=True)[:top]
+        },
+        "slowest_self_ms": {name.strip(): round(us / 1000, 1) for name, us, _ in slowest},
+    }
+
+
+def bench_size(store, size, repeat, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    seed(store, size, repeat)
+
+    at = AppTest.from_file(APP, default_timeout=timeout)
+    at.session_state["player_id"] = PLAYER_ID
+
+    samples = {}
+
+    def measure(name, fn):
+        samples.setdefault(name, []).append(timed(fn))
+
+    # ===== COLD START: session mới, chưa có cache =====
+    measure("cold_start", at.run)
+
+    for i in range(repeat):
+        open_tab(at, "⚔️ Task")
+        measure("warm_rerun", at.run)
+        measure("complete_task", lambda: at.button(key=f"done_bench_{i}").click().run())
+
+        open_tab(at, "🎒 Túi đồ")
+        measure("use_item", lambda: at.button(key="use_mana_potion").click().run())
+        measure("sell_item", lambda: at.button(key="sell_mana_potion").click().run())
+
+        open_tab(at, "📦 Rương")
+        measure("open_chest", lambda: button(at, "🔓 MỞ RƯƠNG").click().run())
+
+        open_tab(at, "🛠️ Rèn")
+        measure("forge", lambda: button(at, "Rèn kiếm").click().run())
+
+        open_tab(at, "🍻 Tavern")
+        measure("tavern_buy", lambda: at.button(key="tavern_0").click().run())
+
+        # session khác vừa ghi → rerun phải tải lại state mới rồi vẽ Analytics
+        open_tab(at, "📊 Thống kê")
+        remote_completion(store)
+        at.session_state["player_checked_at"] = 0
+        measure("analytics", at.run)
+
+    return {name: summarize(s) for name, s in samples.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo latency mỗi rerun / action của The Grind RPG")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--out", help="file JSON kết quả (mặc định: stdout)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="grind-bench-")
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = os.path.join(workdir, "bench.db")
+    os.environ["METRICS_NDJSON"] = os.path.join(workdir, "metrics.ndjson")
+
+    from storage import make_storage
+
+    store = make_storage("sqlite", path=os.environ["SQLITE_PATH"])
+
+    imports = {
+        "startup": import_time(STARTUP_IMPORTS),
+        "lazy": import_time(LAZY_IMPORTS),
+    }
+    print(
+        f"import: khởi động {imports['startup']['total_ms']} ms, "
+        f"tải khi cần {imports['lazy']['total_ms']} ms",
+        file=sys.stderr
+    )
+
+    results = []
+    for size in args.sizes:
+        random.seed(args.seed)
+        for scenario, stats in bench_size(store, size, args.repeat, args.timeout).items():
+            results.append({"history": size, "scenario": scenario, **stats})
+        print(f"history={size} ✓", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": "sqlite",
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "import_time": imports,
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
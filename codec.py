@@ -0,0 +1,224 @@
+import base64
+import json
+import threading
+import zlib
+from datetime import date, datetime, timedelta
+
+# ================= COMPACT DOCUMENT =================
+# Dạng lưu của document player (players.data, player_snapshots.data).
+# UI và luật chơi chỉ thấy document thường: storage encode khi ghi, decode
+# khi đọc. Document không có "v" là dạng cũ (JSON thường), đọc nguyên trạng.
+#
+# v1:
+#   - tên task / treat / lịch sử gần đây gom vào bảng "s", chỗ dùng lưu index
+#   - list dict → các cột song song ({"n": [...], "p": [...], ...})
+#   - thời gian "%Y-%m-%d %H:%M" → số phút kể từ 1970-01-01 (không múi giờ)
+#   - ngày của rollup → ordinal (lưu hiệu số), tuần "YYYY-Www" → YYYYww
+#   - item trong túi đồ trùng CHEST_ITEMS → index trong CHEST_ITEMS
+#     (CHEST_ITEMS chỉ được thêm vào cuối, không đổi thứ tự)
+# v2:
+#   - túi đồ {item_id: số lượng} → {"i": [index tên], "c": [số lượng]};
+#     túi đồ v1 đọc ra list item id / dict, game.inventory() gộp lại thành stack
+#   - JSON lớn hơn COMPRESS_OVER byte → {"v": VERSION, "z": base64(zlib)}
+VERSION = 2
+COMPRESS_OVER = 2048
+
+# giống game.HISTORY_DATE_FMT (codec được storage import nên không import game:
+# game → metrics → storage → codec sẽ thành import vòng)
+DATE_FMT = "%Y-%m-%d %H:%M"
+
+EPOCH = datetime(1970, 1, 1)
+
+# số byte dạng lưu đã encode / decode trên thread này (metrics đọc qua take_bytes,
+# để không phải encode lại document chỉ để đo)
+_local = threading.local()
+
+
+def _count(n):
+    _local.bytes = getattr(_local, "bytes", 0) + n
+
+
+def take_bytes():
+    # → số byte đếm được từ lần gọi trước, rồi đặt lại về 0
+    n = getattr(_local, "bytes", 0)
+    _local.bytes = 0
+    return n
+
+
+def _minutes(text):
+    return (datetime.strptime(text, DATE_FMT) - EPOCH) // timedelta(minutes=1)
+
+
+def _from_minutes(n):
+    return (EPOCH + timedelta(minutes=n)).strftime(DATE_FMT)
+
+
+def _days(keys):
+    # ngày "YYYY-MM-DD" → ordinal, lưu hiệu số với ngày trước (phần lớn là 1)
+    out, prev = [], 0
+    for key in keys:
+        n = date.fromisoformat(key).toordinal()
+        out.append(n - prev)
+        prev = n
+    return out
+
+
+def _from_days(deltas):
+    out, n = [], 0
+    for delta in deltas:
+        n += delta
+        out.append(date.fromordinal(n).isoformat())
+    return out
+
+
+def _week(text):
+    year, week = text.split("-W")
+    return int(year) * 100 + int(week)
+
+
+def _from_week(n):
+    return f"{n // 100}-W{n % 100:02d}"
+
+
+class _Names:
+    def __init__(self):
+        self.table = []
+        self.index = {}
+
+    def __call__(self, name):
+        if name not in self.index:
+            self.index[name] = len(self.table)
+            self.table.append(name)
+        return self.index[name]
+
+
+def _encode_rollups(rollups):
+    day, week = rollups["day"], rollups["week"]
+    return {
+        "d": _days(day),
+        "dp": [v[0] for v in day.values()],
+        "dn": [v[1] for v in day.values()],
+        "w": [_week(k) for k in week],
+        "wp": [v[0] for v in week.values()],
+        "wn": [v[1] for v in week.values()],
+        "hp": [v[0] for v in rollups["hour"]],
+        "hn": [v[1] for v in rollups["hour"]],
+    }
+
+
+def _decode_rollups(c):
+    return {
+        "day": {k: [p, n] for k, p, n in zip(_from_days(c["d"]), c["dp"], c["dn"])},
+        "week": {_from_week(k): [p, n] for k, p, n in zip(c["w"], c["wp"], c["wn"])},
+        "hour": [[p, n] for p, n in zip(c["hp"], c["hn"])],
+    }
+
+
+def _chest_items():
+    from game import CHEST_ITEMS  # import muộn, xem DATE_FMT
+    return CHEST_ITEMS
+
+
+def encode(data):
+    # document → dạng compact (dict JSON được)
+    doc = dict(data)
+    names = _Names()
+    out = {"v": VERSION}
+
+    if "tasks" in doc:
+        tasks = doc.pop("tasks")
+        out["tasks"] = {"n": [names(k) for k in tasks], "p": list(tasks.values())}
+
+    if "treats" in doc:
+        treats = doc.pop("treats")
+        out["treats"] = {"n": [names(k) for k in treats], "c": list(treats.values())}
+
+    if "recent_history" in doc:
+        recent = doc.pop("recent_history")
+        out["recent_history"] = {
+            "n": [names(r["name"]) for r in recent],
+            "p": [r["points"] for r in recent],
+            "t": [_minutes(r["date"]) for r in recent],
+        }
+
+    if "rollups" in doc:
+        out["rollups"] = _encode_rollups(doc.pop("rollups"))
+
+    if isinstance(doc.get("inventory"), dict):
+        stacks = doc.pop("inventory")
+        out["inventory"] = {"i": [names(k) for k in stacks], "c": list(stacks.values())}
+
+    out["s"] = names.table
+    out.update(doc)  # các key còn lại giữ nguyên
+    return out
+
+
+def decode(doc):
+    # dạng lưu (compact hoặc JSON cũ) → document
+    if not isinstance(doc, dict) or "v" not in doc:
+        return doc
+
+    if "z" in doc:
+        _count(len(doc["z"]) + 16)
+        doc = json.loads(zlib.decompress(base64.b64decode(doc["z"])))
+    else:
+        # chưa nén thì nhỏ hơn COMPRESS_OVER, dumps lại rất rẻ
+        _count(len(json.dumps(doc, ensure_ascii=False, separators=(",", ":")).encode("utf-8")))
+
+    data = dict(doc)
+    del data["v"]
+    names = data.pop("s", [])
+
+    if "tasks" in data:
+        c = data["tasks"]
+        data["tasks"] = {names[i]: p for i, p in zip(c["n"], c["p"])}
+
+    if "treats" in data:
+        c = data["treats"]
+        data["treats"] = {names[i]: cost for i, cost in zip(c["n"], c["c"])}
+
+    if "recent_history" in data:
+        c = data["recent_history"]
+        data["recent_history"] = [
+            {"name": names[i], "points": p, "date": _from_minutes(t)}
+            for i, p, t in zip(c["n"], c["p"], c["t"])
+        ]
+
+    if "rollups" in data:
+        data["rollups"] = _decode_rollups(data["rollups"])
+
+    inventory = data.get("inventory")
+    if isinstance(inventory, dict):
+        data["inventory"] = {names[i]: n for i, n in zip(inventory["i"], inventory["c"])}
+    elif isinstance(inventory, list):
+        # v1: index trong bảng rơi của rương
+        catalog = _chest_items()
+        data["inventory"] = [catalog[it] if isinstance(it, int) else it for it in inventory]
+
+    return data
+
+
+def pack(data):
+    # document → (dạng lưu, chuỗi JSON của nó); nén nếu JSON lớn
+    doc = encode(data)
+    text = json.dumps(doc, ensure_ascii=False, separators=(",", ":"))
+
+    if len(text) > COMPRESS_OVER:
+        packed = base64.b64encode(zlib.compress(text.encode("utf-8"), 6)).decode("ascii")
+        doc = {"v": VERSION, "z": packed}
+        text = json.dumps(doc, separators=(",", ":"))
+
+    _count(len(text.encode("utf-8")))
+    return doc, text
+
+
+def dumps(data):
+    return pack(data)[1]
+
+
+def loads(text):
+    # decode() đếm lại từ dict: bỏ phần đó, đếm đúng độ dài chuỗi đã lưu
+    before = getattr(_local, "bytes", 0)
+    data = decode(json.loads(text))
+    _local.bytes = before + len(text.encode("utf-8"))
+    return data
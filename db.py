@@ -1,16 +1,74 @@
-from supabase import create_client
+import os
 import streamlit as st
 import uuid
+import metrics
+from journal import JournaledStorage
+from storage import CONNECT_TIMEOUT, POOL_SIZE, READ_RETRIES, READ_TIMEOUT, make_storage
 
-SUPABASE_URL = st.secrets["SUPABASE_URL"]
-SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+def get_config(key, default=None):
+    # biến môi trường ưu tiên hơn st.secrets
+    if key in os.environ:
+        return os.environ[key]
+    try:
+        return st.secrets.get(key, default)
+    except Exception:  # không có secrets.toml
+        return default
 
-if "player_id" not in st.session_state:
-    st.session_state.player_id = str(uuid.uuid4())
 
-PLAYER_ID = st.session_state.player_id
+# "supabase" (mặc định, cần SUPABASE_URL + SUPABASE_KEY), "sqlite" (SQLITE_PATH) hoặc "memory"
+# Supabase tuỳ chọn: SUPABASE_CONNECT_TIMEOUT / SUPABASE_READ_TIMEOUT (giây),
+# SUPABASE_POOL_SIZE, SUPABASE_READ_RETRIES; JOURNAL_PATH (file SQLite) bật write-ahead journal
+STORAGE_BACKEND = get_config("STORAGE_BACKEND", "supabase")
+
+
+@st.cache_resource
+def get_storage():
+    # dùng chung cho mọi session của process (memory backend cần điều này)
+    if STORAGE_BACKEND == "supabase":
+        inner = make_storage(
+            "supabase",
+            url=get_config("SUPABASE_URL"),
+            key=get_config("SUPABASE_KEY"),
+            connect_timeout=get_config("SUPABASE_CONNECT_TIMEOUT", CONNECT_TIMEOUT),
+            read_timeout=get_config("SUPABASE_READ_TIMEOUT", READ_TIMEOUT),
+            pool_size=get_config("SUPABASE_POOL_SIZE", POOL_SIZE),
+            read_retries=get_config("SUPABASE_READ_RETRIES", READ_RETRIES)
+        )
+    else:
+        inner = make_storage(STORAGE_BACKEND, path=get_config("SQLITE_PATH", "grind.db"))
+
+    # đếm request + byte cho từng rerun
+    store = metrics.InstrumentedStorage(inner)
+
+    # có JOURNAL_PATH: ghi vào journal local trước, thread nền đẩy lên backend sau
+    journal_path = get_config("JOURNAL_PATH")
+    if journal_path:
+        store = JournaledStorage(store, journal_path)
+    return store
+
 
+class LazyStorage:
+    # storage (client Supabase / file SQLite) chỉ được tạo ở lần gọi đầu tiên,
+    # không phải lúc import; sau đó dùng thẳng instance cache của process
+    def __init__(self):
+        self._storage = None
 
+    def __getattr__(self, name):
+        if self._storage is None:
+            self._storage = get_storage()
+        return getattr(self._storage, name)
 
+
+storage = LazyStorage()
+
+# NDJSON từng rerun / file Prometheus (textfile collector), bỏ trống = tắt
+metrics.configure(
+    ndjson_path=get_config("METRICS_NDJSON"),
+    prom_path=get_config("METRICS_PROM_FILE")
+)
+
+if "player_id" not in st.session_state:
+    st.session_state.player_id = str(uuid.uuid4())
+
+PLAYER_ID = st.session_state.player_id
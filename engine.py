@@ -0,0 +1,167 @@
+import json
+import time
+
+import game
+from eventlog import SNAPSHOT_EVERY, apply_event, new_event, replay
+from game import ActionError
+from migrations import migrate, needs_migration
+
+# ================= ENGINE HEADLESS =================
+# Tải / chạy action / ghi cho code không có Streamlit (api.py, script, bot):
+# cùng luật (game.ACTIONS) và cùng action log như UI, nhưng cả một batch
+# action chỉ tốn một lần tải state và một lần ghi (storage.append_events).
+# Session Streamlit đang mở thấy event mới qua get_head như với tab khác.
+
+MAX_RETRIES = 5
+
+
+class ConflictError(Exception):
+    # player bị ghi liên tục từ nơi khác, hết số lần thử lại
+    pass
+
+
+def load_player(store, player_id):
+    # → {"data", "head", "snapshot"}: state hiện tại, seq mới nhất, seq của players.data
+    row = store.get_player(player_id)
+
+    if row is not None:
+        data, version = row
+        changed = False
+    else:
+        data = game.new_player(time.time())
+        version = 0
+        changed = True
+        store.insert_player(player_id, data, version)
+
+    if needs_migration(data):
+        changed = migrate(data, store, player_id)
+
+    # session khác đã ghi snapshot mới hơn thì thôi, event vẫn đủ để dựng lại
+    if changed and store.update_player(player_id, data, version, version):
+        store.save_snapshot(player_id, version, data)
+
+    events = store.read_events(player_id, version)
+    replay(store, player_id, data, events)
+
+    return {
+        "data": data,
+        "head": events[-1]["seq"] if events else version,
+        "snapshot": version
+    }
+
+
+def read_player(store, player_id):
+    # như load_player nhưng chỉ đọc: không tạo player, không lưu migrate / snapshot
+    # → {"data", "head", "snapshot"}, hoặc None nếu chưa có player
+    row = store.get_player(player_id)
+    if row is None:
+        return None
+
+    data, version = row
+    if needs_migration(data):
+        # history trong blob cũ chỉ chuyển sang bảng khi tải để ghi (load_player)
+        migrate(data, _NoHistoryWrites(store), player_id)
+
+    events = store.read_events(player_id, version)
+    replay(store, player_id, data, events)
+
+    return {
+        "data": data,
+        "head": events[-1]["seq"] if events else version,
+        "snapshot": version
+    }
+
+
+class _NoHistoryWrites:
+    # storage cho migrate khi chỉ đọc: đọc bình thường, bỏ ghi history
+    def __init__(self, store):
+        self.store = store
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def append_history(self, table, player_id, rows):
+        pass
+
+
+def parse_actions(actions):
+    # [{"type": ..., "args": {...}}] → list event, kiểm tra trước khi tải gì
+    events = []
+    for i, action in enumerate(actions):
+        if not isinstance(action, dict):
+            raise ActionError(f"action #{i}: phải là object")
+
+        type_ = action.get("type")
+        args = action.get("args", {})
+        if type_ not in game.ACTIONS and type_ != "restore":
+            raise ActionError(f"action #{i}: không có action {type_!r}")
+        if not isinstance(args, dict):
+            raise ActionError(f"action #{i}: args phải là object")
+        try:
+            game.check_action(type_, args)
+        except ActionError as e:
+            raise ActionError(f"action #{i} ({type_}): {e}") from e
+
+        events.append(new_event(type_, **args))
+    return events
+
+
+def run_actions(store, player_id, actions):
+    # chạy lần lượt các action trên một state rồi ghi mọi event trong một lần;
+    # seq đã bị ghi ở nơi khác → tải lại và chạy lại đúng các event đó (cùng seed)
+    # → {"seq", "results", "unlocked"}
+    events = parse_actions(actions)
+
+    for _ in range(MAX_RETRIES):
+        player = load_player(store, player_id)
+        d, head = player["data"], player["head"]
+        unlocked = set(d.get("achievements", []))
+        stats = game.leaderboard_stats(d)
+
+        written, results, history = [], [], []
+        for i, event in enumerate(events):
+            before = json.dumps(d, sort_keys=True)
+            try:
+                result, rows = apply_event(store, player_id, d, event)
+            except (ActionError, TypeError, KeyError, ValueError, LookupError) as e:
+                raise ActionError(f"action #{i} ({event['type']}): {e}") from e
+            results.append(result)
+
+            # ===== KHÔNG ĐỔI GÌ → KHÔNG GHI =====
+            if json.dumps(d, sort_keys=True) != before:
+                d["last_updated"] = event["ts"]
+                written.append({**event, "seq": head + len(written) + 1})
+                history.extend(rows)
+
+        if not store.append_events(player_id, written):
+            continue
+
+        seq = head + len(written)
+        if seq // SNAPSHOT_EVERY > head // SNAPSHOT_EVERY:
+            if store.update_player(player_id, d, player["snapshot"], seq):
+                store.save_snapshot(player_id, seq, d)
+
+        for table in dict.fromkeys(t for t, _ in history):
+            store.append_history(table, player_id, [row for t, row in history if t == table])
+
+        if game.leaderboard_stats(d) != stats:
+            store.update_leaderboard(player_id, game.leaderboard_stats(d))
+
+        return {
+            "seq": seq,
+            "results": results,
+            "unlocked": [k for k in d.get("achievements", []) if k not in unlocked]
+        }
+
+    raise ConflictError("Dữ liệu đang bị ghi liên tục từ nơi khác, thử lại sau")
+
+
+def _jsonable(obj):
+    # kết quả action có thể chứa dict luật chơi (vd. debuff kèm hàm "apply")
+    if callable(obj):
+        return None
+    raise TypeError(f"{type(obj).__name__} không chuyển sang JSON được")
+
+
+def dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, default=_jsonable)
@@ -0,0 +1,96 @@
+import json
+import random
+import time
+
+import game
+
+# ================= ACTION LOG =================
+# State của player = snapshot (players.data, version = seq đã gộp) + replay
+# các event có seq lớn hơn. Mỗi action chỉ ghi một event nhỏ
+#   {"seq", "type", "args", "seed", "ts"}
+# seed + ts làm action tất định: replay cho ra đúng state như lúc chơi.
+# Cứ SNAPSHOT_EVERY event thì ghi snapshot mới để replay luôn ngắn.
+SNAPSHOT_EVERY = 50
+
+
+def new_event(type_, **args):
+    return {
+        "type": type_,
+        "args": args,
+        "seed": random.getrandbits(31),
+        "ts": time.time()
+    }
+
+
+def apply_event(store, player_id, d, event):
+    # → (kết quả, row lịch sử cần insert)
+    if event["type"] != "restore":
+        return game.run_action(d, event)
+
+    # khôi phục về state ngay sau event args["seq"] (vd. trước một lần Reset nhầm)
+    restored = state_at(store, player_id, event["args"]["seq"])
+    d.clear()
+    d.update(restored)
+    return True, []
+
+
+def replay(store, player_id, d, events):
+    for event in events:
+        apply_event(store, player_id, d, event)
+        d["last_updated"] = event["ts"]
+    return d
+
+
+def state_at(store, player_id, seq):
+    # snapshot gần nhất <= seq + các event tới seq
+    row = store.get_snapshot(player_id, seq)
+    if row is None:
+        # player có từ trước khi có action log: snapshot duy nhất là players.data
+        player = store.get_player(player_id)
+        if player is not None and player[1] <= seq:
+            row = player
+    if row is None:
+        raise LookupError(f"Không có snapshot nào tại hoặc trước event #{seq}")
+
+    data, snapshot_seq = row
+    return replay(store, player_id, data, store.read_events(player_id, snapshot_seq, seq))
+
+
+def commit_event(store, player_id, d, event, head, snapshot_seq):
+    # cho code chạy ngoài Streamlit: chạy event trên d rồi ghi với seq = head + 1
+    # → (seq mới, kết quả, row lịch sử); không đổi gì → seq = head;
+    #   seq đã có người ghi → (None, None, []) và d đã bị sửa, phải tải lại
+    before = json.dumps(d, sort_keys=True)
+    result, history = apply_event(store, player_id, d, event)
+    if json.dumps(d, sort_keys=True) == before:
+        return head, result, []
+
+    d["last_updated"] = event["ts"]
+    seq = head + 1
+    if not store.append_event(player_id, {**event, "seq": seq}):
+        return None, None, []
+
+    if seq % SNAPSHOT_EVERY == 0 and store.update_player(player_id, d, snapshot_seq, seq):
+        store.save_snapshot(player_id, seq, d)
+    return seq, result, history
+
+
+EVENT_LABELS = {
+    "complete_tasks": "⚔️ Hoàn thành task",
+    "add_task": "📜 Tạo task",
+    "add_treat": "🎁 Tạo treat",
+    "add_tasks": "📥 Nhập task",
+    "add_treats": "📥 Nhập treat",
+    "delete_treat": "🗑️ Xoá treat",
+    "claim_treat": "🎉 Nhận treat",
+    "open_chest": "📦 Mở rương",
+    "buy_slot": "➕ Mua ô túi đồ",
+    "use_item": "🧪 Dùng item",
+    "sell_item": "💰 Bán item",
+    "forge": "🛠️ Rèn",
+    "buy_tavern": "🍻 Tavern",
+    "reset": "🗑️ Reset",
+    "maintain": "🔧 Bảo trì",
+    "boss_reset": "🐉 Boss hồi máu",
+    "restore": "⏪ Khôi phục",
+}
@@ -0,0 +1,824 @@
+import copy
+import random
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+
+import metrics
+
+# ================= GAME RULES =================
+# Luật chơi thuần Python, không đụng tới Streamlit hay storage: nhận state
+# (dict), sửa tại chỗ và trả về kết quả để UI hiển thị.
+
+BOSS_MAX_HP = 1000
+TASK_ENERGY_COST = 10
+
+BASE_MAX_ENERGY = 100
+MAX_ENERGY_PER_BOOTS = 10
+ENERGY_REGEN_SECONDS = 120  # +1⚡ mỗi 2 phút
+
+RECENT_HISTORY = 5
+HISTORY_DATE_FMT = "%Y-%m-%d %H:%M"
+
+# giờ của game (buff theo giờ, giá tavern, ngày trong lịch sử, streak): cố định
+# UTC+7, không theo múi giờ của máy chạy → replay event ở đâu cũng ra cùng kết quả.
+# Đổi giá trị này là đổi kết quả replay của event cũ.
+GAME_TZ = timezone(timedelta(hours=7))
+
+CHEST_COST = 50
+CHEST_CURSE_CHANCE = 0.2
+SELL_PRICE = max(5, int(0.3 * CHEST_COST))  # bán rẻ
+FORGE_PRICES = {"sword": 100, "boots": 150}  # giá mỗi level
+
+# task / treat: loại → (field giá trị, min, max, bước), khớp slider ở tab Forge;
+# dùng chung cho action add_* và file import (transfer.py)
+IMPORT_KINDS = {
+    "tasks": ("points", 10, 50, 5),
+    "treats": ("cost", 50, 100, 5),
+}
+MAX_IMPORT = 1000
+MAX_NAME = 100
+
+# số migration đã áp dụng lên document (xem migrations.py)
+SCHEMA_VERSION = 5
+
+DEFAULT_DATA = {
+    "schema_version": SCHEMA_VERSION,
+
+    "points": 0,
+    "energy": 100,
+    "boss_hp": 1000,
+    "boss_kills": 0,
+
+    "tasks": {},
+    "recent_history": [],
+    "tasks_done": 0,
+
+    "treats": {},
+    "treats_claimed": 0,
+
+    "inventory": {},
+    "max_slots": 3,
+
+    "equips": {
+        "sword": 1,
+        "boots": 1
+    },
+
+    "debuffs": [],
+    "achievements": []
+}
+
+
+def new_player(ts):
+    # deepcopy: các dict / list trong DEFAULT_DATA không được dùng chung giữa các player
+    d = copy.deepcopy(DEFAULT_DATA)
+    d["created_at"] = ts
+    d["energy_at"] = ts
+    d["last_updated"] = ts
+    return d
+
+# ================= ACHIEVEMENTS =================
+# Mỗi achievement khai báo stat nó theo dõi ("boss_kills", "equips.sword"...)
+# và mốc cần đạt. Khi một stat đổi, chỉ các achievement của stat đó được xét
+# (qua ACHIEVEMENT_INDEX), nên catalogue lớn không làm action chậm đi.
+ACHIEVEMENTS = {
+    "dragon_slayer": {
+        "name": "Kẻ Diệt Rồng",
+        "emoji": "🐉",
+        "desc": "Hạ gục 10 Boss",
+        "stat": "boss_kills",
+        "threshold": 7,
+        "reward": lambda d: d.update({
+            "bonus_damage": d.get("bonus_damage", 0) + 10
+        })
+    },
+
+    "millionaire": {
+        "name": "Triệu Phú",
+        "emoji": "💰",
+        "desc": "Tích lũy tổng cộng 5000 pts",
+        "stat": "total_points",
+        "threshold": 5000,
+        "reward": lambda d: d.update({
+            "max_slots": d.get("max_slots", 3) + 2
+        })
+    },
+
+    "iron_discipline": {
+        "name": "Kỷ Luật Thép",
+        "emoji": "🛡️",
+        "desc": "Hoàn thành task liên tục 7 ngày",
+        "stat": "streak",
+        "threshold": 7,
+        "reward": lambda d: d.update({
+            "bonus_max_energy": d.get("bonus_max_energy", 0) + 20
+        })
+    }
+}
+
+
+def build_achievement_index(achievements):
+    # stat → [(mốc, key)] sắp tăng dần
+    index = {}
+    for key, ach in achievements.items():
+        index.setdefault(ach["stat"], []).append((ach["threshold"], key))
+    for entries in index.values():
+        entries.sort()
+    return index
+
+
+ACHIEVEMENT_INDEX = build_achievement_index(ACHIEVEMENTS)
+
+# các stat mà một lần hoàn thành task có thể làm đổi
+TASK_STATS = ("total_points", "tasks_done", "streak", "boss_kills")
+
+DEBUFFS = [
+    {
+        "name": "Mệt Mỏi",
+        "emoji": "😵",
+        "desc": "Task tiếp theo tốn +5 energy",
+        "apply": lambda d, ts: d.__setitem__("next_task_penalty", 5)
+    },
+    {
+        "name": "Chấn Thương",
+        "emoji": "🩸",
+        "desc": "Giảm 20 energy ngay lập tức",
+        "apply": lambda d, ts: d.__setitem__("energy", max(0, d["energy"] - 20))
+    },
+    {
+        "name": "Uể Oải",
+        "emoji": "🐌",
+        "desc": "Giảm 50% sát thương task kế tiếp",
+        "type": "half_damage"
+    },
+    {
+        "name": "Choáng",
+        "emoji": "💫",
+        "desc": "Không hồi energy trong 10 phút",
+        "apply": lambda d, ts: d.__setitem__("energy_block_until", ts + 600)
+    },
+    {
+        "name": "Cám Dỗ",
+        "emoji": "🍩",
+        "desc": "Mất 10 pts vì xao nhãng",
+        "apply": lambda d, ts: d.__setitem__("points", max(0, d["points"] - 10))
+    }
+]
+
+# ================= ITEMS =================
+# Registry item dùng chung cho cả process, khoá bằng id cố định.
+# Túi đồ chỉ lưu {item_id: số lượng}; id không bao giờ được đổi / dùng lại.
+ITEMS = {
+    "mana_potion": {"name": "Mana Potion", "desc": "Hồi 50⚡ energy", "type": "energy", "value": 50},
+    "greater_mana_potion": {"name": "Greater Mana Potion", "desc": "Hồi 100⚡ energy", "type": "energy", "value": 100},
+    "boss_bomb": {"name": "Boss Bomb", "desc": "Gây 200 dmg lên Boss", "type": "damage", "value": 200},
+    "mega_bomb": {"name": "Mega Bomb", "desc": "Gây 400 dmg lên Boss", "type": "damage", "value": 400},
+    "energy_scroll": {"name": "Energy Scroll", "desc": "Tăng energy tối đa +10", "type": "max_energy", "value": 10},
+    "lucky_coin": {"name": "Lucky Coin", "desc": "Nhận thêm 100 pts", "type": "points", "value": 100},
+    "cursed_coin": {"name": "Cursed Coin", "desc": "Mất 50 pts (đen)", "type": "points", "value": -50},
+    "boss_poison": {"name": "Boss Poison", "desc": "Boss mất 10% HP hiện tại", "type": "percent_damage", "value": 0.1},
+    "stimulant": {"name": "Stimulant", "desc": "Hồi 30⚡ energy ngay", "type": "energy", "value": 30},
+    "empty_chest": {"name": "Empty Chest", "desc": "Không có gì… xui 😭", "type": "none", "value": 0},
+}
+
+# bảng rơi của rương (mỗi phần tử cùng tỉ lệ), giữ nguyên thứ tự để seed cũ replay đúng
+CHEST_ITEMS = [
+    "mana_potion", "greater_mana_potion", "boss_bomb", "mega_bomb", "energy_scroll",
+    "lucky_coin", "cursed_coin", "boss_poison", "stimulant", "empty_chest",
+]
+
+# túi đồ cũ lưu nguyên dict item → tìm lại id theo tên
+ITEM_IDS_BY_NAME = {item["name"]: item_id for item_id, item in ITEMS.items()}
+
+TAVERN_ITEMS = [
+    {"name": "Nước Lã", "emoji": "🥛", "cost": 10, "energy": 10},
+    {"name": "Trà Đậm", "emoji": "🍵", "cost": 25, "energy": 25},
+    {"name": "Cà Phê Đen", "emoji": "☕", "cost": 50, "energy": 40},
+    {"name": "Bữa Thịnh Soạn", "emoji": "🍖", "cost": 80, "energy": 70},
+    {"name": "Yến Tiệc Vương Giả", "emoji": "🍗", "cost": 120, "energy": 100},
+]
+
+
+# ================= ENERGY =================
+# Document chỉ lưu energy tại thời điểm energy_at. Energy hiện tại là hàm
+# thuần của (energy, energy_at, max energy, khoá Choáng, thời gian hiện tại),
+# nên đọc không bao giờ phải ghi. Chỉ action tiêu / cộng energy mới đổi state.
+def max_energy(d):
+    boots_lvl = d.get("equips", {}).get("boots", 1)
+    return BASE_MAX_ENERGY + (boots_lvl - 1) * MAX_ENERGY_PER_BOOTS + d.get("bonus_max_energy", 0)
+
+
+def regen_seconds(d, ts):
+    # thời gian được hồi energy kể từ energy_at (trừ đoạn bị khoá)
+    since = d.get("energy_at", ts)
+    elapsed = max(0, ts - since)
+
+    block_until = d.get("energy_block_until", 0)
+    if block_until > since:
+        elapsed -= min(ts, block_until) - since
+
+    return elapsed
+
+
+def current_energy(d, ts):
+    stored = d["energy"]
+    cap = max_energy(d)
+    if stored >= cap:
+        return cap
+
+    ticks = int(regen_seconds(d, ts) // ENERGY_REGEN_SECONDS)
+    return min(cap, stored + ticks)
+
+
+def materialize_energy(d, ts):
+    # gộp phần đã hồi vào state trước khi action đổi energy,
+    # giữ lại phần lẻ của tick đang hồi dở
+    elapsed = regen_seconds(d, ts)
+    ticks = int(elapsed // ENERGY_REGEN_SECONDS)
+    energy = current_energy(d, ts)
+
+    d["energy"] = energy
+    if energy >= max_energy(d) or ts < d.get("energy_block_until", 0):
+        d["energy_at"] = ts
+    else:
+        d["energy_at"] = ts - (elapsed - ticks * ENERGY_REGEN_SECONDS)
+
+    # khoá đã hết hạn thì bỏ, để lần tính sau không trừ đoạn khoá lần nữa
+    if d.get("energy_block_until", 0) <= ts:
+        d.pop("energy_block_until", None)
+
+
+def grant_energy(d, amount, ts):
+    materialize_energy(d, ts)
+    d["energy"] = min(max_energy(d), d["energy"] + amount)
+
+
+def task_modifiers(now):
+    # ⚡ 9–11h: x2 damage · 🌫️ sau 23h: debuff 40% thay vì 20%
+    damage_mult = 2 if 9 <= now.hour < 11 else 1
+    debuff_chance = 0.40 if now.hour >= 23 else 0.20
+    return damage_mult, debuff_chance
+
+
+def task_damage(d, pts, now):
+    return (pts // 2) * d["equips"].get("sword", 1) * task_modifiers(now)[0]
+
+
+def inventory(d):
+    # → {item_id: số lượng}; túi đồ dạng list dict cũ được gộp thành stack tại chỗ
+    items = d.get("inventory")
+    if isinstance(items, dict):
+        return items
+
+    stacks = {}
+    for it in items or []:
+        item_id = it if isinstance(it, str) else ITEM_IDS_BY_NAME.get(it["name"])
+        if item_id in ITEMS:
+            stacks[item_id] = stacks.get(item_id, 0) + 1
+
+    d["inventory"] = stacks
+    return stacks
+
+
+def inventory_size(d):
+    return sum(inventory(d).values())
+
+
+def add_item(d, item_id, count=1):
+    stacks = inventory(d)
+    stacks[item_id] = stacks.get(item_id, 0) + count
+
+
+def remove_item(d, item_id):
+    # → False nếu không còn item này (vd. session khác vừa dùng mất)
+    stacks = inventory(d)
+    if not stacks.get(item_id):
+        return False
+
+    stacks[item_id] -= 1
+    if not stacks[item_id]:
+        del stacks[item_id]
+    return True
+
+
+def leaderboard_stats(d):
+    # các stat được xếp hạng giữa mọi player (bảng leaderboard)
+    return {
+        "total_points": d.get("total_points", 0),
+        "boss_kills": d.get("boss_kills", 0),
+        "tasks_done": d.get("tasks_done", 0)
+    }
+
+
+def tavern_cost(item, now):
+    # 🍻 cuối tuần giảm 50%
+    return int(item["cost"] * (0.5 if now.weekday() >= 5 else 1))
+
+
+def slot_price(d):
+    return 100 + (d.get("max_slots", 3) - 3) * 50
+
+
+def stat_value(d, stat):
+    value = d
+    for part in stat.split("."):
+        value = value.get(part, 0) if isinstance(value, dict) else 0
+    return value
+
+
+@metrics.timed("check_achievements")
+def check_achievements(d, *stats):
+    # gọi ngay sau khi các stat đổi → list key vừa mở khoá
+    unlocked = d.setdefault("achievements", [])
+    seen = set(unlocked)
+    new = []
+
+    for stat in stats:
+        entries = ACHIEVEMENT_INDEX.get(stat)
+        if not entries:
+            continue
+
+        # mọi mốc <= giá trị hiện tại
+        reached = bisect_right(entries, (stat_value(d, stat), chr(0x10FFFF)))
+        for _, key in entries[:reached]:
+            if key in seen:
+                continue
+
+            seen.add(key)
+            unlocked.append(key)
+            new.append(key)
+
+            reward = ACHIEVEMENTS[key].get("reward")
+            if reward:
+                reward(d)
+
+    return new
+
+
+def achievement_progress(d):
+    # → [(key, achievement, % tiến độ 0..1, đã mở)]
+    unlocked = set(d.get("achievements", []))
+    return [
+        (
+            key, ach,
+            1.0 if key in unlocked else min(1.0, stat_value(d, ach["stat"]) / ach["threshold"]),
+            key in unlocked
+        )
+        for key, ach in ACHIEVEMENTS.items()
+    ]
+
+
+# ================= STREAK =================
+# streak = số ngày liên tiếp có hoàn thành task, tính tới streak_day
+def update_streak(d, now):
+    today = now.strftime("%Y-%m-%d")
+    last = d.get("streak_day")
+
+    if last == today:
+        return
+
+    yesterday = (now - timedelta(days=1)).strftime("%Y-%m-%d")
+    d["streak"] = d.get("streak", 0) + 1 if last == yesterday else 1
+    d["streak_day"] = today
+
+
+def rebuild_streak(d):
+    # cho document cũ: chuỗi ngày liên tiếp kết thúc ở ngày hoạt động cuối
+    days = sorted(d.get("rollups", {}).get("day", {}))
+    if not days:
+        return
+
+    streak = 1
+    current = datetime.strptime(days[-1], "%Y-%m-%d")
+    for day in reversed(days[:-1]):
+        previous = datetime.strptime(day, "%Y-%m-%d")
+        if current - previous != timedelta(days=1):
+            break
+        streak += 1
+        current = previous
+
+    d["streak"] = streak
+    d["streak_day"] = days[-1]
+
+
+# ================= HISTORY / ROLLUP =================
+# Rollup: [points, số task] theo ngày / tuần ISO / giờ trong ngày
+def empty_rollups():
+    return {"day": {}, "week": {}, "hour": [[0, 0] for _ in range(24)]}
+
+
+def add_to_rollups(rollups, when, points):
+    year, week, _ = when.isocalendar()
+    buckets = (
+        rollups["day"].setdefault(when.strftime("%Y-%m-%d"), [0, 0]),
+        rollups["week"].setdefault(f"{year}-W{week:02d}", [0, 0]),
+        rollups["hour"][when.hour],
+    )
+    for bucket in buckets:
+        bucket[0] += points
+        bucket[1] += 1
+
+
+def build_rollups(rows):
+    rollups = empty_rollups()
+    for row in rows:
+        add_to_rollups(rollups, datetime.strptime(row["date"], HISTORY_DATE_FMT), row["points"])
+    return rollups
+
+
+def add_history(d, table, row):
+    # phần nằm trong document: recent window + rollup / counter
+    if table == "task_history":
+        d["recent_history"] = (d.get("recent_history", []) + [row])[-RECENT_HISTORY:]
+        add_to_rollups(
+            d.setdefault("rollups", empty_rollups()),
+            datetime.strptime(row["date"], HISTORY_DATE_FMT),
+            row["points"]
+        )
+    else:
+        d["treats_claimed"] = d.get("treats_claimed", 0) + 1
+
+
+# ================= TASK =================
+def complete_task(d, name, now, rng=random):
+    # → None nếu task không còn (đã hoàn thành ở nơi khác), hoặc dict kết quả
+    if name not in d["tasks"]:
+        return None
+
+    pts = d["tasks"][name]
+    result = {"name": name, "unlocked": []}
+
+    # ===== ENERGY COST =====
+    energy_cost = TASK_ENERGY_COST + d.get("next_task_penalty", 0)
+    ts = now.timestamp()
+
+    if current_energy(d, ts) < energy_cost:
+        result["no_energy"] = True
+        return result
+
+    # ===== APPLY COST =====
+    materialize_energy(d, ts)
+    d["energy"] -= energy_cost
+    d.pop("next_task_penalty", None)
+
+    # ===== REWARD =====
+    d["points"] += pts
+    d["total_points"] = d.get("total_points", 0) + pts
+    dmg = task_damage(d, pts, now)
+
+    # ===== RANDOM DEBUFF =====
+    debuff = None
+    if rng.random() < task_modifiers(now)[1]:
+        debuff = rng.choice(DEBUFFS)
+
+        if debuff.get("type") == "half_damage":
+            dmg //= 2
+        else:
+            debuff["apply"](d, ts)
+
+    # ===== DAMAGE =====
+    d["boss_hp"] -= dmg
+
+    # ===== HISTORY =====
+    row = {"name": name, "points": pts, "date": now.strftime(HISTORY_DATE_FMT)}
+    add_history(d, "task_history", row)
+    d["tasks_done"] = d.get("tasks_done", 0) + 1
+    update_streak(d, now)
+
+    # ===== REMOVE TASK =====
+    del d["tasks"][name]
+
+    # ===== BOSS DEAD =====
+    boss_killed = d["boss_hp"] <= 0
+    if boss_killed:
+        d["boss_kills"] += 1
+        d["boss_hp"] = BOSS_MAX_HP
+
+    result.update({
+        "unlocked": check_achievements(d, *TASK_STATS),
+        "points": pts,
+        "damage": dmg,
+        "debuff": debuff,
+        "boss_killed": boss_killed,
+        "history_row": row
+    })
+    return result
+
+
+def complete_tasks(d, names, now, rng=random):
+    # hoàn thành lần lượt từng task, đúng như bấm từng nút một
+    # (cùng thứ tự roll debuff, boss chết giữa chừng thì hồi máu rồi đánh tiếp)
+    results = []
+    for name in names:
+        result = complete_task(d, name, now, rng)
+        if result is not None:
+            results.append(result)
+    return results
+
+
+def game_now(ts=None):
+    # → giờ hiện tại (hoặc của ts) theo GAME_TZ, dạng naive như ngày trong lịch sử
+    if ts is None:
+        return datetime.now(GAME_TZ).replace(tzinfo=None)
+    return datetime.fromtimestamp(ts, GAME_TZ).replace(tzinfo=None)
+
+
+# ================= ACTIONS =================
+# Mọi thay đổi state của player đều là một action có tên, nhận tham số JSON
+# được. Cùng (state, tham số, thời điểm, seed) → cùng kết quả, nên action log
+# replay lại được. Mỗi action: fn(d, ctx, **args) → kết quả cho UI.
+class ActionError(Exception):
+    # action không tồn tại / tham số sai → lỗi của client, không ghi gì
+    pass
+
+
+def check_item(kind, name, value):
+    # tên + giá trị của một task / treat, cùng luật với form Forge và file import
+    field, low, high, step = IMPORT_KINDS[kind]
+
+    if not isinstance(name, str) or not name.strip():
+        raise ActionError("name phải là chuỗi khác rỗng")
+    if len(name) > MAX_NAME:
+        raise ActionError(f"name dài quá {MAX_NAME} ký tự")
+    if (isinstance(value, bool) or not isinstance(value, int)
+            or not low <= value <= high or (value - low) % step):
+        raise ActionError(f"{field} phải là số nguyên từ {low} tới {high}, bước {step}")
+
+
+def check_items(kind, items):
+    if not isinstance(items, dict) or not items:
+        raise ActionError(f"{kind} phải là object {{tên: giá trị}} khác rỗng")
+    if len(items) > MAX_IMPORT:
+        raise ActionError(f"Tối đa {MAX_IMPORT} {kind} mỗi lần ({len(items)})")
+    for name, value in items.items():
+        check_item(kind, name, value)
+
+
+# Kiểm tra tham số chỉ chạy ở chỗ nhận action mới (engine.parse_actions, form
+# Forge), không chạy trong action: replay phải chạy được cả event ghi từ trước
+# khi có luật (vd. tên task dài hơn MAX_NAME).
+def check_int(args, key, low, high):
+    # bool cũng là int trong Python: index=true không được hiểu thành 1
+    value = args.get(key)
+    if isinstance(value, bool) or not isinstance(value, int) or not low <= value < high:
+        raise ActionError(f"{key} phải là số nguyên từ {low} tới {high - 1}")
+
+
+def check_choice(args, key, choices):
+    if not isinstance(args.get(key), str) or args[key] not in choices:
+        raise ActionError(f"{key} phải là một trong {', '.join(choices)}")
+
+
+def check_name(args):
+    if not isinstance(args.get("name"), str):
+        raise ActionError("name phải là chuỗi")
+
+
+def check_names(args):
+    names = args.get("names")
+    if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+        raise ActionError("names phải là list chuỗi")
+
+
+ACTION_CHECKS = {
+    "complete_tasks": check_names,
+    "add_task": lambda args: check_item("tasks", args.get("name"), args.get("points")),
+    "add_treat": lambda args: check_item("treats", args.get("name"), args.get("cost")),
+    "add_tasks": lambda args: check_items("tasks", args.get("tasks")),
+    "add_treats": lambda args: check_items("treats", args.get("treats")),
+    "delete_treat": check_name,
+    "claim_treat": check_name,
+    # "item" (nguyên dict) chỉ có trong event cũ, action mới gửi item_id
+    "use_item": lambda args: check_choice(args, "item_id", ITEMS),
+    "sell_item": lambda args: check_choice(args, "item_id", ITEMS),
+    "forge": lambda args: check_choice(args, "equip", FORGE_PRICES),
+    "buy_tavern": lambda args: check_int(args, "index", 0, len(TAVERN_ITEMS)),
+    "restore": lambda args: check_int(args, "seq", 0, 2 ** 62),
+}
+
+
+def check_action(type_, args):
+    check = ACTION_CHECKS.get(type_)
+    if check is not None:
+        check(args)
+
+
+class ActionContext:
+    def __init__(self, ts, seed):
+        self.ts = ts
+        self.now = game_now(ts)
+        self.rng = random.Random(seed)
+        self.history = []  # (table, row) chờ insert vào bảng lịch sử
+
+    def record_history(self, d, table, row):
+        self.history.append((table, row))
+        add_history(d, table, row)
+
+
+def action_complete_tasks(d, ctx, names):
+    results = complete_tasks(d, names, ctx.now, ctx.rng)
+    for r in results:
+        if "history_row" in r:
+            ctx.history.append(("task_history", r["history_row"]))
+    return results
+
+
+def action_add_task(d, ctx, name, points):
+    d["tasks"][name] = points
+
+
+def action_add_treat(d, ctx, name, cost):
+    d["treats"][name] = cost
+
+
+def action_add_tasks(d, ctx, tasks):
+    # nhập hàng loạt {tên: points}: một event cho cả file (đã kiểm tra ở check_action)
+    d["tasks"].update(tasks)
+
+
+def action_add_treats(d, ctx, treats):
+    d["treats"].update(treats)
+
+
+def action_delete_treat(d, ctx, name):
+    d["treats"].pop(name, None)
+
+
+def action_claim_treat(d, ctx, name):
+    cost = d["treats"].get(name)
+    if cost is None or d["points"] < cost:
+        return False
+
+    d["points"] -= cost
+
+    ctx.record_history(d, "treat_history", {
+        "name": name,
+        "cost": cost,
+        "time": ctx.now.strftime(HISTORY_DATE_FMT)
+    })
+    check_achievements(d, "treats_claimed")
+    return True
+
+
+def action_open_chest(d, ctx):
+    if d["points"] < CHEST_COST:
+        return {"error": "Không đủ points"}
+    if inventory_size(d) >= d["max_slots"]:
+        return {"error": "Túi đồ đã đầy"}
+
+    d["points"] -= CHEST_COST
+    item_id = ctx.rng.choice(CHEST_ITEMS)
+    item = ITEMS[item_id]
+
+    msg = ""
+
+    # rủi ro mất thêm pts
+    if ctx.rng.random() < CHEST_CURSE_CHANCE:
+        lost = ctx.rng.randint(10, 30)
+        d["points"] = max(0, d["points"] - lost)
+        msg += f"💀 Rương bị nguyền! Mất {lost} pts\n"
+
+    if item["type"] == "none":
+        msg += "😢 Rương trống..."
+    else:
+        add_item(d, item_id)
+        msg += f"🎉 Nhận được: {item['name']}\n👉 {item['desc']}"
+
+    d["chests_opened"] = d.get("chests_opened", 0) + 1
+    check_achievements(d, "chests_opened")
+
+    return {"msg": msg}
+
+
+def action_buy_slot(d, ctx):
+    price = slot_price(d)
+    if d["points"] < price:
+        return False
+
+    d["points"] -= price
+    d["max_slots"] += 1
+    return True
+
+
+def action_use_item(d, ctx, item_id=None, item=None):
+    # item: event ghi trước khi có item id (nguyên dict item)
+    if item_id is None:
+        item_id = ITEM_IDS_BY_NAME.get(item["name"])
+    if not remove_item(d, item_id):
+        return None
+
+    item = ITEMS[item_id]
+
+    if item["type"] == "energy":
+        grant_energy(d, item["value"], ctx.ts)
+
+    elif item["type"] == "damage":
+        d["boss_hp"] -= item["value"]
+
+    elif item["type"] == "percent_damage":
+        d["boss_hp"] -= int(d["boss_hp"] * item["value"])
+
+    elif item["type"] == "points":
+        d["points"] = max(0, d["points"] + item["value"])
+
+    elif item["type"] == "max_energy":
+        d.setdefault("bonus_max_energy", 0)
+        d["bonus_max_energy"] += item["value"]
+
+    boss_killed = d["boss_hp"] <= 0
+    if boss_killed:
+        d["boss_kills"] += 1
+        d["boss_hp"] = BOSS_MAX_HP
+        check_achievements(d, "boss_kills")
+
+    return boss_killed
+
+
+def action_sell_item(d, ctx, item_id=None, item=None):
+    if item_id is None:
+        item_id = ITEM_IDS_BY_NAME.get(item["name"])
+    if not remove_item(d, item_id):
+        return False
+
+    d["points"] += SELL_PRICE
+    return True
+
+
+def action_forge(d, ctx, equip):
+    cost = d["equips"][equip] * FORGE_PRICES[equip]
+    if d["points"] < cost:
+        return False
+
+    d["points"] -= cost
+    d["equips"][equip] += 1
+    check_achievements(d, f"equips.{equip}")
+    return True
+
+
+def action_buy_tavern(d, ctx, index):
+    item = TAVERN_ITEMS[index]
+    cost = tavern_cost(item, ctx.now)
+    if d["points"] < cost:
+        return False
+
+    d["points"] -= cost
+    grant_energy(d, item["energy"], ctx.ts)
+    return True
+
+
+def action_reset(d, ctx):
+    d.clear()
+    d.update(new_player(ctx.ts))
+    d["rollups"] = empty_rollups()
+    # lịch sử không bị xoá: row mang mốc Reset của state lúc tạo (run_action),
+    # đọc chỉ lấy row cùng mốc với state hiện tại
+    d["reset_at"] = int(ctx.ts * 1000)
+
+
+def action_maintain(d, ctx):
+    # hiệu ứng theo thời gian, worker chạy định kỳ cho mọi player (worker.py)
+    if 0 < d.get("energy_block_until", 0) <= ctx.ts:
+        # Choáng đã hết: gộp energy đã hồi và bỏ khoá
+        materialize_energy(d, ctx.ts)
+
+    debuffs = d.get("debuffs")
+    if debuffs:
+        d["debuffs"] = [x for x in debuffs if x.get("remaining", 0) > 0]
+
+    if d["boss_hp"] <= 0:
+        d["boss_hp"] = BOSS_MAX_HP
+
+
+def action_boss_reset(d, ctx):
+    # sự kiện định kỳ: boss của mọi player hồi đầy máu
+    d["boss_hp"] = BOSS_MAX_HP
+
+
+ACTIONS = {
+    "complete_tasks": action_complete_tasks,
+    "add_task": action_add_task,
+    "add_treat": action_add_treat,
+    "add_tasks": action_add_tasks,
+    "add_treats": action_add_treats,
+    "delete_treat": action_delete_treat,
+    "claim_treat": action_claim_treat,
+    "open_chest": action_open_chest,
+    "buy_slot": action_buy_slot,
+    "use_item": action_use_item,
+    "sell_item": action_sell_item,
+    "forge": action_forge,
+    "buy_tavern": action_buy_tavern,
+    "reset": action_reset,
+    "maintain": action_maintain,
+    "boss_reset": action_boss_reset,
+}
+
+
+def run_action(d, event):
+    # → (kết quả, row lịch sử cần insert); action không đổi gì thì state giữ nguyên.
+    # Row gắn mốc Reset của state (reset_at): khôi phục về trước một lần Reset
+    # thì lịch sử của "đời" cũ hiện lại
+    ctx = ActionContext(event["ts"], event["seed"])
+    result = ACTIONS[event["type"]](d, ctx, **event["args"])
+    reset_at = d.get("reset_at", 0)
+    return result, [(table, {**row, "reset_at": reset_at}) for table, row in ctx.history]
@@ -0,0 +1,510 @@
+import json
+import random
+import sqlite3
+import sys
+import threading
+import time
+
+import game
+import metrics
+from eventlog import apply_event, state_at
+from storage import HISTORY_PAGE, SCAN_BATCH, Storage
+
+# ================= WRITE-AHEAD JOURNAL =================
+# Bọc một storage (thường là Supabase): mọi thao tác ghi của một action được
+# append vào file SQLite (WAL, synchronous=FULL) trên máy chạy app rồi trả về
+# ngay, rerun không phải chờ backend. Một thread nền đẩy journal lên backend
+# theo đúng thứ tự của từng player, gom các ghi liên tiếp:
+#   - event → một lần append_events
+#   - history cùng bảng → một lần append_history
+#   - leaderboard / snapshot → chỉ ghi bản cuối
+# Mỗi lần ghi lên backend xong thì xoá ngay phần đó khỏi journal. Backend lỗi
+# thì phần chưa ghi nằm lại và được thử lại sau, phần đã ghi không gửi lại.
+# App khởi động lại thì thread đọc tiếp phần còn dở trong file. Backoff tính
+# riêng từng player: một player đẩy lỗi mãi (row hỏng, backend từ chối) không
+# chặn các player khác; lỗi liên tiếp từ STUCK_AFTER lần thì player đó được
+# báo là "kẹt" (stderr, metrics, stuck()).
+#
+# Đọc vẫn đi thẳng tới backend, riêng event (read_events / get_head) được
+# gộp với event chưa đẩy để state luôn thấy action vừa làm. Backend lỗi thì
+# get_head / read_events / get_player trả từ phần journal biết chắc (head đã
+# đẩy / đã đọc được + event chờ đẩy, snapshot chờ đẩy) thay vì báo lỗi, và
+# trong OFFLINE_WAIT giây sau đó không hỏi backend nữa (khỏi chờ timeout mỗi
+# rerun). Không đủ dữ liệu trong journal thì vẫn báo lỗi như trước.
+#
+# Event đẩy lên bị trùng seq (server khác đã ghi trước): event là action
+# + seed nên chỉ cần đánh số lại sau head của backend rồi đẩy tiếp ("rebase"),
+# action được chạy trên state mới nhất thay vì bị mất. Event bị đánh số lại
+# được đánh dấu "rebased": row history và stats leaderboard app đã tính trên
+# state cũ bị bỏ, tính lại bằng cách replay trên backend. Snapshot chờ đẩy của
+# player đó cũng bị bỏ vì không còn khớp thứ tự event.
+#
+# Journal đẩy "ít nhất một lần" chỉ trong một khe hẹp: app sập (hoặc mất
+# response) giữa lúc backend đã nhận và lúc xoá khỏi journal. Event lặp được
+# nhận ra và bỏ qua, riêng row history lặp thì bị ghi hai lần.
+
+RETRY_BASE = 0.5   # giây, backoff khi backend lỗi
+RETRY_CAP = 30.0
+IDLE_WAIT = 5.0
+STUCK_AFTER = 5    # số lần lỗi liên tiếp thì báo player bị kẹt
+OFFLINE_WAIT = 15.0  # giây không hỏi backend cho các lệnh đọc sau khi nó lỗi
+
+
+class JournaledStorage(Storage):
+    def __init__(self, inner, path):
+        self.inner = inner
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.last_error = None
+        # seq cao nhất đã đẩy lên backend, theo player
+        self.heads = {}
+        # head backend đã biết (đã đẩy / đọc được), để đọc khi backend lỗi
+        self.known_heads = {}
+        # time.monotonic() tới lúc đó đọc không hỏi backend (backend vừa lỗi)
+        self.offline_until = 0.0
+        # player đẩy lỗi: số lần lỗi liên tiếp, lỗi cuối, lúc được thử lại
+        self.failures = {}
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("pragma journal_mode=wal")
+        self.conn.execute("pragma synchronous=full")
+        with self.conn:
+            self.conn.execute(
+                "create table if not exists journal ("
+                " id integer primary key autoincrement,"
+                " player_id text not null,"
+                " op text not null,"
+                " seq integer,"
+                " payload text not null)"
+            )
+            # seq của event chờ đẩy là duy nhất theo player (như player_events)
+            self.conn.execute(
+                "create unique index if not exists journal_event_seq "
+                "on journal (player_id, seq) where op = 'event'"
+            )
+
+        self.thread = threading.Thread(target=self._flush_loop, name="journal-flush", daemon=True)
+        self.thread.start()
+
+    # ===== JOURNAL =====
+    def _append(self, player_id, op, payload, seq=None):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "insert into journal (player_id, op, seq, payload) values (?, ?, ?, ?)",
+                (player_id, op, seq, json.dumps(payload, ensure_ascii=False))
+            )
+            self.wakeup.notify()
+
+    def _pending_events(self, player_id):
+        rows = self.conn.execute(
+            "select payload from journal where player_id = ? and op = 'event' order by seq",
+            (player_id,)
+        ).fetchall()
+        return [json.loads(payload) for payload, in rows]
+
+    def pending(self):
+        # → số thao tác chưa đẩy lên backend
+        with self.lock:
+            return self.conn.execute("select count(*) from journal").fetchone()[0]
+
+    def stuck(self):
+        # → {player_id: (số lần lỗi liên tiếp, lỗi cuối)} của player đang kẹt
+        with self.lock:
+            return {
+                player_id: (count, error)
+                for player_id, (count, error, _) in self.failures.items()
+                if count >= STUCK_AFTER
+            }
+
+    def drain(self, timeout=None):
+        # chờ journal đẩy hết (script / test); → True nếu đã hết
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending():
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            with self.lock:
+                self.wakeup.notify()
+            time.sleep(0.05)
+        return True
+
+    # ===== GHI: VÀO JOURNAL =====
+    def append_event(self, player_id, event):
+        return self.append_events(player_id, [event])
+
+    def append_events(self, player_id, events):
+        with self.lock:
+            pending = self._pending_events(player_id)
+            # đã có event chờ đẩy → seq phải nối tiếp ngay sau nó (session khác
+            # cùng process vừa ghi thì báo trùng, như backend)
+            if pending and events and events[0]["seq"] != pending[-1]["seq"] + 1:
+                return False
+            # session cũ ghi đè seq vừa được đẩy lên
+            if events and events[0]["seq"] <= self.heads.get(player_id, 0):
+                return False
+
+            try:
+                with self.conn:
+                    self.conn.executemany(
+                        "insert into journal (player_id, op, seq, payload) values (?, 'event', ?, ?)",
+                        [(player_id, e["seq"], json.dumps(e, ensure_ascii=False)) for e in events]
+                    )
+            except sqlite3.IntegrityError:
+                return False
+            self.wakeup.notify()
+
+        return True
+
+    def update_player(self, player_id, data, expected_version, version):
+        # snapshot chỉ để replay ngắn lại: CAS chạy lúc đẩy, thua thì bỏ
+        self._append(player_id, "update_player", {
+            "data": data, "expected": expected_version, "version": version
+        })
+        return True
+
+    def save_snapshot(self, player_id, seq, data):
+        self._append(player_id, "save_snapshot", {"data": data}, seq)
+
+    def append_history(self, table, player_id, rows):
+        self._append(player_id, "append_history", {"table": table, "rows": rows})
+
+    def delete_history(self, player_id):
+        self._append(player_id, "delete_history", {})
+
+    def update_leaderboard(self, player_id, stats):
+        self._append(player_id, "update_leaderboard", {"stats": stats})
+
+    # ===== ĐỌC: BACKEND + EVENT CHƯA ĐẨY =====
+    def _read(self, name, *args):
+        # backend vừa lỗi → báo lỗi ngay để dùng journal, không chờ timeout lần nữa
+        if time.monotonic() < self.offline_until:
+            raise ConnectionError(f"backend lỗi gần đây ({self.last_error!r})")
+        try:
+            return getattr(self.inner, name)(*args)
+        except Exception as e:
+            self.last_error = e
+            self.offline_until = time.monotonic() + OFFLINE_WAIT
+            print(f"journal: đọc {name} lỗi ({e!r}), dùng journal", file=sys.stderr)
+            raise
+
+    def _seen_head(self, player_id, seq):
+        with self.lock:
+            self.known_heads[player_id] = max(self.known_heads.get(player_id, 0), seq)
+
+    def read_events(self, player_id, after_seq=0, upto_seq=None):
+        try:
+            events = self._read("read_events", player_id, after_seq, upto_seq)
+        except Exception:
+            # mọi event sau head đã biết đều nằm trong journal → không cần backend
+            if after_seq < self.known_heads.get(player_id, float("inf")):
+                raise
+            events = []
+        else:
+            if upto_seq is None:
+                self._seen_head(player_id, events[-1]["seq"] if events else after_seq)
+
+        with self.lock:
+            pending = self._pending_events(player_id)
+
+        # event chờ rebase (seq đã có trên backend) không được trộn vào
+        last = events[-1]["seq"] if events else after_seq
+        return events + [
+            e for e in pending
+            if e["seq"] > last and (upto_seq is None or e["seq"] <= upto_seq)
+        ]
+
+    def read_events_many(self, after_seqs):
+        return {
+            player_id: rows
+            for player_id in after_seqs
+            if (rows := self.read_events(player_id, after_seqs[player_id]))
+        }
+
+    def get_head(self, player_id):
+        try:
+            head = self._read("get_head", player_id)
+        except Exception:
+            # head đã biết của backend, event chờ đẩy nối sau nó
+            if player_id not in self.known_heads:
+                raise
+            head = self.known_heads[player_id]
+        else:
+            if head is not None:
+                self._seen_head(player_id, head)
+
+        with self.lock:
+            row = self.conn.execute(
+                "select max(seq) from journal where player_id = ? and op = 'event'",
+                (player_id,)
+            ).fetchone()
+
+        if row[0] is None or head is None:
+            return head
+        return max(head, row[0])
+
+    def get_player(self, player_id):
+        try:
+            return self._read("get_player", player_id)
+        except Exception:
+            # snapshot chờ đẩy mới nhất (event sau nó thì read_events lo)
+            with self.lock:
+                row = self.conn.execute(
+                    "select payload from journal where player_id = ? and op = 'update_player' "
+                    "order by id desc limit 1",
+                    (player_id,)
+                ).fetchone()
+            if row is None:
+                raise
+            payload = json.loads(row[0])
+            return payload["data"], payload["version"]
+
+    def get_version(self, player_id):
+        return self.inner.get_version(player_id)
+
+    def insert_player(self, player_id, data, version=0):
+        return self.inner.insert_player(player_id, data, version)
+
+    def read_history(self, table, player_id, after_id=0, limit=None, reset_at=None):
+        return self.inner.read_history(table, player_id, after_id, limit, reset_at)
+
+    def query_history(self, table, player_id, before_id=None, limit=HISTORY_PAGE,
+                      date_from=None, date_to=None, search=None, reset_at=None):
+        return self.inner.query_history(
+            table, player_id, before_id, limit, date_from, date_to, search, reset_at
+        )
+
+    def top_players(self, stat, limit=10):
+        return self.inner.top_players(stat, limit)
+
+    def player_rank(self, player_id, stat):
+        return self.inner.player_rank(player_id, stat)
+
+    def scan_players(self, after_id="", limit=SCAN_BATCH):
+        return self.inner.scan_players(after_id, limit)
+
+    def get_snapshot(self, player_id, upto_seq):
+        return self.inner.get_snapshot(player_id, upto_seq)
+
+    # ===== FLUSH =====
+    def _flush_loop(self):
+        while True:
+            with self.lock:
+                # player còn phần chờ đẩy, ai ghi trước đẩy trước; đang backoff thì bỏ qua
+                players = [p for p, in self.conn.execute(
+                    "select player_id from journal group by player_id order by min(id)"
+                )]
+                now = time.monotonic()
+                ready = [p for p in players if p not in self.failures or self.failures[p][2] <= now]
+                if not ready:
+                    retry = min((self.failures[p][2] - now for p in players), default=IDLE_WAIT)
+                    self.wakeup.wait(min(retry, IDLE_WAIT))
+                    continue
+
+            player_id = ready[0]
+            try:
+                self._flush_player(player_id)
+            except Exception as e:
+                # backend chậm / sập / từ chối: giữ phần chưa ghi, thử lại player này sau
+                self._flush_failed(player_id, e)
+                continue
+
+            with self.lock:
+                failed = self.failures.pop(player_id, None)
+                stuck = sum(count >= STUCK_AFTER for count, _, _ in self.failures.values())
+            if failed and failed[0] >= STUCK_AFTER:
+                print(f"journal: {player_id} đã đẩy được sau {failed[0]} lần lỗi", file=sys.stderr)
+                metrics.set_stuck_players(stuck)
+            self.last_error = None
+            self.offline_until = 0.0
+
+    def _flush_failed(self, player_id, error):
+        with self.lock:
+            count = self.failures.get(player_id, (0,))[0] + 1
+            delay = random.uniform(0, min(RETRY_CAP, RETRY_BASE * 2 ** count))
+            self.failures[player_id] = (count, error, time.monotonic() + delay)
+            stuck = sum(c >= STUCK_AFTER for c, _, _ in self.failures.values())
+        self.last_error = error
+        metrics.count_flush_error(stuck)
+
+        if count >= STUCK_AFTER:
+            print(
+                f"journal: {player_id} đẩy lỗi {count} lần liên tiếp ({error!r}), "
+                f"các player khác vẫn được đẩy",
+                file=sys.stderr
+            )
+        else:
+            print(f"journal: đẩy {player_id} lên backend lỗi ({error!r}), thử lại", file=sys.stderr)
+
+    def _forget(self, ids):
+        # các thao tác đã ghi xong lên backend
+        with self.lock, self.conn:
+            self.conn.executemany("delete from journal where id = ?", [(i,) for i in ids])
+
+    def _flush_player(self, player_id):
+        with self.lock:
+            entries = self.conn.execute(
+                "select id, op, seq, payload from journal where player_id = ? order by id",
+                (player_id,)
+            ).fetchall()
+
+        events, history = [], []  # [(id, payload)] của đoạn đang gom
+        snapshot_ids, leaderboard_ids = [], []
+        leaderboard = snapshot = None
+        rebased = False
+
+        def push():
+            nonlocal rebased
+            if events:
+                pushed = self._push_events(player_id, list(events))
+                events.clear()
+                if any(event.get("rebased") for _, event in pushed):
+                    rebased = True
+                    history[:] = self._rebase_history(player_id, pushed, history)
+                else:
+                    self._forget([i for i, _ in pushed])
+
+            for table in dict.fromkeys(p["table"] for _, p in history):
+                batch = [(i, p) for i, p in history if p["table"] == table]
+                self.inner.append_history(table, player_id, [row for _, p in batch for row in p["rows"]])
+                self._forget([i for i, _ in batch])
+            history.clear()
+
+        for entry_id, op, seq, payload in entries:
+            payload = json.loads(payload)
+
+            if op == "event":
+                events.append((entry_id, payload))
+            elif op == "append_history":
+                history.append((entry_id, payload))
+            elif op == "delete_history":
+                # xoá phải đứng đúng chỗ giữa các lần ghi history
+                push()
+                self.inner.delete_history(player_id)
+                self._forget([entry_id])
+            elif op == "update_leaderboard":
+                leaderboard = payload["stats"]
+                leaderboard_ids.append(entry_id)
+            elif op == "update_player":
+                # gộp chuỗi CAS: expected của bản đầu, data / version của bản cuối
+                expected = snapshot["expected"] if snapshot else payload["expected"]
+                snapshot = {**payload, "expected": expected, "archive": False}
+                snapshot_ids.append(entry_id)
+            elif op == "save_snapshot":
+                if snapshot and snapshot["version"] == seq:
+                    snapshot["archive"] = True
+                snapshot_ids.append(entry_id)
+
+        push()
+
+        if snapshot is not None and not rebased:
+            written = self.inner.update_player(
+                player_id, snapshot["data"], snapshot["expected"], snapshot["version"]
+            )
+            if written and snapshot["archive"]:
+                self.inner.save_snapshot(player_id, snapshot["version"], snapshot["data"])
+        self._forget(snapshot_ids)
+
+        if rebased:
+            # stats app gửi kèm cũng tính trên state cũ → lấy từ state mới nhất
+            head = self.inner.get_head(player_id)
+            leaderboard = game.leaderboard_stats(state_at(self.inner, player_id, head))
+        if leaderboard is not None:
+            self.inner.update_leaderboard(player_id, leaderboard)
+        self._forget(leaderboard_ids)
+
+    def _push_events(self, player_id, batch):
+        # batch: [(id, event)] theo seq → cùng các event đó với seq đã lên backend
+        while True:
+            events = [event for _, event in batch]
+
+            # sập sau khi đẩy nhưng trước khi xoá khỏi journal: bỏ phần đã có trên backend
+            remote = self.inner.read_events(player_id, events[0]["seq"] - 1, events[-1]["seq"])
+            same = 0
+            while same < len(remote) and _same_event(remote[same], events[same]):
+                same += 1
+
+            if same == len(events) or self.inner.append_events(player_id, events[same:]):
+                self._seen_head(player_id, events[-1]["seq"])
+                with self.lock:
+                    self.heads[player_id] = events[-1]["seq"]
+                return batch
+
+            # server khác đã ghi các seq này → nối phần chưa đẩy sau head mới
+            head = self.inner.get_head(player_id) or 0
+            ids = {i for i, _ in batch[same:]}
+            batch = batch[:same] + [
+                (i, event) for i, event in self._renumber(player_id, head, events[same]["seq"])
+                if i in ids
+            ]
+
+    def _renumber(self, player_id, head, from_seq):
+        # đánh số lại mọi event chờ đẩy có seq >= from_seq (kể cả event mới thêm
+        # trong lúc đang đẩy), nối sau head → [(id, event)] theo seq mới
+        with self.lock, self.conn:
+            rows = self.conn.execute(
+                "select id, payload from journal "
+                "where player_id = ? and op = 'event' and seq >= ? order by seq",
+                (player_id, from_seq)
+            ).fetchall()
+            print(
+                f"journal: {player_id} bị ghi từ nơi khác, đánh số lại "
+                f"#{from_seq} → #{head + 1}",
+                file=sys.stderr
+            )
+
+            self.conn.execute(
+                "update journal set seq = -seq where player_id = ? and op = 'event' and seq >= ?",
+                (player_id, from_seq)
+            )
+            renumbered = []
+            for i, (entry_id, payload) in enumerate(rows):
+                event = {**json.loads(payload), "seq": head + 1 + i, "rebased": True}
+                self.conn.execute(
+                    "update journal set seq = ?, payload = ? where id = ?",
+                    (event["seq"], json.dumps(event, ensure_ascii=False), entry_id)
+                )
+                renumbered.append((entry_id, event))
+
+        return renumbered
+
+    def _rebase_history(self, player_id, pushed, history):
+        # event của đoạn đã lên backend sau khi đánh số lại: row history app tính
+        # trên state cũ → chạy lại các event trên backend lấy row mới (row chuyển
+        # từ blob cũ, có "src", không phụ thuộc state thì giữ). Trong một
+        # transaction: xoá event + history cũ của đoạn, ghi history mới vào đúng
+        # chỗ (dùng lại id nhỏ nhất) → lỗi / sập sau đó cũng không tính lại lần nữa
+        rows = [(p["table"], row) for _, p in history for row in p["rows"] if "src" in row]
+        rows += self._replay_rows(player_id, [event for _, event in pushed])
+
+        ids = sorted([i for i, _ in pushed] + [i for i, _ in history])
+        tables = list(dict.fromkeys(t for t, _ in rows))
+        rebuilt = [
+            (ids[k], {"table": table, "rows": [r for t, r in rows if t == table]})
+            for k, table in enumerate(tables)
+        ]
+
+        with self.lock, self.conn:
+            self.conn.executemany("delete from journal where id = ?", [(i,) for i in ids])
+            self.conn.executemany(
+                "insert into journal (id, player_id, op, seq, payload) "
+                "values (?, ?, 'append_history', null, ?)",
+                [(i, player_id, json.dumps(p, ensure_ascii=False)) for i, p in rebuilt]
+            )
+        return rebuilt
+
+    def _replay_rows(self, player_id, events):
+        # chạy lại từ state của backend ngay trước event đầu → row history của
+        # đúng các event này (event của server khác xen giữa chỉ để dựng state)
+        ours = {event["seq"] for event in events}
+        d = state_at(self.inner, player_id, events[0]["seq"] - 1)
+
+        rows = []
+        for event in self.inner.read_events(player_id, events[0]["seq"] - 1, events[-1]["seq"]):
+            _, history = apply_event(self.inner, player_id, d, event)
+            d["last_updated"] = event["ts"]
+            if event["seq"] in ours:
+                rows.extend(history)
+        return rows
+
+
+def _same_event(a, b):
+    return all(a[k] == b[k] for k in ("seq", "type", "seed", "ts"))
@@ -0,0 +1,308 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+import codec
+from storage import HISTORY_PAGE, SCAN_BATCH, Storage
+
+# ================= METRICS =================
+# Mỗi rerun có một bản ghi riêng (theo thread của ScriptRunner):
+#   spans    – wall time (ms) của load_data, save_data, từng tab...
+#   requests – số request tới storage theo từng loại
+#   bytes    – số byte JSON gửi đi / nhận về
+# finish_rerun() cộng dồn vào số liệu toàn process (xuất dạng Prometheus)
+# và append một dòng NDJSON nếu đã cấu hình. Thread đẩy journal báo thêm số
+# lần đẩy lỗi và số player đang kẹt (lỗi liên tiếp nhiều lần).
+
+RERUN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_local = threading.local()
+_lock = threading.Lock()
+
+_config = {"ndjson_path": None, "prom_path": None}
+
+_totals = {
+    "reruns": 0,
+    "rerun_seconds_sum": 0.0,
+    "rerun_buckets": [0] * len(RERUN_BUCKETS),
+    "span_seconds": {},
+    "span_count": {},
+    "requests": {},
+    "bytes_sent": 0,
+    "bytes_received": 0,
+    "journal_flush_errors": 0,
+    "journal_stuck_players": 0,
+}
+
+_last = None
+
+
+def configure(ndjson_path=None, prom_path=None):
+    _config["ndjson_path"] = ndjson_path
+    _config["prom_path"] = prom_path
+
+
+def start_rerun():
+    _local.record = {
+        "ts": time.time(),
+        "started": time.perf_counter(),
+        "spans": {},
+        "requests": {},
+        "bytes_sent": 0,
+        "bytes_received": 0,
+    }
+    return _local.record
+
+
+def current():
+    return getattr(_local, "record", None)
+
+
+def last_rerun():
+    return _last
+
+
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record = current()
+        if record is not None:
+            spans = record["spans"]
+            spans[name] = spans.get(name, 0) + (time.perf_counter() - start) * 1000
+
+
+def timed(name):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count_request(op, sent=0, received=0):
+    record = current()
+    if record is None:
+        return
+
+    record["requests"][op] = record["requests"].get(op, 0) + 1
+    record["bytes_sent"] += sent
+    record["bytes_received"] += received
+
+
+def count_flush_error(stuck_players):
+    # journal đẩy lên backend lỗi; stuck_players: số player đang kẹt sau lần này
+    with _lock:
+        _totals["journal_flush_errors"] += 1
+        _totals["journal_stuck_players"] = stuck_players
+
+
+def set_stuck_players(n):
+    with _lock:
+        _totals["journal_stuck_players"] = n
+
+
+def finish_rerun():
+    global _last
+
+    record = current()
+    if record is None:
+        return None
+    _local.record = None
+
+    elapsed = time.perf_counter() - record.pop("started")
+    record["total_ms"] = elapsed * 1000
+
+    with _lock:
+        _totals["reruns"] += 1
+        _totals["rerun_seconds_sum"] += elapsed
+        for i, bound in enumerate(RERUN_BUCKETS):
+            if elapsed <= bound:
+                _totals["rerun_buckets"][i] += 1
+
+        for name, ms in record["spans"].items():
+            _totals["span_seconds"][name] = _totals["span_seconds"].get(name, 0) + ms / 1000
+            _totals["span_count"][name] = _totals["span_count"].get(name, 0) + 1
+
+        for op, n in record["requests"].items():
+            _totals["requests"][op] = _totals["requests"].get(op, 0) + n
+
+        _totals["bytes_sent"] += record["bytes_sent"]
+        _totals["bytes_received"] += record["bytes_received"]
+        _last = record
+
+        if _config["ndjson_path"]:
+            with open(_config["ndjson_path"], "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        if _config["prom_path"]:
+            # ghi file tạm rồi rename để node_exporter không đọc phải file dở
+            tmp = _config["prom_path"] + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(_prometheus_text())
+            os.replace(tmp, _config["prom_path"])
+
+    return record
+
+
+def prometheus_text():
+    with _lock:
+        return _prometheus_text()
+
+
+def _prometheus_text():
+    lines = [
+        "# HELP grind_rerun_seconds Wall time của một rerun.",
+        "# TYPE grind_rerun_seconds histogram",
+    ]
+    for bound, n in zip(RERUN_BUCKETS, _totals["rerun_buckets"]):
+        lines.append(f'grind_rerun_seconds_bucket{{le="{bound}"}} {n}')
+    lines += [
+        f'grind_rerun_seconds_bucket{{le="+Inf"}} {_totals["reruns"]}',
+        f'grind_rerun_seconds_sum {_totals["rerun_seconds_sum"]:.6f}',
+        f'grind_rerun_seconds_count {_totals["reruns"]}',
+        "# HELP grind_span_seconds Wall time theo từng phần của rerun.",
+        "# TYPE grind_span_seconds summary",
+    ]
+    for name in sorted(_totals["span_seconds"]):
+        lines.append(f'grind_span_seconds_sum{{span="{name}"}} {_totals["span_seconds"][name]:.6f}')
+        lines.append(f'grind_span_seconds_count{{span="{name}"}} {_totals["span_count"][name]}')
+    lines += [
+        "# HELP grind_storage_requests_total Số request tới storage.",
+        "# TYPE grind_storage_requests_total counter",
+    ]
+    for op in sorted(_totals["requests"]):
+        lines.append(f'grind_storage_requests_total{{op="{op}"}} {_totals["requests"][op]}')
+    lines += [
+        "# HELP grind_storage_bytes_total Số byte JSON gửi tới / nhận từ storage.",
+        "# TYPE grind_storage_bytes_total counter",
+        f'grind_storage_bytes_total{{direction="sent"}} {_totals["bytes_sent"]}',
+        f'grind_storage_bytes_total{{direction="received"}} {_totals["bytes_received"]}',
+        "# HELP grind_journal_flush_errors_total Số lần đẩy journal lên backend bị lỗi.",
+        "# TYPE grind_journal_flush_errors_total counter",
+        f'grind_journal_flush_errors_total {_totals["journal_flush_errors"]}',
+        "# HELP grind_journal_stuck_players Số player có phần journal đẩy lỗi liên tiếp.",
+        "# TYPE grind_journal_stuck_players gauge",
+        f'grind_journal_stuck_players {_totals["journal_stuck_players"]}',
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def _size(obj):
+    return len(json.dumps(obj, ensure_ascii=False).encode("utf-8"))
+
+
+def _doc_call(fn, *args):
+    # → (kết quả, số byte document dạng compact): storage đã encode / decode qua
+    # codec, đọc lại con số codec đếm thay vì encode lần nữa
+    codec.take_bytes()
+    result = fn(*args)
+    return result, codec.take_bytes()
+
+
+# ================= STORAGE ĐẾM REQUEST =================
+class InstrumentedStorage(Storage):
+    def __init__(self, inner):
+        self.inner = inner
+
+    def get_player(self, player_id):
+        row, size = _doc_call(self.inner.get_player, player_id)
+        count_request("get_player", received=size)
+        return row
+
+    def get_version(self, player_id):
+        count_request("get_version")
+        return self.inner.get_version(player_id)
+
+    def insert_player(self, player_id, data, version=0):
+        result, size = _doc_call(self.inner.insert_player, player_id, data, version)
+        count_request("insert_player", sent=size)
+        return result
+
+    def update_player(self, player_id, data, expected_version, version):
+        result, size = _doc_call(self.inner.update_player, player_id, data, expected_version, version)
+        count_request("update_player", sent=size)
+        return result
+
+    def append_history(self, table, player_id, rows):
+        count_request("append_history", sent=_size(rows))
+        return self.inner.append_history(table, player_id, rows)
+
+    def read_history(self, table, player_id, after_id=0, limit=None, reset_at=None):
+        rows = self.inner.read_history(table, player_id, after_id, limit, reset_at)
+        count_request("read_history", received=_size(rows))
+        return rows
+
+    def query_history(self, table, player_id, before_id=None, limit=HISTORY_PAGE,
+                      date_from=None, date_to=None, search=None, reset_at=None):
+        rows = self.inner.query_history(
+            table, player_id, before_id, limit, date_from, date_to, search, reset_at
+        )
+        count_request("query_history", received=_size(rows))
+        return rows
+
+    def delete_history(self, player_id):
+        count_request("delete_history")
+        return self.inner.delete_history(player_id)
+
+    def update_leaderboard(self, player_id, stats):
+        count_request("update_leaderboard", sent=_size(stats))
+        return self.inner.update_leaderboard(player_id, stats)
+
+    def top_players(self, stat, limit=10):
+        rows = self.inner.top_players(stat, limit)
+        count_request("top_players", received=_size(rows))
+        return rows
+
+    def player_rank(self, player_id, stat):
+        row = self.inner.player_rank(player_id, stat)
+        count_request("player_rank", received=_size(row))
+        return row
+
+    def scan_players(self, after_id="", limit=SCAN_BATCH):
+        rows = self.inner.scan_players(after_id, limit)
+        count_request("scan_players", received=_size(rows))
+        return rows
+
+    def append_event(self, player_id, event):
+        count_request("append_event", sent=_size(event))
+        return self.inner.append_event(player_id, event)
+
+    def append_events(self, player_id, events):
+        count_request("append_events", sent=_size(events))
+        return self.inner.append_events(player_id, events)
+
+    def append_events_many(self, events):
+        count_request("append_events_many", sent=_size(events))
+        return self.inner.append_events_many(events)
+
+    def read_events(self, player_id, after_seq=0, upto_seq=None):
+        rows = self.inner.read_events(player_id, after_seq, upto_seq)
+        count_request("read_events", received=_size(rows))
+        return rows
+
+    def read_events_many(self, after_seqs):
+        events = self.inner.read_events_many(after_seqs)
+        count_request("read_events_many", received=_size(events))
+        return events
+
+    def get_head(self, player_id):
+        count_request("get_head")
+        return self.inner.get_head(player_id)
+
+    def save_snapshot(self, player_id, seq, data):
+        result, size = _doc_call(self.inner.save_snapshot, player_id, seq, data)
+        count_request("save_snapshot", sent=size)
+        return result
+
+    def get_snapshot(self, player_id, upto_seq):
+        row, size = _doc_call(self.inner.get_snapshot, player_id, upto_seq)
+        count_request("get_snapshot", received=size)
+        return row
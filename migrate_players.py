@@ -0,0 +1,111 @@
+import argparse
+import sys
+import time
+
+from engine import read_player
+from game import leaderboard_stats
+from migrations import migrate, needs_migration
+from storage import SCAN_BATCH, make_storage_from_env
+
+# ================= MIGRATE OFFLINE =================
+# Nâng cấp mọi document trong bảng players lên SCHEMA_VERSION mới nhất,
+# duyệt theo id từng batch. Player đang chơi (version đổi giữa chừng) được
+# bỏ qua, lần tải sau tự migrate. Dừng giữa chừng thì chạy lại với --after.
+#
+#
+# --leaderboard: lấp / sửa bảng leaderboard cho mọi player (vd. lần đầu có
+# bảng), stats tính từ state thật (snapshot + replay event), chạy lại không sao.
+#
+#   python migrate_players.py --backend sqlite --path grind.db
+#   SUPABASE_URL=... SUPABASE_KEY=... python migrate_players.py --batch 200
+#   python migrate_players.py --leaderboard
+
+
+def migrate_all(store, after_id="", batch=SCAN_BATCH, dry_run=False):
+    stats = {"scanned": 0, "migrated": 0, "skipped": 0, "last_id": after_id}
+
+    while True:
+        rows = store.scan_players(stats["last_id"], batch)
+        if not rows:
+            return stats
+
+        for player_id, data, version in rows:
+            stats["scanned"] += 1
+
+            if needs_migration(data):
+                if dry_run:
+                    stats["migrated"] += 1
+                else:
+                    migrate(data, store, player_id)
+
+                    # snapshot giữ nguyên version: event sau nó vẫn replay như cũ
+                    if store.update_player(player_id, data, version, version):
+                        store.save_snapshot(player_id, version, data)
+                        stats["migrated"] += 1
+                    else:
+                        stats["skipped"] += 1
+
+        stats["last_id"] = rows[-1][0]
+        print(
+            f"… {stats['scanned']} player, {stats['migrated']} đã migrate, "
+            f"đến id {stats['last_id']}",
+            file=sys.stderr
+        )
+
+
+def backfill_leaderboard(store, after_id="", batch=SCAN_BATCH):
+    # data của scan_players chỉ là snapshot → đọc lại từng player có replay
+    stats = {"scanned": 0, "migrated": 0, "skipped": 0, "last_id": after_id}
+
+    while True:
+        rows = store.scan_players(stats["last_id"], batch)
+        if not rows:
+            return stats
+
+        for player_id, _, _ in rows:
+            stats["scanned"] += 1
+            player = read_player(store, player_id)
+            if player is None:
+                stats["skipped"] += 1
+                continue
+            store.update_leaderboard(player_id, leaderboard_stats(player["data"]))
+            stats["migrated"] += 1
+
+        stats["last_id"] = rows[-1][0]
+        print(
+            f"… {stats['scanned']} player, {stats['migrated']} đã ghi leaderboard, "
+            f"đến id {stats['last_id']}",
+            file=sys.stderr
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate mọi player lên schema mới nhất")
+    parser.add_argument("--backend", choices=["supabase", "sqlite"], default="supabase")
+    parser.add_argument("--path", default="grind.db", help="file SQLite (backend sqlite)")
+    parser.add_argument("--batch", type=int, default=SCAN_BATCH)
+    parser.add_argument("--after", default="", help="tiếp tục sau player id này")
+    parser.add_argument("--dry-run", action="store_true", help="chỉ đếm, không ghi")
+    parser.add_argument(
+        "--leaderboard", action="store_true",
+        help="ghi lại leaderboard của mọi player từ state thật thay vì migrate"
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    store = make_storage_from_env(args.backend, args.path)
+    if args.leaderboard:
+        stats = backfill_leaderboard(store, args.after, args.batch)
+        done = "đã ghi leaderboard"
+    else:
+        stats = migrate_all(store, args.after, args.batch, args.dry_run)
+        done = "cần migrate" if args.dry_run else "đã migrate"
+
+    print(
+        f"Xong: {stats['scanned']} player, {stats['migrated']} {done}, "
+        f"{stats['skipped']} bỏ qua ({time.perf_counter() - start:.1f}s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
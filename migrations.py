@@ -0,0 +1,98 @@
+import copy
+import time
+
+from game import (
+    DEFAULT_DATA, RECENT_HISTORY, SCHEMA_VERSION, build_rollups, inventory, rebuild_streak
+)
+
+# ================= SCHEMA MIGRATIONS =================
+# document["schema_version"] = số bước migration đã chạy. Document cũ (chưa
+# có field này) là version 0. Mỗi bước chạy đúng một lần theo thứ tự, kết quả
+# được lưu lại nên lần tải sau không phải làm gì.
+#
+# Thêm bước mới: viết hàm step(d, store, player_id), thêm vào cuối MIGRATIONS
+# và tăng game.SCHEMA_VERSION. Không sửa / đổi thứ tự các bước đã có.
+
+
+def add_defaults(d, store, player_id):
+    # các field có sau này (document tạo từ bản đầu tiên thiếu)
+    for key, value in DEFAULT_DATA.items():
+        if key != "schema_version":
+            d.setdefault(key, copy.deepcopy(value))
+
+    d.setdefault("total_points", 0)
+    d.setdefault("last_updated", time.time())
+    # energy trước đây hồi theo last_updated
+    d.setdefault("energy_at", d["last_updated"])
+
+
+def add_rollups(d, store, player_id):
+    # rollup cho Analytics: dựng một lần từ lịch sử cũ
+    if "rollups" in d:
+        return
+
+    if "task_history" in d:
+        rows = d["task_history"]
+    elif d["tasks_done"]:
+        rows = store.read_history("task_history", player_id)
+    else:
+        rows = []
+    d["rollups"] = build_rollups(rows)
+
+
+def add_streak(d, store, player_id):
+    # streak trước đây không được lưu → tính lại từ rollup theo ngày
+    if "streak_day" not in d:
+        rebuild_streak(d)
+
+
+def move_history(d, store, player_id):
+    # history cũ nằm trong blob → chuyển sang bảng riêng. Ghi trước CAS của
+    # snapshot nên hai nơi cùng migrate một player đều ghi: mỗi row mang vị trí
+    # trong blob (src), storage bỏ qua row trùng (player_id, src)
+    task_rows = d.pop("task_history", None)
+    treat_rows = d.pop("treat_history", None)
+
+    if task_rows:
+        store.append_history("task_history", player_id, _with_src(task_rows))
+        d["recent_history"] = task_rows[-RECENT_HISTORY:]
+    if treat_rows:
+        store.append_history("treat_history", player_id, _with_src(treat_rows))
+        d["treats_claimed"] = d.get("treats_claimed", 0) + len(treat_rows)
+
+
+def _with_src(rows):
+    return [{**row, "src": i} for i, row in enumerate(rows)]
+
+
+def stack_inventory(d, store, player_id):
+    # túi đồ cũ: list dict item → {item_id: số lượng}
+    inventory(d)
+
+
+MIGRATIONS = [
+    add_defaults,
+    add_rollups,
+    add_streak,
+    move_history,
+    stack_inventory,
+]
+
+assert len(MIGRATIONS) == SCHEMA_VERSION, "tăng game.SCHEMA_VERSION khi thêm migration"
+
+
+def needs_migration(d):
+    return d.get("schema_version", 0) < SCHEMA_VERSION
+
+
+def migrate(d, store, player_id):
+    # → True nếu document vừa được nâng cấp (cần lưu lại)
+    start = d.get("schema_version", 0)
+    if start >= SCHEMA_VERSION:
+        return False
+
+    for version, step in enumerate(MIGRATIONS[start:], start + 1):
+        step(d, store, player_id)
+        d["schema_version"] = version
+
+    return True
@@ -0,0 +1,171 @@
+-- Bảng player: snapshot state nằm trong cột data (jsonb), version = seq của
+-- event cuối đã gộp vào snapshot (xem player_events bên dưới).
+-- Ghi snapshot chỉ thành công khi version còn đúng bằng version đã đọc (compare-and-swap).
+create table if not exists players (
+    id text primary key,
+    data jsonb not null,
+    version bigint not null default 0
+);
+
+alter table players add column if not exists version bigint not null default 0;
+
+-- Lịch sử append-only, tách khỏi document của player.
+-- Mỗi lần hoàn thành task / nhận treat chỉ insert 1 row.
+create table if not exists task_history (
+    id bigserial primary key,
+    player_id text not null references players (id) on delete cascade,
+    name text not null,
+    points integer not null,
+    date text not null
+);
+
+create index if not exists task_history_player_idx on task_history (player_id, id);
+
+create table if not exists treat_history (
+    id bigserial primary key,
+    player_id text not null references players (id) on delete cascade,
+    name text not null,
+    cost integer not null,
+    time text not null
+);
+
+create index if not exists treat_history_player_idx on treat_history (player_id, id);
+
+-- Row chuyển từ blob cũ (migrations.move_history): src = vị trí trong blob,
+-- unique theo player → hai nơi cùng migrate một player không ghi đôi.
+-- Row thường để src null (null không trùng nhau).
+alter table task_history add column if not exists src integer;
+alter table treat_history add column if not exists src integer;
+create unique index if not exists task_history_src_idx on task_history (player_id, src);
+create unique index if not exists treat_history_src_idx on treat_history (player_id, src);
+
+-- Mốc Reset (game.action_reset) của state lúc tạo row, 0 = chưa Reset lần nào.
+-- Reset không xoá lịch sử: app chỉ đọc row cùng mốc với state hiện tại, khôi
+-- phục về trước lần Reset thì lịch sử cũ hiện lại.
+alter table task_history add column if not exists reset_at bigint not null default 0;
+alter table treat_history add column if not exists reset_at bigint not null default 0;
+create index if not exists task_history_reset_idx on task_history (player_id, reset_at, id);
+create index if not exists treat_history_reset_idx on treat_history (player_id, reset_at, id);
+
+-- Action log: mỗi action của player là 1 event nhỏ kèm seed RNG.
+-- Primary key (player_id, seq) thay cho CAS: hai session cùng ghi seq = head + 1
+-- thì chỉ một bên thành công, bên kia đọc lại rồi chạy lại action.
+-- players.data/version là snapshot mới nhất (ghi mỗi SNAPSHOT_EVERY event),
+-- state hiện tại = snapshot + replay các event có seq > version.
+create table if not exists player_events (
+    player_id text not null references players (id) on delete cascade,
+    seq bigint not null,
+    type text not null,
+    args jsonb not null,
+    seed bigint not null,
+    ts double precision not null,
+    primary key (player_id, seq)
+);
+
+-- Các snapshot cũ, giữ lại để dựng state tại một seq bất kỳ (audit / khôi phục)
+create table if not exists player_snapshots (
+    player_id text not null references players (id) on delete cascade,
+    seq bigint not null,
+    data jsonb not null,
+    primary key (player_id, seq)
+);
+
+-- Leaderboard: các stat để xếp hạng tách khỏi jsonb thành cột riêng có index,
+-- cập nhật mỗi lần commit làm đổi stat. Top-K = đọc đầu index,
+-- hạng của mình đọc từ histogram leaderboard_buckets (xem bên dưới).
+create table if not exists leaderboard (
+    player_id text primary key references players (id) on delete cascade,
+    total_points bigint not null default 0,
+    boss_kills bigint not null default 0,
+    tasks_done bigint not null default 0
+);
+
+create index if not exists leaderboard_total_points_idx on leaderboard (total_points desc, player_id);
+create index if not exists leaderboard_boss_kills_idx on leaderboard (boss_kills desc, player_id);
+create index if not exists leaderboard_tasks_done_idx on leaderboard (tasks_done desc, player_id);
+
+-- Histogram số player của từng stat, hai mức: bucket rộng (value / width) và
+-- từng giá trị (width = 1); width khớp LEADERBOARD_BUCKETS trong storage.py.
+-- Trigger trên leaderboard giữ đồng bộ trong cùng transaction.
+-- Hạng = 1 + tổng bucket rộng phía trên + các giá trị lớn hơn trong bucket của
+-- mình: đọc tối đa (max / width + width) row thay vì đếm mọi player đứng trên.
+create table if not exists leaderboard_buckets (
+    stat text not null,
+    width bigint not null,
+    bucket bigint not null,
+    players bigint not null,
+    primary key (stat, width, bucket)
+);
+
+create or replace function leaderboard_levels(l leaderboard)
+returns table (stat text, width bigint, bucket bigint)
+language sql immutable as $$
+    select 'total_points'::text, 1::bigint, l.total_points union all
+    select 'total_points', 100, l.total_points / 100 union all
+    select 'boss_kills', 1, l.boss_kills union all
+    select 'tasks_done', 1, l.tasks_done union all
+    select 'tasks_done', 10, l.tasks_done / 10
+$$;
+
+-- đếm một lần khi histogram còn trống (leaderboard có từ trước), sau đó trigger lo
+insert into leaderboard_buckets (stat, width, bucket, players)
+select v.stat, v.width, v.bucket, count(*)
+from leaderboard, leaderboard_levels(leaderboard) as v
+where not exists (select 1 from leaderboard_buckets)
+group by 1, 2, 3;
+
+create or replace function leaderboard_buckets_sync()
+returns trigger language plpgsql as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        update leaderboard_buckets b set players = b.players - 1
+        from leaderboard_levels(old) as v
+        where b.stat = v.stat and b.width = v.width and b.bucket = v.bucket;
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        insert into leaderboard_buckets (stat, width, bucket, players)
+        select v.stat, v.width, v.bucket, 1 from leaderboard_levels(new) as v
+        on conflict (stat, width, bucket) do update set players = leaderboard_buckets.players + 1;
+    end if;
+    return null;
+end
+$$;
+
+drop trigger if exists leaderboard_buckets_sync on leaderboard;
+create trigger leaderboard_buckets_sync
+after insert or update or delete on leaderboard
+for each row execute function leaderboard_buckets_sync();
+
+-- storage.SupabaseStorage.player_rank gọi qua rpc → (rank, value), không có player thì rỗng
+create or replace function leaderboard_rank(p_player_id text, p_stat text)
+returns table (rank bigint, value bigint)
+language plpgsql stable as $$
+declare
+    w bigint := case p_stat when 'total_points' then 100 when 'boss_kills' then 1 when 'tasks_done' then 10 end;
+    v bigint;
+begin
+    if w is null then
+        raise exception 'Không có cột leaderboard: %', p_stat;
+    end if;
+
+    execute format('select %I from leaderboard where player_id = $1', p_stat)
+        into v using p_player_id;
+    if v is null then
+        return;
+    end if;
+
+    return query select
+        1
+        + coalesce((select sum(b.players) from leaderboard_buckets b
+                    where b.stat = p_stat and b.width = w and b.bucket > v / w), 0)::bigint
+        + coalesce((select sum(b.players) from leaderboard_buckets b
+                    where b.stat = p_stat and b.width = 1 and b.bucket > v
+                      and b.bucket < (v / w + 1) * w), 0)::bigint,
+        v;
+end
+$$;
+
+-- Player có từ trước bảng leaderboard: lấp bằng
+--   python migrate_players.py --leaderboard
+-- (stats tính từ state thật: snapshot giải nén + replay event sau nó, không
+-- đọc thẳng players.data vì snapshot có thể nén hoặc cũ hơn event mới nhất)
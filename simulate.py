@@ -0,0 +1,336 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from multiprocessing import Pool
+
+import numpy as np
+
+import game
+
+# ================= MÔ PHỎNG KINH TẾ =================
+# Monte Carlo cho cân bằng game: N player giả chơi D ngày, mỗi giờ là một
+# bước tính trên cả mảng NumPy (không có vòng lặp Python theo player / action).
+# Luật lấy từ game.py (bảng rương, ITEMS, DEBUFFS, task_modifiers, giá rèn,
+# ACHIEVEMENTS); PARAMS chỉ cho phép ghi đè để thử giá trị khác.
+# Cần numpy (công cụ dev, app không dùng nên không có trong requirements.txt).
+#
+# Mô hình người chơi (đơn giản hoá, xem simulate_hour):
+#   - mỗi giờ trong ACTIVE_HOURS làm 1 task với xác suất tasks_per_day / số giờ,
+#     points như slider trong UI (TASK_POINTS), thiếu energy thì bỏ lượt
+#   - dư points thì rèn kiếm trước, rồi mở rương; item dùng ngay khi nhận
+#   - energy hồi liên tục theo giờ, Choáng trừ phần hồi bị khoá
+#   - phần thưởng achievement không được tính, chỉ ghi ngày đạt
+#
+#   python simulate.py --players 200000 --days 30
+#   python simulate.py --grid curse_chance=0.1,0.2,0.3 --grid boss_hp=800,1000,1200
+#   python simulate.py --grid chest_cost=30,50,80 --jobs 8 --out sweep.json
+
+TASK_POINTS = np.arange(10, 55, 5)  # slider "Points nhận được"
+ACTIVE_HOURS = range(7, 24)
+
+# giờ → (hệ số damage, tỉ lệ debuff) theo task_modifiers
+HOUR_MODIFIERS = [game.task_modifiers(datetime(2000, 1, 1, h)) for h in range(24)]
+DAY_DEBUFF_CHANCE = HOUR_MODIFIERS[12][1]
+NIGHT_HOURS = np.array([m[1] != DAY_DEBUFF_CHANCE for m in HOUR_MODIFIERS])
+
+PARAMS = {
+    "tasks_per_day": 6,
+    "boss_hp": game.BOSS_MAX_HP,
+    "task_energy_cost": game.TASK_ENERGY_COST,
+    "chest_cost": game.CHEST_COST,
+    "curse_chance": game.CHEST_CURSE_CHANCE,
+    "debuff_chance": DAY_DEBUFF_CHANCE,
+    "night_debuff_chance": max(m[1] for m in HOUR_MODIFIERS),
+    "sword_price": game.FORGE_PRICES["sword"],
+    "forge": 1,        # 0: không rèn kiếm
+    "open_chests": 1,  # 0: không mở rương
+    "reserve": 0,      # giữ lại bao nhiêu points trước khi tiêu
+}
+
+# ===== ITEM TABLES =====
+# CHEST_ITEMS → mảng loại / giá trị để tra theo index rơi ra
+ITEM_TYPES = ["none", "energy", "damage", "percent_damage", "points", "max_energy"]
+CHEST_TYPE = np.array([ITEM_TYPES.index(game.ITEMS[i]["type"]) for i in game.CHEST_ITEMS])
+CHEST_VALUE = np.array([game.ITEMS[i]["value"] for i in game.CHEST_ITEMS], dtype=float)
+
+
+# ===== DEBUFFS =====
+# bản vector của DEBUFFS[i]["apply"], khoá theo tên; half_damage xử lý trong simulate_hour
+def _fatigue(s, hit):
+    s["penalty"][hit] = 5
+
+
+def _injury(s, hit):
+    s["energy"][hit] = np.maximum(0, s["energy"][hit] - 20)
+
+
+def _stun(s, hit):
+    s["block"][hit] = 600
+
+
+def _temptation(s, hit):
+    s["points"][hit] = np.maximum(0, s["points"][hit] - 10)
+
+
+DEBUFF_EFFECTS = {
+    "Mệt Mỏi": _fatigue,
+    "Chấn Thương": _injury,
+    "Choáng": _stun,
+    "Cám Dỗ": _temptation,
+}
+
+missing = [
+    b["name"] for b in game.DEBUFFS
+    if b.get("type") != "half_damage" and b["name"] not in DEBUFF_EFFECTS
+]
+assert not missing, f"thiếu bản vector cho debuff: {missing}"
+
+HALF_DAMAGE = np.array([b.get("type") == "half_damage" for b in game.DEBUFFS])
+
+
+# ===== ACHIEVEMENTS =====
+# stat của document → mảng trong state (achievement theo stat khác bị bỏ qua)
+STAT_ARRAYS = {
+    "total_points": "total_points",
+    "tasks_done": "tasks_done",
+    "boss_kills": "boss_kills",
+    "streak": "streak",
+}
+TRACKED = {k: a for k, a in game.ACHIEVEMENTS.items() if a["stat"] in STAT_ARRAYS}
+
+
+def new_state(n, p):
+    state = {
+        "points": np.zeros(n),
+        "total_points": np.zeros(n),
+        "energy": np.full(n, float(game.BASE_MAX_ENERGY)),
+        "bonus_max_energy": np.zeros(n),
+        "sword": np.ones(n),
+        "boss_hp": np.full(n, float(p["boss_hp"])),
+        "boss_kills": np.zeros(n),
+        "tasks_done": np.zeros(n),
+        "penalty": np.zeros(n),
+        "block": np.zeros(n),  # số giây còn bị khoá hồi energy
+        "streak": np.zeros(n),
+        "active": np.zeros(n, dtype=bool),
+        "chests": np.zeros(n),
+        "skipped": np.zeros(n),  # lượt muốn làm task nhưng thiếu energy
+    }
+    for key in TRACKED:
+        state[f"day_{key}"] = np.full(n, np.nan)
+    return state
+
+
+def kill_boss(s, p):
+    dead = s["boss_hp"] <= 0
+    s["boss_kills"][dead] += 1
+    s["boss_hp"][dead] = p["boss_hp"]
+
+
+def regen(s, seconds):
+    blocked = np.minimum(s["block"], seconds)
+    s["block"] -= blocked
+    cap = game.BASE_MAX_ENERGY + s["bonus_max_energy"]
+    s["energy"] = np.minimum(cap, s["energy"] + (seconds - blocked) / game.ENERGY_REGEN_SECONDS)
+    return cap
+
+
+def simulate_hour(s, p, hour, rng):
+    n = len(s["points"])
+    cap = regen(s, 3600)
+
+    # ngoài giờ chơi chỉ hồi energy: points không đổi nên cũng không tiêu gì
+    if hour not in ACTIVE_HOURS:
+        return
+
+    # mọi số ngẫu nhiên của giờ này trong một lần gọi:
+    # [làm task, debuff, rương bị nguyền] + [điểm task, loại debuff, pts mất, item rơi]
+    roll = rng.random((3, n), dtype=np.float32)
+    pick = rng.random((4, n), dtype=np.float32)
+
+    # ===== TASK =====
+    acting = roll[0] < p["tasks_per_day"] / len(ACTIVE_HOURS)
+    cost = p["task_energy_cost"] + s["penalty"]
+    done = acting & (s["energy"] >= cost)
+    s["skipped"] += acting & ~done
+
+    pts = np.where(done, TASK_POINTS[(pick[0] * len(TASK_POINTS)).astype(int)], 0)
+    s["energy"] -= np.where(done, cost, 0)
+    s["penalty"][done] = 0
+    s["points"] += pts
+    s["total_points"] += pts
+    s["tasks_done"] += done
+    s["active"] |= done
+
+    dmg = (pts // 2) * s["sword"] * HOUR_MODIFIERS[hour][0]
+
+    chance = p["night_debuff_chance"] if NIGHT_HOURS[hour] else p["debuff_chance"]
+    hit = done & (roll[1] < chance)
+    kind = (pick[1] * len(game.DEBUFFS)).astype(int)
+
+    dmg = np.where(hit & HALF_DAMAGE[kind], dmg // 2, dmg)
+    for i, debuff in enumerate(game.DEBUFFS):
+        if not HALF_DAMAGE[i]:
+            DEBUFF_EFFECTS[debuff["name"]](s, hit & (kind == i))
+
+    s["boss_hp"] -= dmg
+    kill_boss(s, p)
+
+    # ===== FORGE =====
+    if p["forge"]:
+        price = s["sword"] * p["sword_price"]
+        forging = s["points"] >= price + p["reserve"]
+        s["points"] -= np.where(forging, price, 0)
+        s["sword"] += forging
+
+    # ===== CHEST =====
+    if p["open_chests"]:
+        opening = s["points"] >= p["chest_cost"] + p["reserve"]
+        s["points"] -= np.where(opening, p["chest_cost"], 0)
+        s["chests"] += opening
+
+        cursed = opening & (roll[2] < p["curse_chance"])
+        lost = 10 + (pick[2] * 21).astype(int)  # randint(10, 30)
+        s["points"] = np.where(cursed, np.maximum(0, s["points"] - lost), s["points"])
+
+        drop = (pick[3] * len(game.CHEST_ITEMS)).astype(int)
+        kind = np.where(opening, CHEST_TYPE[drop], 0)
+        value = CHEST_VALUE[drop]
+
+        is_energy = kind == ITEM_TYPES.index("energy")
+        s["energy"] = np.where(is_energy, np.minimum(cap, s["energy"] + value), s["energy"])
+
+        s["boss_hp"] -= np.where(kind == ITEM_TYPES.index("damage"), value, 0)
+        percent = kind == ITEM_TYPES.index("percent_damage")
+        s["boss_hp"] -= np.where(percent, np.floor(s["boss_hp"] * value), 0)
+
+        is_points = kind == ITEM_TYPES.index("points")
+        s["points"] = np.where(is_points, np.maximum(0, s["points"] + value), s["points"])
+
+        s["bonus_max_energy"] += np.where(kind == ITEM_TYPES.index("max_energy"), value, 0)
+        kill_boss(s, p)
+
+
+def end_of_day(s, day):
+    s["streak"] = np.where(s["active"], s["streak"] + 1, 0)
+    s["active"][:] = False
+
+    for key, ach in TRACKED.items():
+        first = np.isnan(s[f"day_{key}"]) & (s[STAT_ARRAYS[ach["stat"]]] >= ach["threshold"])
+        s[f"day_{key}"][first] = day + 1
+
+
+def percentiles(values):
+    p10, p50, p90 = np.percentile(values, [10, 50, 90])
+    return {"mean": float(values.mean()), "p10": float(p10), "p50": float(p50), "p90": float(p90)}
+
+
+def report(s, days):
+    out = {
+        "points": percentiles(s["points"]),
+        "total_points": percentiles(s["total_points"]),
+        "tasks_done": percentiles(s["tasks_done"]),
+        "sword": percentiles(s["sword"]),
+        "chests": percentiles(s["chests"]),
+        "boss_kills": percentiles(s["boss_kills"]),
+        "boss_kills_per_day": float(s["boss_kills"].mean() / days),
+        "killed_any_boss": float((s["boss_kills"] > 0).mean()),
+        "no_energy_rate": float(s["skipped"].sum() / max(1, s["skipped"].sum() + s["tasks_done"].sum())),
+        "achievements": {},
+    }
+
+    for key in TRACKED:
+        reached = s[f"day_{key}"][~np.isnan(s[f"day_{key}"])]
+        out["achievements"][key] = {
+            "reached": float(len(reached) / len(s["points"])),
+            "day": percentiles(reached) if len(reached) else None,
+        }
+    return out
+
+
+def simulate(params, players, days, seed):
+    p = {**PARAMS, **params}
+    rng = np.random.default_rng(seed)
+    s = new_state(players, p)
+
+    for day in range(days):
+        for hour in range(24):
+            simulate_hour(s, p, hour, rng)
+        end_of_day(s, day)
+
+    return report(s, days)
+
+
+def _run(job):
+    params, players, days, seed = job
+    start = time.perf_counter()
+    result = simulate(params, players, days, seed)
+    return {"params": params, "seconds": round(time.perf_counter() - start, 2), **result}
+
+
+def parse_grid(specs):
+    # ["boss_hp=800,1000", ...] → list các dict tham số (tích Descartes)
+    axes = {}
+    for spec in specs:
+        key, _, values = spec.partition("=")
+        if key not in PARAMS:
+            raise SystemExit(f"Không có tham số {key!r} (có: {', '.join(PARAMS)})")
+        axes[key] = [float(v) for v in values.split(",")]
+    return [dict(zip(axes, combo)) for combo in itertools.product(*axes.values())]
+
+
+def print_result(r):
+    label = ", ".join(f"{k}={v:g}" for k, v in r["params"].items()) or "mặc định"
+    print(f"== {label} ({r['seconds']}s)")
+    for key in ("total_points", "points", "sword", "chests", "boss_kills"):
+        v = r[key]
+        print(f"   {key:<13} mean {v['mean']:>9.1f}  p10 {v['p10']:>8.0f}  p50 {v['p50']:>8.0f}  p90 {v['p90']:>8.0f}")
+    print(
+        f"   boss/ngày {r['boss_kills_per_day']:.2f} · có hạ boss {r['killed_any_boss']:.0%} · "
+        f"thiếu energy {r['no_energy_rate']:.1%}"
+    )
+    for key, a in r["achievements"].items():
+        when = f"ngày p50 {a['day']['p50']:.0f} (p90 {a['day']['p90']:.0f})" if a["day"] else "-"
+        print(f"   🏆 {key:<16} {a['reached']:>6.1%}  {when}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mô phỏng Monte Carlo kinh tế The Grind RPG")
+    parser.add_argument("--players", type=int, default=100_000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--grid", action="append", default=[], metavar="KEY=V1,V2",
+                        help=f"quét tham số, lặp lại được ({', '.join(PARAMS)})")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="số process (mặc định: mọi core)")
+    parser.add_argument("--out", help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    grid = parse_grid(args.grid) or [{}]
+    jobs = [(params, args.players, args.days, args.seed + i) for i, params in enumerate(grid)]
+
+    start = time.perf_counter()
+    if len(jobs) == 1 or args.jobs == 1:
+        results = [_run(job) for job in jobs]
+    else:
+        with Pool(min(args.jobs, len(jobs))) as pool:
+            results = pool.map(_run, jobs)
+
+    for r in results:
+        print_result(r)
+    print(
+        f"{len(jobs)} cấu hình × {args.players} player × {args.days} ngày "
+        f"trong {time.perf_counter() - start:.1f}s",
+        file=sys.stderr
+    )
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1108 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, insort
+from functools import wraps
+
+import codec
+
+# ================= STORAGE BACKENDS =================
+# Mọi chỗ đọc/ghi dữ liệu player đều đi qua interface này:
+#   get_player / get_version / insert_player / update_player (CAS theo version)
+#   append_history / read_history / query_history (phân trang) / delete_history
+#   update_leaderboard / top_players / player_rank (bảng leaderboard có index)
+#   scan_players (batch, duyệt theo id)
+#   append_event(s) / append_events_many / read_events / read_events_many / get_head (action log)
+#   save_snapshot / get_snapshot
+# Chọn backend bằng make_storage("supabase" | "sqlite" | "memory", ...).
+# Document của player được lưu ở dạng compact (codec.py), đọc ra là dict thường.
+
+HISTORY_COLUMNS = {
+    "task_history": ("name", "points", "date"),
+    "treat_history": ("name", "cost", "time"),
+}
+
+# row lịch sử còn có cột reset_at: mốc Reset (game.action_reset) của state lúc
+# tạo row, 0 = chưa Reset lần nào. Đọc truyền reset_at của state hiện tại để chỉ
+# lấy lịch sử từ lần Reset đó, None = mọi row
+
+# cột thời gian dạng "%Y-%m-%d %H:%M" → so sánh chuỗi đúng thứ tự thời gian
+HISTORY_TIME_COLUMN = {"task_history": "date", "treat_history": "time"}
+
+HISTORY_PAGE = 50
+
+SCAN_BATCH = 500
+
+EVENT_COLUMNS = ("seq", "type", "args", "seed", "ts")
+
+# read_events_many trên Supabase: mỗi request một nhóm player (URL vừa phải),
+# đọc từng trang vì PostgREST cắt kết quả ở max-rows (mặc định 1000)
+EVENTS_CHUNK = 50
+EVENTS_PAGE = 1000
+
+# cột của bảng leaderboard, mỗi cột một index (giá trị giảm dần, player_id)
+LEADERBOARD_COLUMNS = ("total_points", "boss_kills", "tasks_done")
+
+# histogram số player của từng cột, hai mức: bucket rộng (value // độ rộng) và
+# từng giá trị (độ rộng 1), giữ đồng bộ bằng trigger. Hạng = tổng các bucket
+# rộng phía trên + các giá trị lớn hơn trong bucket của mình: đọc tối đa
+# (max / độ rộng + độ rộng) row, không phụ thuộc số player (khớp schema.sql)
+LEADERBOARD_BUCKETS = {"total_points": 100, "boss_kills": 1, "tasks_done": 10}
+
+# HTTP tới Supabase: pool connection keep-alive dùng chung cả process
+CONNECT_TIMEOUT = 5   # giây
+READ_TIMEOUT = 15
+POOL_SIZE = 20
+KEEPALIVE_EXPIRY = 60
+
+# đọc lỗi mạng / 5xx thì thử lại, chờ ngẫu nhiên trong [0, min(CAP, BASE * 2^lần)]
+READ_RETRIES = 3
+RETRY_BASE = 0.2
+RETRY_CAP = 2.0
+
+
+class Storage:
+    def get_player(self, player_id):
+        # → (data, version) hoặc None
+        raise NotImplementedError
+
+    def get_version(self, player_id):
+        # → version hoặc None nếu player chưa tồn tại
+        raise NotImplementedError
+
+    def insert_player(self, player_id, data, version=0):
+        raise NotImplementedError
+
+    def update_player(self, player_id, data, expected_version, version):
+        # chỉ ghi khi version hiện tại == expected_version → True/False
+        raise NotImplementedError
+
+    def append_history(self, table, player_id, rows):
+        # row có "src" (vị trí trong blob cũ, xem migrations.move_history): row
+        # trùng (player_id, src) đã có thì bỏ qua → migrate chạy lặp không ghi đôi
+        raise NotImplementedError
+
+    def read_history(self, table, player_id, after_id=0, limit=None, reset_at=None):
+        # → list row (có "id"), sắp theo id tăng dần
+        raise NotImplementedError
+
+    def query_history(self, table, player_id, before_id=None, limit=HISTORY_PAGE,
+                      date_from=None, date_to=None, search=None, reset_at=None):
+        # một trang, mới nhất trước, phân trang bằng keyset (id < before_id).
+        # date_from <= thời gian < date_to (chuỗi "YYYY-MM-DD"), search: tên chứa chuỗi
+        raise NotImplementedError
+
+    def delete_history(self, player_id):
+        raise NotImplementedError
+
+    def update_leaderboard(self, player_id, stats):
+        # stats: {cột trong LEADERBOARD_COLUMNS: giá trị}, upsert theo player_id
+        raise NotImplementedError
+
+    def top_players(self, stat, limit=10):
+        # → list (player_id, value) giảm dần theo stat, bằng nhau thì theo player_id
+        raise NotImplementedError
+
+    def player_rank(self, player_id, stat):
+        # → (hạng, value) với hạng = 1 + số player có stat lớn hơn, None nếu chưa có row
+        raise NotImplementedError
+
+    def scan_players(self, after_id="", limit=SCAN_BATCH):
+        # → list (player_id, data, version) có id > after_id, sắp theo id
+        raise NotImplementedError
+
+    def append_event(self, player_id, event):
+        # seq đã có người ghi → False (dùng thay cho CAS khi ghi action)
+        raise NotImplementedError
+
+    def append_events(self, player_id, events):
+        # ghi nhiều event trong một request / transaction: tất cả hoặc không gì cả
+        raise NotImplementedError
+
+    def read_events(self, player_id, after_seq=0, upto_seq=None):
+        # → list event có after_seq < seq <= upto_seq, sắp theo seq tăng dần
+        raise NotImplementedError
+
+    def read_events_many(self, after_seqs):
+        # after_seqs: {player_id: seq} → {player_id: list event có seq > seq đó},
+        # một query cho cả batch (worker)
+        raise NotImplementedError
+
+    def append_events_many(self, events):
+        # events: {player_id: list event} → set player_id đã ghi; player có seq
+        # bị trùng thì không ghi gì của player đó (như append_events). Mặc định
+        # ghi từng player, backend có insert nhiều player một lần thì ghi đè
+        return {
+            player_id for player_id, rows in events.items()
+            if self.append_events(player_id, rows)
+        }
+
+    def get_head(self, player_id):
+        # → seq của event mới nhất (hoặc version snapshot nếu chưa có event), None nếu chưa có player
+        raise NotImplementedError
+
+    def save_snapshot(self, player_id, seq, data):
+        raise NotImplementedError
+
+    def get_snapshot(self, player_id, upto_seq):
+        # → (data, seq) của snapshot mới nhất có seq <= upto_seq, hoặc None
+        raise NotImplementedError
+
+
+# ================= SUPABASE =================
+def _transient(e):
+    # lỗi đáng thử lại: timeout / mất kết nối, hoặc server quá tải / lỗi tạm
+    import httpx
+
+    if isinstance(e, httpx.TransportError):
+        return True
+    return str(getattr(e, "code", "")) in ("408", "429", "500", "502", "503", "504")
+
+
+def _quote(value):
+    # giá trị trong filter or=(...) của PostgREST: dấu , ( ) phải nằm trong ngoặc kép
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _like_escape(text):
+    # chuỗi người dùng gõ trong pattern like / ilike: % _ \ là ký tự thường
+    # (như SQLite / Memory tìm theo chuỗi con). PostgREST còn đổi * thành %,
+    # không escape được nên * vẫn khớp mọi chuỗi
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def retry_read(fn):
+    # chỉ dùng cho thao tác đọc: ghi (insert event...) mà thử lại thì lần đầu có
+    # thể đã thành công, lần sau báo trùng seq → session chạy lại action hai lần
+    @wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        for attempt in range(self.read_retries + 1):
+            try:
+                return fn(self, *args, **kwargs)
+            except Exception as e:
+                if attempt == self.read_retries or not _transient(e):
+                    raise
+            time.sleep(random.uniform(0, min(RETRY_CAP, RETRY_BASE * 2 ** attempt)))
+    return wrapper
+
+
+class SupabaseStorage(Storage):
+    def __init__(self, client, read_retries=READ_RETRIES):
+        self.client = client
+        self.read_retries = read_retries
+
+    @retry_read
+    def get_player(self, player_id):
+        res = self.client.table("players") \
+            .select("data, version") \
+            .eq("id", player_id) \
+            .execute()
+
+        if not res.data:
+            return None
+        return codec.decode(res.data[0]["data"]), res.data[0].get("version") or 0
+
+    @retry_read
+    def get_version(self, player_id):
+        res = self.client.table("players") \
+            .select("version") \
+            .eq("id", player_id) \
+            .execute()
+
+        if not res.data:
+            return None
+        return res.data[0].get("version") or 0
+
+    def insert_player(self, player_id, data, version=0):
+        self.client.table("players").insert({
+            "id": player_id,
+            "data": codec.pack(data)[0],
+            "version": version
+        }).execute()
+
+    def update_player(self, player_id, data, expected_version, version):
+        res = self.client.table("players").update({
+            "data": codec.pack(data)[0],
+            "version": version
+        }).eq("id", player_id).eq("version", expected_version).execute()
+
+        return bool(res.data)
+
+    def append_history(self, table, player_id, rows):
+        for i in range(0, len(rows), SCAN_BATCH):
+            batch = [
+                {"player_id": player_id, **row, "reset_at": row.get("reset_at", 0)}
+                for row in rows[i:i + SCAN_BATCH]
+            ]
+            if any("src" in row for row in batch):
+                self.client.table(table).upsert(
+                    batch, on_conflict="player_id,src", ignore_duplicates=True
+                ).execute()
+            else:
+                self.client.table(table).insert(batch).execute()
+
+    @retry_read
+    def read_history(self, table, player_id, after_id=0, limit=None, reset_at=None):
+        query = self.client.table(table) \
+            .select(", ".join(("id",) + HISTORY_COLUMNS[table])) \
+            .eq("player_id", player_id) \
+            .gt("id", after_id) \
+            .order("id")
+
+        if reset_at is not None:
+            query = query.eq("reset_at", reset_at)
+        if limit is not None:
+            query = query.limit(limit)
+        return query.execute().data
+
+    @retry_read
+    def query_history(self, table, player_id, before_id=None, limit=HISTORY_PAGE,
+                      date_from=None, date_to=None, search=None, reset_at=None):
+        time_column = HISTORY_TIME_COLUMN[table]
+        query = self.client.table(table) \
+            .select(", ".join(("id",) + HISTORY_COLUMNS[table])) \
+            .eq("player_id", player_id)
+
+        if reset_at is not None:
+            query = query.eq("reset_at", reset_at)
+        if before_id is not None:
+            query = query.lt("id", before_id)
+        if date_from:
+            query = query.gte(time_column, date_from)
+        if date_to:
+            query = query.lt(time_column, date_to)
+        if search:
+            query = query.ilike("name", f"%{_like_escape(search)}%")
+
+        return query.order("id", desc=True).limit(limit).execute().data
+
+    def delete_history(self, player_id):
+        for table in HISTORY_COLUMNS:
+            self.client.table(table).delete().eq("player_id", player_id).execute()
+
+    def update_leaderboard(self, player_id, stats):
+        self.client.table("leaderboard").upsert({
+            "player_id": player_id,
+            **{c: stats.get(c, 0) for c in LEADERBOARD_COLUMNS}
+        }).execute()
+
+    @retry_read
+    def top_players(self, stat, limit=10):
+        res = self.client.table("leaderboard") \
+            .select(f"player_id, {stat}") \
+            .order(stat, desc=True) \
+            .order("player_id") \
+            .limit(limit) \
+            .execute()
+
+        return [(r["player_id"], r[stat]) for r in res.data]
+
+    @retry_read
+    def player_rank(self, player_id, stat):
+        # hàm leaderboard_rank trong schema.sql: một round trip, đọc histogram
+        res = self.client.rpc(
+            "leaderboard_rank", {"p_player_id": player_id, "p_stat": stat}
+        ).execute()
+
+        if not res.data:
+            return None
+        return res.data[0]["rank"], res.data[0]["value"]
+
+    @retry_read
+    def scan_players(self, after_id="", limit=SCAN_BATCH):
+        res = self.client.table("players") \
+            .select("id, data, version") \
+            .gt("id", after_id) \
+            .order("id") \
+            .limit(limit) \
+            .execute()
+
+        return [(r["id"], codec.decode(r["data"]), r.get("version") or 0) for r in res.data]
+
+    def append_event(self, player_id, event):
+        try:
+            self.client.table("player_events").insert({
+                "player_id": player_id,
+                **{c: event[c] for c in EVENT_COLUMNS}
+            }).execute()
+        except Exception as e:
+            # 23505 = unique_violation: seq này đã có session khác ghi
+            if getattr(e, "code", None) == "23505":
+                return False
+            raise
+
+        return True
+
+    def append_events(self, player_id, events):
+        if not events:
+            return True
+
+        # một câu insert nhiều row: Postgres chạy trong một transaction
+        try:
+            self.client.table("player_events").insert([
+                {"player_id": player_id, **{c: event[c] for c in EVENT_COLUMNS}}
+                for event in events
+            ]).execute()
+        except Exception as e:
+            if getattr(e, "code", None) == "23505":
+                return False
+            raise
+
+        return True
+
+    def append_events_many(self, events):
+        events = {pid: rows for pid, rows in events.items() if rows}
+        if not events:
+            return set()
+
+        # cả batch một request; có player bị trùng seq thì cả câu bị huỷ →
+        # ghi lại từng player để biết player nào trùng
+        try:
+            self.client.table("player_events").insert([
+                {"player_id": player_id, **{c: event[c] for c in EVENT_COLUMNS}}
+                for player_id, rows in events.items() for event in rows
+            ]).execute()
+        except Exception as e:
+            if getattr(e, "code", None) == "23505":
+                return super().append_events_many(events)
+            raise
+
+        return set(events)
+
+    @retry_read
+    def read_events(self, player_id, after_seq=0, upto_seq=None):
+        query = self.client.table("player_events") \
+            .select(", ".join(EVENT_COLUMNS)) \
+            .eq("player_id", player_id) \
+            .gt("seq", after_seq)
+
+        if upto_seq is not None:
+            query = query.lte("seq", upto_seq)
+        return query.order("seq").execute().data
+
+    @retry_read
+    def read_events_many(self, after_seqs):
+        if not after_seqs:
+            return {}
+
+        events = {}
+        ids = list(after_seqs)
+        for i in range(0, len(ids), EVENTS_CHUNK):
+            # đúng seq của từng player: or=(and(player_id.eq.a,seq.gt.5),...)
+            where = ",".join(
+                f"and(player_id.eq.{_quote(pid)},seq.gt.{int(after_seqs[pid])})"
+                for pid in ids[i:i + EVENTS_CHUNK]
+            )
+
+            offset = 0
+            while True:
+                rows = self.client.table("player_events") \
+                    .select(", ".join(("player_id",) + EVENT_COLUMNS)) \
+                    .or_(where) \
+                    .order("player_id") \
+                    .order("seq") \
+                    .range(offset, offset + EVENTS_PAGE - 1) \
+                    .execute().data
+
+                for r in rows:
+                    player_id = r.pop("player_id")
+                    player_events = events.setdefault(player_id, [])
+                    # event mới chèn giữa hai trang đẩy row cũ sang trang sau
+                    if not player_events or r["seq"] > player_events[-1]["seq"]:
+                        player_events.append(r)
+
+                if len(rows) < EVENTS_PAGE:
+                    break
+                offset += EVENTS_PAGE
+
+        return events
+
+    @retry_read
+    def get_head(self, player_id):
+        res = self.client.table("player_events") \
+            .select("seq") \
+            .eq("player_id", player_id) \
+            .order("seq", desc=True) \
+            .limit(1) \
+            .execute()
+
+        if res.data:
+            return res.data[0]["seq"]
+        return self.get_version(player_id)
+
+    def save_snapshot(self, player_id, seq, data):
+        self.client.table("player_snapshots").upsert({
+            "player_id": player_id,
+            "seq": seq,
+            "data": codec.pack(data)[0]
+        }).execute()
+
+    @retry_read
+    def get_snapshot(self, player_id, upto_seq):
+        res = self.client.table("player_snapshots") \
+            .select("seq, data") \
+            .eq("player_id", player_id) \
+            .lte("seq", upto_seq) \
+            .order("seq", desc=True) \
+            .limit(1) \
+            .execute()
+
+        if not res.data:
+            return None
+        return codec.decode(res.data[0]["data"]), res.data[0]["seq"]
+
+
+# ================= SQLITE =================
+class SQLiteStorage(Storage):
+    def __init__(self, path="grind.db"):
+        # một connection dùng chung cho mọi session của process
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        # lower() của SQLite chỉ hiểu ASCII → tìm kiếm tên tiếng Việt dùng casefold
+        self.conn.create_function(
+            "casefold", 1, lambda s: s.casefold() if s else s, deterministic=True
+        )
+
+        with self.lock, self.conn:
+            self.conn.execute("pragma journal_mode=wal")
+            self.conn.execute("""
+                create table if not exists players (
+                    id text primary key,
+                    data text not null,
+                    version integer not null default 0
+                )
+            """)
+            for table, columns in HISTORY_COLUMNS.items():
+                self.conn.execute(f"""
+                    create table if not exists {table} (
+                        id integer primary key autoincrement,
+                        player_id text not null,
+                        {", ".join(f"{c} not null" for c in columns)}
+                    )
+                """)
+                self.conn.execute(
+                    f"create index if not exists {table}_player_idx on {table} (player_id, id)"
+                )
+                # row chuyển từ blob cũ: src = vị trí trong blob, row thường để null
+                if "src" not in (r[1] for r in self.conn.execute(f"pragma table_info({table})")):
+                    self.conn.execute(f"alter table {table} add column src integer")
+                self.conn.execute(
+                    f"create unique index if not exists {table}_src_idx on {table} (player_id, src)"
+                )
+                if "reset_at" not in (r[1] for r in self.conn.execute(f"pragma table_info({table})")):
+                    self.conn.execute(
+                        f"alter table {table} add column reset_at integer not null default 0"
+                    )
+                self.conn.execute(
+                    f"create index if not exists {table}_reset_idx on {table} (player_id, reset_at, id)"
+                )
+            self.conn.execute("""
+                create table if not exists player_events (
+                    player_id text not null,
+                    seq integer not null,
+                    type text not null,
+                    args text not null,
+                    seed integer not null,
+                    ts real not null,
+                    primary key (player_id, seq)
+                )
+            """)
+            self.conn.execute("""
+                create table if not exists player_snapshots (
+                    player_id text not null,
+                    seq integer not null,
+                    data text not null,
+                    primary key (player_id, seq)
+                )
+            """)
+            self.conn.execute(f"""
+                create table if not exists leaderboard (
+                    player_id text primary key,
+                    {", ".join(f"{c} integer not null default 0" for c in LEADERBOARD_COLUMNS)}
+                )
+            """)
+            for column in LEADERBOARD_COLUMNS:
+                self.conn.execute(
+                    f"create index if not exists leaderboard_{column}_idx "
+                    f"on leaderboard ({column} desc, player_id)"
+                )
+
+            new_buckets = self.conn.execute(
+                "select 1 from sqlite_master where type = 'table' and name = 'leaderboard_buckets'"
+            ).fetchone() is None
+            self.conn.execute("""
+                create table if not exists leaderboard_buckets (
+                    stat text not null,
+                    width integer not null,
+                    bucket integer not null,
+                    players integer not null,
+                    primary key (stat, width, bucket)
+                )
+            """)
+            levels = [(c, w) for c, width in LEADERBOARD_BUCKETS.items() for w in sorted({1, width})]
+
+            # leaderboard có từ trước histogram: đếm một lần, sau đó trigger lo
+            if new_buckets:
+                for column, width in levels:
+                    self.conn.execute(
+                        "insert into leaderboard_buckets (stat, width, bucket, players) "
+                        f"select ?, ?, {column} / ?, count(*) from leaderboard group by 3",
+                        (column, width, width)
+                    )
+
+            add = "; ".join(
+                "insert into leaderboard_buckets (stat, width, bucket, players) "
+                f"values ('{c}', {w}, new.{c} / {w}, 1) "
+                "on conflict (stat, width, bucket) do update set players = players + 1"
+                for c, w in levels
+            )
+            remove = "; ".join(
+                "update leaderboard_buckets set players = players - 1 "
+                f"where stat = '{c}' and width = {w} and bucket = old.{c} / {w}"
+                for c, w in levels
+            )
+            self.conn.executescript(f"""
+                create trigger if not exists leaderboard_buckets_insert
+                after insert on leaderboard begin {add}; end;
+                create trigger if not exists leaderboard_buckets_update
+                after update on leaderboard begin {remove}; {add}; end;
+                create trigger if not exists leaderboard_buckets_delete
+                after delete on leaderboard begin {remove}; end;
+            """)
+
+    def get_player(self, player_id):
+        with self.lock:
+            row = self.conn.execute(
+                "select data, version from players where id = ?", (player_id,)
+            ).fetchone()
+
+        if row is None:
+            return None
+        return codec.loads(row[0]), row[1]
+
+    def get_version(self, player_id):
+        with self.lock:
+            row = self.conn.execute(
+                "select version from players where id = ?", (player_id,)
+            ).fetchone()
+
+        return None if row is None else row[0]
+
+    def insert_player(self, player_id, data, version=0):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "insert into players (id, data, version) values (?, ?, ?)",
+                (player_id, codec.dumps(data), version)
+            )
+
+    def update_player(self, player_id, data, expected_version, version):
+        with self.lock, self.conn:
+            cur = self.conn.execute(
+                "update players set data = ?, version = ? where id = ? and version = ?",
+                (codec.dumps(data), version, player_id, expected_version)
+            )
+
+        return cur.rowcount > 0
+
+    def append_history(self, table, player_id, rows):
+        columns = HISTORY_COLUMNS[table]
+
+        with self.lock, self.conn:
+            self.conn.executemany(
+                f"insert into {table} (player_id, {', '.join(columns)}, src, reset_at) "
+                f"values (?, {', '.join('?' for _ in columns)}, ?, ?) "
+                "on conflict (player_id, src) do nothing",
+                [
+                    (player_id, *(row[c] for c in columns), row.get("src"), row.get("reset_at", 0))
+                    for row in rows
+                ]
+            )
+
+    def read_history(self, table, player_id, after_id=0, limit=None, reset_at=None):
+        columns = ("id",) + HISTORY_COLUMNS[table]
+        where, params = ["player_id = ?", "id > ?"], [player_id, after_id]
+
+        if reset_at is not None:
+            where.append("reset_at = ?")
+            params.append(reset_at)
+
+        with self.lock:
+            rows = self.conn.execute(
+                f"select {', '.join(columns)} from {table} "
+                f"where {' and '.join(where)} order by id limit ?",
+                (*params, -1 if limit is None else limit)
+            ).fetchall()
+
+        return [dict(zip(columns, row)) for row in rows]
+
+    def query_history(self, table, player_id, before_id=None, limit=HISTORY_PAGE,
+                      date_from=None, date_to=None, search=None, reset_at=None):
+        columns = ("id",) + HISTORY_COLUMNS[table]
+        time_column = HISTORY_TIME_COLUMN[table]
+        where, params = ["player_id = ?"], [player_id]
+
+        if reset_at is not None:
+            where.append("reset_at = ?")
+            params.append(reset_at)
+        if before_id is not None:
+            where.append("id < ?")
+            params.append(before_id)
+        if date_from:
+            where.append(f"{time_column} >= ?")
+            params.append(date_from)
+        if date_to:
+            where.append(f"{time_column} < ?")
+            params.append(date_to)
+        if search:
+            where.append("instr(casefold(name), ?) > 0")
+            params.append(search.casefold())
+
+        with self.lock:
+            rows = self.conn.execute(
+                f"select {', '.join(columns)} from {table} "
+                f"where {' and '.join(where)} order by id desc limit ?",
+                (*params, limit)
+            ).fetchall()
+
+        return [dict(zip(columns, row)) for row in rows]
+
+    def delete_history(self, player_id):
+        with self.lock, self.conn:
+            for table in HISTORY_COLUMNS:
+                self.conn.execute(f"delete from {table} where player_id = ?", (player_id,))
+
+    def update_leaderboard(self, player_id, stats):
+        # upsert thay cho "insert or replace": replace xoá row mà không chạy
+        # trigger delete → histogram lệch
+        with self.lock, self.conn:
+            self.conn.execute(
+                f"insert into leaderboard (player_id, {', '.join(LEADERBOARD_COLUMNS)}) "
+                f"values (?, {', '.join('?' for _ in LEADERBOARD_COLUMNS)}) "
+                "on conflict (player_id) do update set "
+                + ", ".join(f"{c} = excluded.{c}" for c in LEADERBOARD_COLUMNS),
+                (player_id, *(stats.get(c, 0) for c in LEADERBOARD_COLUMNS))
+            )
+
+    def top_players(self, stat, limit=10):
+        if stat not in LEADERBOARD_COLUMNS:
+            raise ValueError(f"Không có cột leaderboard: {stat}")
+
+        with self.lock:
+            rows = self.conn.execute(
+                f"select player_id, {stat} from leaderboard "
+                f"order by {stat} desc, player_id limit ?",
+                (limit,)
+            ).fetchall()
+
+        return rows
+
+    def player_rank(self, player_id, stat):
+        if stat not in LEADERBOARD_COLUMNS:
+            raise ValueError(f"Không có cột leaderboard: {stat}")
+
+        # bucket rộng cao hơn + giá trị lớn hơn mình trong cùng bucket rộng
+        width = LEADERBOARD_BUCKETS[stat]
+        with self.lock:
+            row = self.conn.execute(
+                "select 1 + coalesce((select sum(players) from leaderboard_buckets"
+                f"  where stat = ? and width = ? and bucket > me.{stat} / ?), 0)"
+                " + coalesce((select sum(players) from leaderboard_buckets"
+                f"  where stat = ? and width = 1 and bucket > me.{stat}"
+                f"  and bucket < (me.{stat} / ? + 1) * ?), 0), {stat} "
+                "from leaderboard as me where player_id = ?",
+                (stat, width, width, stat, width, width, player_id)
+            ).fetchone()
+
+        return row
+
+    def scan_players(self, after_id="", limit=SCAN_BATCH):
+        with self.lock:
+            rows = self.conn.execute(
+                "select id, data, version from players where id > ? order by id limit ?",
+                (after_id, limit)
+            ).fetchall()
+
+        return [(pid, codec.loads(data), version) for pid, data, version in rows]
+
+    def append_event(self, player_id, event):
+        try:
+            with self.lock, self.conn:
+                self.conn.execute(
+                    "insert into player_events (player_id, seq, type, args, seed, ts) "
+                    "values (?, ?, ?, ?, ?, ?)",
+                    (player_id, event["seq"], event["type"],
+                     json.dumps(event["args"], ensure_ascii=False), event["seed"], event["ts"])
+                )
+        except sqlite3.IntegrityError:
+            return False
+
+        return True
+
+    def append_events(self, player_id, events):
+        try:
+            with self.lock, self.conn:
+                self.conn.executemany(
+                    "insert into player_events (player_id, seq, type, args, seed, ts) "
+                    "values (?, ?, ?, ?, ?, ?)",
+                    [
+                        (player_id, e["seq"], e["type"],
+                         json.dumps(e["args"], ensure_ascii=False), e["seed"], e["ts"])
+                        for e in events
+                    ]
+                )
+        except sqlite3.IntegrityError:
+            return False
+
+        return True
+
+    def append_events_many(self, events):
+        # một transaction cho cả batch; có player trùng seq → rollback, ghi từng player
+        try:
+            with self.lock, self.conn:
+                self.conn.executemany(
+                    "insert into player_events (player_id, seq, type, args, seed, ts) "
+                    "values (?, ?, ?, ?, ?, ?)",
+                    [
+                        (player_id, e["seq"], e["type"],
+                         json.dumps(e["args"], ensure_ascii=False), e["seed"], e["ts"])
+                        for player_id, rows in events.items() for e in rows
+                    ]
+                )
+        except sqlite3.IntegrityError:
+            return super().append_events_many(events)
+
+        return set(events)
+
+    def read_events(self, player_id, after_seq=0, upto_seq=None):
+        with self.lock:
+            rows = self.conn.execute(
+                f"select {', '.join(EVENT_COLUMNS)} from player_events "
+                "where player_id = ? and seq > ? and seq <= ? order by seq",
+                (player_id, after_seq, 2 ** 62 if upto_seq is None else upto_seq)
+            ).fetchall()
+
+        return [
+            {"seq": seq, "type": type_, "args": json.loads(args), "seed": seed, "ts": ts}
+            for seq, type_, args, seed, ts in rows
+        ]
+
+    def read_events_many(self, after_seqs):
+        if not after_seqs:
+            return {}
+
+        # bảng tạm (player_id, seq) join với primary key của player_events
+        with self.lock:
+            rows = self.conn.execute(
+                f"with since (player_id, seq) as (values {', '.join('(?, ?)' for _ in after_seqs)}) "
+                f"select e.player_id, {', '.join(f'e.{c}' for c in EVENT_COLUMNS)} "
+                "from since join player_events as e "
+                "on e.player_id = since.player_id and e.seq > since.seq "
+                "order by e.player_id, e.seq",
+                [v for item in after_seqs.items() for v in item]
+            ).fetchall()
+
+        events = {}
+        for player_id, seq, type_, args, seed, ts in rows:
+            events.setdefault(player_id, []).append(
+                {"seq": seq, "type": type_, "args": json.loads(args), "seed": seed, "ts": ts}
+            )
+        return events
+
+    def get_head(self, player_id):
+        with self.lock:
+            row = self.conn.execute(
+                "select max(version, coalesce("
+                "(select max(seq) from player_events where player_id = ?), 0)) "
+                "from players where id = ?",
+                (player_id, player_id)
+            ).fetchone()
+
+        return None if row is None else row[0]
+
+    def save_snapshot(self, player_id, seq, data):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "insert or replace into player_snapshots (player_id, seq, data) values (?, ?, ?)",
+                (player_id, seq, codec.dumps(data))
+            )
+
+    def get_snapshot(self, player_id, upto_seq):
+        with self.lock:
+            row = self.conn.execute(
+                "select data, seq from player_snapshots "
+                "where player_id = ? and seq <= ? order by seq desc limit 1",
+                (player_id, upto_seq)
+            ).fetchone()
+
+        if row is None:
+            return None
+        return codec.loads(row[0]), row[1]
+
+
+# ================= IN-MEMORY =================
+class MemoryStorage(Storage):
+    def __init__(self):
+        # document lưu dạng JSON string để không ai giữ được reference vào state
+        self.players = {}
+        self.history = {table: [] for table in HISTORY_COLUMNS}
+        self.history_src = set()  # (table, player_id, src) của row chuyển từ blob cũ
+        self.next_id = 1
+        self.events = {}     # player_id → {seq: JSON event}
+        self.snapshots = {}  # player_id → {seq: JSON document}
+        # leaderboard: stats theo player; mỗi cột chia bucket như LEADERBOARD_BUCKETS,
+        # mỗi bucket một list (-value, player_id) đã sắp + list -bucket đã sắp
+        self.leaderboard = {}
+        self.ranking = {c: {} for c in LEADERBOARD_COLUMNS}
+        self.bucket_keys = {c: [] for c in LEADERBOARD_COLUMNS}
+        self.lock = threading.Lock()
+
+    def get_player(self, player_id):
+        with self.lock:
+            row = self.players.get(player_id)
+
+        if row is None:
+            return None
+        return codec.loads(row[0]), row[1]
+
+    def get_version(self, player_id):
+        with self.lock:
+            row = self.players.get(player_id)
+
+        return None if row is None else row[1]
+
+    def insert_player(self, player_id, data, version=0):
+        with self.lock:
+            if player_id in self.players:
+                raise KeyError(f"player {player_id} đã tồn tại")
+            self.players[player_id] = (codec.dumps(data), version)
+
+    def update_player(self, player_id, data, expected_version, version):
+        with self.lock:
+            row = self.players.get(player_id)
+            if row is None or row[1] != expected_version:
+                return False
+            self.players[player_id] = (codec.dumps(data), version)
+
+        return True
+
+    def append_history(self, table, player_id, rows):
+        columns = HISTORY_COLUMNS[table]
+
+        with self.lock:
+            for row in rows:
+                if "src" in row:
+                    if (table, player_id, row["src"]) in self.history_src:
+                        continue
+                    self.history_src.add((table, player_id, row["src"]))
+                self.history[table].append({
+                    "id": self.next_id, "player_id": player_id,
+                    "reset_at": row.get("reset_at", 0), **{c: row[c] for c in columns}
+                })
+                self.next_id += 1
+
+    def read_history(self, table, player_id, after_id=0, limit=None, reset_at=None):
+        columns = ("id",) + HISTORY_COLUMNS[table]
+
+        with self.lock:
+            rows = [
+                {c: r[c] for c in columns}
+                for r in self.history[table]
+                if r["player_id"] == player_id and r["id"] > after_id
+                and (reset_at is None or r["reset_at"] == reset_at)
+            ]
+
+        return rows if limit is None else rows[:limit]
+
+    def query_history(self, table, player_id, before_id=None, limit=HISTORY_PAGE,
+                      date_from=None, date_to=None, search=None, reset_at=None):
+        columns = ("id",) + HISTORY_COLUMNS[table]
+        time_column = HISTORY_TIME_COLUMN[table]
+        search = search.casefold() if search else None
+        page = []
+
+        with self.lock:
+            for r in reversed(self.history[table]):
+                if len(page) >= limit:
+                    break
+                if r["player_id"] != player_id:
+                    continue
+                if reset_at is not None and r["reset_at"] != reset_at:
+                    continue
+                if before_id is not None and r["id"] >= before_id:
+                    continue
+                if date_from and r[time_column] < date_from:
+                    continue
+                if date_to and r[time_column] >= date_to:
+                    continue
+                if search and search not in r["name"].casefold():
+                    continue
+                page.append({c: r[c] for c in columns})
+
+        return page
+
+    def delete_history(self, player_id):
+        with self.lock:
+            for table in HISTORY_COLUMNS:
+                self.history[table] = [
+                    r for r in self.history[table] if r["player_id"] != player_id
+                ]
+
+    def update_leaderboard(self, player_id, stats):
+        with self.lock:
+            old = self.leaderboard.get(player_id)
+            new = {c: stats.get(c, 0) for c in LEADERBOARD_COLUMNS}
+            self.leaderboard[player_id] = new
+
+            # chèn / xoá chỉ dịch list của một bucket
+            for column, ranking in self.ranking.items():
+                keys = self.bucket_keys[column]
+                if old is not None:
+                    bucket = -(old[column] // LEADERBOARD_BUCKETS[column])
+                    entries = ranking[bucket]
+                    del entries[bisect_left(entries, (-old[column], player_id))]
+                    if not entries:
+                        del ranking[bucket]
+                        del keys[bisect_left(keys, bucket)]
+
+                bucket = -(new[column] // LEADERBOARD_BUCKETS[column])
+                if bucket not in ranking:
+                    ranking[bucket] = []
+                    insort(keys, bucket)
+                insort(ranking[bucket], (-new[column], player_id))
+
+    def top_players(self, stat, limit=10):
+        with self.lock:
+            top = []
+            for bucket in self.bucket_keys[stat]:
+                top.extend((pid, -value) for value, pid in self.ranking[stat][bucket])
+                if len(top) >= limit:
+                    break
+            return top[:limit]
+
+    def player_rank(self, player_id, stat):
+        with self.lock:
+            stats = self.leaderboard.get(player_id)
+            if stats is None:
+                return None
+
+            value = stats[stat]
+            ranking = self.ranking[stat]
+            bucket = -(value // LEADERBOARD_BUCKETS[stat])
+            # bucket cao hơn + các entry đứng trước (-value, "") trong bucket của mình
+            above = sum(len(ranking[b]) for b in self.bucket_keys[stat] if b < bucket)
+            return above + bisect_left(ranking[bucket], (-value, "")) + 1, value
+
+    def scan_players(self, after_id="", limit=SCAN_BATCH):
+        with self.lock:
+            ids = sorted(pid for pid in self.players if pid > after_id)[:limit]
+            rows = [(pid, *self.players[pid]) for pid in ids]
+
+        return [(pid, codec.loads(doc), version) for pid, doc, version in rows]
+
+    def append_event(self, player_id, event):
+        with self.lock:
+            events = self.events.setdefault(player_id, {})
+            if event["seq"] in events:
+                return False
+            events[event["seq"]] = json.dumps({c: event[c] for c in EVENT_COLUMNS})
+
+        return True
+
+    def append_events(self, player_id, events):
+        with self.lock:
+            stored = self.events.setdefault(player_id, {})
+            if any(event["seq"] in stored for event in events):
+                return False
+            for event in events:
+                stored[event["seq"]] = json.dumps({c: event[c] for c in EVENT_COLUMNS})
+
+        return True
+
+    def read_events(self, player_id, after_seq=0, upto_seq=None):
+        with self.lock:
+            events = self.events.get(player_id, {})
+            rows = [
+                events[seq] for seq in sorted(events)
+                if seq > after_seq and (upto_seq is None or seq <= upto_seq)
+            ]
+
+        return [json.loads(e) for e in rows]
+
+    def read_events_many(self, after_seqs):
+        events = {}
+        for player_id, after_seq in after_seqs.items():
+            rows = self.read_events(player_id, after_seq)
+            if rows:
+                events[player_id] = rows
+        return events
+
+    def get_head(self, player_id):
+        with self.lock:
+            row = self.players.get(player_id)
+            if row is None:
+                return None
+            return max(row[1], max(self.events.get(player_id) or [0]))
+
+    def save_snapshot(self, player_id, seq, data):
+        with self.lock:
+            self.snapshots.setdefault(player_id, {})[seq] = codec.dumps(data)
+
+    def get_snapshot(self, player_id, upto_seq):
+        with self.lock:
+            snapshots = self.snapshots.get(player_id, {})
+            seqs = [seq for seq in snapshots if seq <= upto_seq]
+            if not seqs:
+                return None
+            return codec.loads(snapshots[max(seqs)]), max(seqs)
+
+
+def make_storage_from_env(backend, path="grind.db"):
+    # cho các script chạy ngoài Streamlit: Supabase đọc SUPABASE_URL / SUPABASE_KEY từ env
+    if backend == "supabase":
+        return make_storage(
+            "supabase",
+            url=os.environ["SUPABASE_URL"],
+            key=os.environ["SUPABASE_KEY"],
+            connect_timeout=os.environ.get("SUPABASE_CONNECT_TIMEOUT", CONNECT_TIMEOUT),
+            read_timeout=os.environ.get("SUPABASE_READ_TIMEOUT", READ_TIMEOUT),
+            pool_size=os.environ.get("SUPABASE_POOL_SIZE", POOL_SIZE),
+            read_retries=os.environ.get("SUPABASE_READ_RETRIES", READ_RETRIES)
+        )
+    if backend == "sqlite":
+        return make_storage("sqlite", path=path)
+    return make_storage(backend)
+
+
+def make_storage(backend="supabase", **config):
+    if backend == "supabase":
+        import httpx
+        from supabase import ClientOptions, create_client
+
+        # một httpx.Client cho mọi request: giữ connection (keep-alive) thay vì
+        # bắt tay TLS lại mỗi lần, timeout kết nối / đọc tách riêng
+        size = int(config.get("pool_size", POOL_SIZE))
+        http = httpx.Client(
+            timeout=httpx.Timeout(
+                float(config.get("read_timeout", READ_TIMEOUT)),
+                connect=float(config.get("connect_timeout", CONNECT_TIMEOUT))
+            ),
+            limits=httpx.Limits(
+                max_connections=size,
+                max_keepalive_connections=size,
+                keepalive_expiry=KEEPALIVE_EXPIRY
+            )
+        )
+        client = create_client(config["url"], config["key"], options=ClientOptions(httpx_client=http))
+        return SupabaseStorage(client, int(config.get("read_retries", READ_RETRIES)))
+
+    if backend == "sqlite":
+        return SQLiteStorage(config.get("path", "grind.db"))
+
+    if backend == "memory":
+        return MemoryStorage()
+
+    raise ValueError(f"Không biết storage backend: {backend}")
@@ -0,0 +1,57 @@
+from pathlib import Path
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import db
+import journal
+from journal import JournaledStorage
+from test_journal import Backend
+
+APP = str(Path(__file__).resolve().parent.parent / "3linhtinh.py")
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # app chạy trên journal bọc một backend có thể "sập"
+    monkeypatch.setattr(journal, "RETRY_BASE", 0.01)
+    monkeypatch.setattr(journal, "RETRY_CAP", 0.05)
+    backend = Backend()
+    store = JournaledStorage(backend, str(tmp_path / "journal.db"))
+    monkeypatch.setattr(db.storage, "_storage", store)
+
+    at = AppTest.from_file(APP, default_timeout=30)
+    at.run()
+    assert not at.exception
+    return at, backend, store
+
+
+def expire_cache(at):
+    # như đã qua CACHE_TTL: rerun sau phải hỏi head
+    at.session_state["player_checked_at"] = 0
+
+
+def test_commit_and_read_while_backend_down(app):
+    at, backend, store = app
+    backend.down = True
+    expire_cache(at)
+
+    at.radio(key="active_tab").set_value("⚙️ Forge").run()
+    assert not at.exception and not at.error
+
+    at.text_input[0].set_value("Gym")
+    at.button(key="FormSubmitter:task_forge-⚔️ Tạo Task").click().run()
+    assert not at.exception and not at.error
+    assert at.session_state["player_version"] == 1
+    assert store.pending()
+
+    # rerun sau TTL vẫn đọc được: head + event lấy từ journal
+    expire_cache(at)
+    at.radio(key="active_tab").set_value("⚔️ Task").run()
+    assert not at.exception and not at.error
+    assert at.session_state["player_version"] == 1
+    assert "done_Gym" in [b.key for b in at.button]
+
+    backend.down = False
+    assert store.drain(timeout=10)
+    assert [e["type"] for e in backend.read_events(db.PLAYER_ID)] == ["add_task"]
@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+import engine
+import game
+from eventlog import new_event
+from storage import MemoryStorage, make_storage
+
+PLAYER = "p1"
+LONG_NAME = "x" * (game.MAX_NAME + 20)
+
+
+@pytest.fixture
+def store():
+    store = MemoryStorage()
+    data = game.new_player(time.time())
+    store.insert_player(PLAYER, data)
+    store.save_snapshot(PLAYER, 0, data)
+    return store
+
+
+def test_replays_event_written_before_validation(store):
+    # event cũ (form Forge chưa có max_chars) vẫn phải replay được
+    store.append_events(PLAYER, [
+        {**new_event("add_task", name=LONG_NAME, points=20), "seq": 1},
+        {**new_event("add_treats", treats={"Cafe": 77}), "seq": 2},
+    ])
+
+    player = engine.load_player(store, PLAYER)
+    assert player["head"] == 2
+    assert player["data"]["tasks"] == {LONG_NAME: 20}
+    assert engine.read_player(store, PLAYER)["data"]["treats"] == {"Cafe": 77}
+
+    result = engine.run_actions(store, PLAYER, [{"type": "add_task", "args": {"name": "Gym", "points": 20}}])
+    assert result["seq"] == 3
+
+
+def test_new_action_is_validated(store):
+    with pytest.raises(engine.ActionError, match="dài quá"):
+        engine.run_actions(store, PLAYER, [{"type": "add_task", "args": {"name": LONG_NAME, "points": 20}}])
+    with pytest.raises(engine.ActionError, match="points"):
+        engine.run_actions(store, PLAYER, [{"type": "add_tasks", "args": {"tasks": {"Gym": 22}}}])
+    assert store.get_head(PLAYER) == 0
+
+
+@pytest.mark.parametrize("action", [
+    {"type": "buy_tavern", "args": {"index": -1}},
+    {"type": "buy_tavern", "args": {"index": True}},
+    {"type": "buy_tavern", "args": {"index": 1.0}},
+    {"type": "buy_tavern", "args": {"index": len(game.TAVERN_ITEMS)}},
+    {"type": "buy_tavern", "args": {}},
+    {"type": "forge", "args": {"equip": "shield"}},
+    {"type": "use_item", "args": {"item_id": ["mana_potion"]}},
+    {"type": "complete_tasks", "args": {"names": "Gym"}},
+    {"type": "restore", "args": {"seq": "1"}},
+])
+def test_bad_arguments_are_client_errors(store, action):
+    with pytest.raises(engine.ActionError):
+        engine.run_actions(store, PLAYER, [action])
+    assert store.get_head(PLAYER) == 0
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_restore_before_reset_brings_history_back(backend, tmp_path):
+    store = make_storage(backend, path=str(tmp_path / "grind.db"))
+    data = game.new_player(time.time())
+    store.insert_player(PLAYER, data)
+    store.save_snapshot(PLAYER, 0, data)
+
+    def run(type_, **args):
+        return engine.run_actions(store, PLAYER, [{"type": type_, "args": args}])
+
+    def history():
+        d = engine.read_player(store, PLAYER)["data"]
+        rows = store.query_history("task_history", PLAYER, reset_at=d.get("reset_at", 0))
+        return [r["name"] for r in rows]
+
+    run("add_task", name="Gym", points=20)
+    before_reset = run("complete_tasks", names=["Gym"])["seq"]
+    run("reset")
+    assert history() == []
+
+    run("add_task", name="Đọc sách", points=10)
+    run("complete_tasks", names=["Đọc sách"])
+    assert history() == ["Đọc sách"]
+
+    run("restore", seq=before_reset)
+    assert history() == ["Gym"]
+    assert len(store.read_history("task_history", PLAYER)) == 2
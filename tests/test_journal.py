@@ -0,0 +1,214 @@
+import copy
+import time
+
+import pytest
+
+import game
+import journal
+from eventlog import new_event
+from journal import JournaledStorage
+from storage import MemoryStorage
+
+PLAYER = "p1"
+
+
+class Backend(MemoryStorage):
+    # MemoryStorage có thể "sập": down = True thì mọi lệnh ghi / đọc đều lỗi,
+    # fail = {tên hàm: số lần lỗi} để lỗi đúng một bước, broken = player luôn lỗi
+    def __init__(self):
+        super().__init__()
+        self.down = False
+        self.fail = {}
+        self.broken = set()
+
+    def __getattribute__(self, name):
+        attr = super().__getattribute__(name)
+        if name.startswith("_") or not callable(attr) or name not in Backend.CALLS:
+            return attr
+
+        def call(*args, **kwargs):
+            if self.down:
+                raise ConnectionError("backend down")
+            if any(a in self.broken for a in args if isinstance(a, str)):
+                raise ValueError("backend từ chối")
+            if self.fail.get(name):
+                self.fail[name] -= 1
+                raise ConnectionError(f"{name} lỗi")
+            return attr(*args, **kwargs)
+        return call
+
+    CALLS = {
+        "append_events", "read_events", "get_head", "get_player", "get_snapshot",
+        "append_history", "delete_history", "update_leaderboard", "update_player", "save_snapshot",
+    }
+
+
+@pytest.fixture(autouse=True)
+def fast_retry(monkeypatch):
+    monkeypatch.setattr(journal, "RETRY_BASE", 0.01)
+    monkeypatch.setattr(journal, "RETRY_CAP", 0.05)
+    monkeypatch.setattr(journal, "STUCK_AFTER", 2)
+
+
+def make(tmp_path, data=None):
+    backend = Backend()
+    data = data or game.new_player(time.time())
+    backend.insert_player(PLAYER, data)
+    backend.save_snapshot(PLAYER, 0, data)
+    backend.down = True  # journal gom hết rồi mới đẩy trong một lần
+    return backend, JournaledStorage(backend, str(tmp_path / "journal.db")), data
+
+
+def commit(store, d, seq, type_, player=PLAYER, **args):
+    # như commit() của app: chạy action trên state của mình rồi ghi event + history + stats
+    event = {**new_event(type_, **args), "seq": seq}
+    _, rows = game.run_action(d, event)
+    assert store.append_events(player, [event])
+    for table in dict.fromkeys(t for t, _ in rows):
+        store.append_history(table, player, [r for t, r in rows if t == table])
+    store.update_leaderboard(player, game.leaderboard_stats(d))
+    return event
+
+
+def flush(backend, store):
+    backend.down = False
+    assert store.drain(timeout=10)
+
+
+def foreign(backend, seq, type_, **args):
+    # server khác ghi trước seq này
+    backend.down = False
+    event = {**new_event(type_, **args), "seq": seq}
+    assert backend.append_events(PLAYER, [event])
+    backend.down = True
+    return event
+
+
+def test_rebase_keeps_segment_pushed_earlier(tmp_path):
+    backend, store, data = make(tmp_path)
+    foreign(backend, 2, "add_task", name="Đọc sách", points=10)
+
+    d = copy.deepcopy(data)
+    first = commit(store, d, 1, "add_task", name="Gym", points=20)
+    store.delete_history(PLAYER)
+    second = commit(store, d, 2, "add_treat", name="Cafe", cost=50)
+
+    flush(backend, store)
+
+    events = backend.read_events(PLAYER)
+    assert [e["seq"] for e in events] == [1, 2, 3]
+    assert (events[0]["type"], events[0]["seed"]) == ("add_task", first["seed"])
+    assert (events[2]["type"], events[2]["seed"]) == ("add_treat", second["seed"])
+    assert sum(e["seed"] == first["seed"] for e in events) == 1
+
+
+def test_rebase_renumbers_events_added_later(tmp_path):
+    backend, store, data = make(tmp_path)
+    foreign(backend, 1, "add_task", name="Đọc sách", points=10)
+
+    d = copy.deepcopy(data)
+    commit(store, d, 1, "add_task", name="Gym", points=20)
+    flush(backend, store)
+
+    # session cũ ghi tiếp sau head mới của journal
+    assert store.get_head(PLAYER) == 2
+    commit(store, d, 3, "add_treat", name="Cafe", cost=50)
+    flush(backend, store)
+
+    assert [e["type"] for e in backend.read_events(PLAYER)] == ["add_task", "add_task", "add_treat"]
+
+
+def test_rebase_recomputes_history_and_leaderboard(tmp_path):
+    data = game.new_player(time.time())
+    data["tasks"] = {"Gym": 20}
+    backend, store, data = make(tmp_path, data)
+    # server khác nâng điểm task trước khi action của mình lên
+    foreign(backend, 1, "add_task", name="Gym", points=50)
+
+    d = copy.deepcopy(data)
+    commit(store, d, 1, "complete_tasks", names=["Gym"])
+    assert d["total_points"] == 20
+
+    flush(backend, store)
+
+    assert [e["type"] for e in backend.read_events(PLAYER)] == ["add_task", "complete_tasks"]
+    rows = backend.read_history("task_history", PLAYER)
+    assert [(r["name"], r["points"]) for r in rows] == [("Gym", 50)]
+    assert backend.player_rank(PLAYER, "total_points") == (1, 50)
+
+
+def test_rebase_keeps_migrated_history(tmp_path):
+    data = game.new_player(time.time())
+    data["tasks"] = {"Gym": 20}
+    backend, store, data = make(tmp_path, data)
+    foreign(backend, 1, "add_task", name="Gym", points=50)
+
+    d = copy.deepcopy(data)
+    migrated = {"name": "Cũ", "points": 10, "date": "2024-01-01 08:00", "src": 0}
+    store.append_history("task_history", PLAYER, [migrated])
+    commit(store, d, 1, "complete_tasks", names=["Gym"])
+
+    flush(backend, store)
+
+    rows = backend.read_history("task_history", PLAYER)
+    assert [(r["name"], r["points"]) for r in rows] == [("Cũ", 10), ("Gym", 50)]
+
+
+def test_failure_after_history_does_not_resend_it(tmp_path):
+    backend, store, data = make(tmp_path)
+    d = copy.deepcopy(data)
+    commit(store, d, 1, "add_task", name="Gym", points=20)
+    commit(store, d, 2, "complete_tasks", names=["Gym"])
+
+    backend.fail["update_leaderboard"] = 2
+    flush(backend, store)
+
+    assert [e["seq"] for e in backend.read_events(PLAYER)] == [1, 2]
+    assert len(backend.read_history("task_history", PLAYER)) == 1
+    assert backend.player_rank(PLAYER, "total_points") == (1, 20)
+
+
+def test_reads_fall_back_to_journal_while_backend_down(tmp_path):
+    backend, store, data = make(tmp_path)
+    backend.down = False
+    assert store.get_head(PLAYER) == 0
+    assert store.read_events(PLAYER) == []
+
+    backend.down = True
+    d = copy.deepcopy(data)
+    event = commit(store, d, 1, "add_task", name="Gym", points=20)
+    store.update_player(PLAYER, d, 0, 1)
+
+    assert store.get_head(PLAYER) == 1
+    assert store.read_events(PLAYER, 0) == [event]
+    assert store.get_player(PLAYER) == (d, 1)
+    # player chưa đọc lần nào: journal không biết head → vẫn báo lỗi
+    with pytest.raises(ConnectionError):
+        store.read_events("p2")
+
+
+def wait_for(check, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not check():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+def test_failing_player_does_not_block_others(tmp_path):
+    backend, store, data = make(tmp_path)
+    backend.down = False
+    backend.insert_player("p2", data)
+    backend.broken.add(PLAYER)
+
+    # player hỏng ghi trước nên đứng đầu journal
+    commit(store, copy.deepcopy(data), 1, "add_task", name="Gym", points=20)
+    commit(store, copy.deepcopy(data), 1, "add_task", player="p2", name="Cafe", points=10)
+
+    wait_for(lambda: backend.read_events("p2"))
+    wait_for(lambda: PLAYER in store.stuck())
+    assert isinstance(store.stuck()[PLAYER][1], ValueError)
+
+    backend.broken.clear()
+    assert store.drain(timeout=10)
+    assert [e["seq"] for e in backend.read_events(PLAYER)] == [1]
+    assert store.stuck() == {}
@@ -0,0 +1,29 @@
+import time
+
+import engine
+import game
+from migrate_players import backfill_leaderboard
+from storage import SQLiteStorage
+
+PLAYER = "p1"
+
+
+def test_backfill_leaderboard_from_replayed_state(tmp_path):
+    store = SQLiteStorage(str(tmp_path / "grind.db"))
+    data = game.new_player(time.time())
+    # snapshot lớn → lưu dạng nén, không đọc được bằng json_extract
+    data["tasks"] = {f"Task {i}": 10 for i in range(200)}
+    data["total_points"] = 30
+    store.insert_player(PLAYER, data)
+    store.save_snapshot(PLAYER, 0, data)
+    assert store.conn.execute("select data from players").fetchone()[0].find('"z"') > 0
+
+    # event sau snapshot: cộng thêm điểm mà players.data chưa có
+    engine.run_actions(store, PLAYER, [{"type": "complete_tasks", "args": {"names": ["Task 1"]}}])
+    store.conn.execute("delete from leaderboard")
+
+    stats = backfill_leaderboard(store)
+
+    assert stats["migrated"] == 1
+    assert store.player_rank(PLAYER, "total_points") == (1, 40)
+    assert store.player_rank(PLAYER, "tasks_done") == (1, 1)
@@ -0,0 +1,21 @@
+import sqlite3
+
+import pytest
+
+from storage import _like_escape
+
+
+@pytest.mark.parametrize("name, search, found", [
+    ("Giảm 50% đường", "50%", True),
+    ("Giảm 50 đường", "50%", False),
+    ("a_b", "a_b", True),
+    ("axb", "a_b", False),
+    ("c:\\temp", "c:\\t", True),
+])
+def test_like_escape_matches_literally(name, search, found):
+    # backslash là ký tự escape mặc định của LIKE trên Postgres, SQLite phải ghi rõ
+    conn = sqlite3.connect(":memory:")
+    row = conn.execute(
+        "select ? like ? escape '\\'", (name, f"%{_like_escape(search)}%")
+    ).fetchone()
+    assert bool(row[0]) == found
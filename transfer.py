@@ -0,0 +1,221 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+
+from game import IMPORT_KINDS, MAX_IMPORT, MAX_NAME
+from storage import HISTORY_COLUMNS, SCAN_BATCH, make_storage_from_env
+
+# ================= EXPORT / IMPORT =================
+# Export: đọc lịch sử từng trang (keyset theo id) và ghi dần ra NDJSON / CSV /
+# Parquet, bộ nhớ không phụ thuộc số row. Dùng cho nút tải trong app và CLI.
+# Import: đọc file task / treat, kiểm tra toàn bộ (giống form Forge), rồi ghi
+# cả file trong một action add_tasks / add_treats = một event (tên đã có thì
+# ghi đè, như tạo lại bằng form).
+#
+#   python transfer.py export --player $ID --format csv --out history.csv
+#   python transfer.py export --player $ID --table treat_history > treats.ndjson
+#   python transfer.py import --player $ID --kind tasks tasks.csv
+#
+# File import: CSV có header (name,points / name,cost), NDJSON hoặc JSON list
+# các object cùng field. Parquet cần pyarrow (chỉ khi export parquet).
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+# ===== EXPORT =====
+def iter_history(store, table, player_id, page=SCAN_BATCH, reset_at=None):
+    # từng row, cũ → mới; mỗi lần chỉ giữ một trang trong bộ nhớ
+    after_id = 0
+    while True:
+        rows = store.read_history(table, player_id, after_id, page, reset_at)
+        yield from rows
+        if len(rows) < page:
+            return
+        after_id = rows[-1]["id"]
+
+
+def iter_pages(rows, size):
+    page = []
+    for row in rows:
+        page.append(row)
+        if len(page) == size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def write_ndjson(rows, out, columns):
+    for row in rows:
+        line = json.dumps({c: row[c] for c in columns}, ensure_ascii=False)
+        out.write(line.encode("utf-8") + b"\n")
+
+
+def write_csv(rows, out, columns):
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="", write_through=True)
+    writer = csv.DictWriter(text, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+    text.detach()  # không đóng out theo
+
+
+def write_parquet(rows, out, columns, page=SCAN_BATCH):
+    # mỗi trang lịch sử = một row group
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    for batch in iter_pages(rows, page):
+        table = pa.Table.from_pylist([{c: r[c] for c in columns} for r in batch])
+        if writer is None:
+            writer = pq.ParquetWriter(out, table.schema)
+        writer.write_table(table.cast(writer.schema))
+
+    if writer is None:
+        writer = pq.ParquetWriter(out, pa.schema([(c, pa.string()) for c in columns]))
+    writer.close()
+
+
+WRITERS = {"ndjson": write_ndjson, "csv": write_csv, "parquet": write_parquet}
+
+
+def export_history(store, table, player_id, fmt, out, reset_at=None):
+    # out: file nhị phân (file thật, stdout.buffer, BytesIO...);
+    # reset_at: chỉ row cùng mốc Reset (xem storage.py), None = tất cả
+    columns = ("id",) + HISTORY_COLUMNS[table]
+    WRITERS[fmt](iter_history(store, table, player_id, reset_at=reset_at), out, columns)
+
+
+# ===== IMPORT =====
+class ImportFileError(ValueError):
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def read_records(f, filename):
+    # → list (số dòng, dict) theo đuôi file
+    text = io.TextIOWrapper(f, encoding="utf-8-sig") if isinstance(f.read(0), bytes) else f
+    ext = os.path.splitext(filename)[1].lower()
+
+    if ext == ".csv":
+        return [(i, row) for i, row in enumerate(csv.DictReader(text), 2)]
+
+    if ext == ".json":
+        try:
+            records = json.load(text)
+        except ValueError as e:
+            raise ImportFileError([f"JSON không hợp lệ: {e}"]) from e
+        if not isinstance(records, list):
+            raise ImportFileError(["JSON phải là một list object"])
+        return list(enumerate(records, 1))
+
+    if ext in (".ndjson", ".jsonl"):
+        records = []
+        for i, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                records.append((i, json.loads(line)))
+            except ValueError as e:
+                raise ImportFileError([f"dòng {i}: JSON không hợp lệ ({e})"]) from e
+        return records
+
+    raise ImportFileError([f"Không đọc được file {ext or filename!r} (csv, json, ndjson)"])
+
+
+def parse_import(f, filename, kind):
+    # → {tên: giá trị}; sai bất kỳ dòng nào → ImportFileError liệt kê mọi lỗi
+    field, low, high, step = IMPORT_KINDS[kind]
+    items, errors = {}, []
+
+    records = read_records(f, filename)
+    if len(records) > MAX_IMPORT:
+        raise ImportFileError([f"Tối đa {MAX_IMPORT} dòng mỗi lần ({len(records)})"])
+
+    for line, record in records:
+        if not isinstance(record, dict):
+            errors.append(f"dòng {line}: phải là object")
+            continue
+
+        name = str(record.get("name") or "").strip()
+        if not name:
+            errors.append(f"dòng {line}: thiếu name")
+            continue
+        if len(name) > MAX_NAME:
+            errors.append(f"dòng {line}: name dài quá {MAX_NAME} ký tự")
+            continue
+        if name in items:
+            errors.append(f"dòng {line}: {name!r} bị lặp trong file")
+            continue
+
+        try:
+            value = int(str(record.get(field, "")).strip())
+        except ValueError:
+            errors.append(f"dòng {line}: {field} phải là số nguyên")
+            continue
+        if not low <= value <= high or (value - low) % step:
+            errors.append(f"dòng {line}: {field} phải từ {low} tới {high}, bước {step}")
+            continue
+
+        items[name] = value
+
+    if errors:
+        raise ImportFileError(errors)
+    if not items:
+        raise ImportFileError(["File không có dòng nào"])
+    return items
+
+
+# ===== CLI =====
+def main():
+    parser = argparse.ArgumentParser(description="Export lịch sử / import task, treat của một player")
+    parser.add_argument("--backend", choices=["supabase", "sqlite"], default="supabase")
+    parser.add_argument("--path", default="grind.db", help="file SQLite (backend sqlite)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export")
+    export.add_argument("--player", required=True)
+    export.add_argument("--table", choices=list(HISTORY_COLUMNS), default="task_history")
+    export.add_argument("--format", choices=list(EXPORT_FORMATS), default="ndjson")
+    export.add_argument("--out", help="file kết quả (mặc định: stdout)")
+
+    load = commands.add_parser("import")
+    load.add_argument("--player", required=True)
+    load.add_argument("--kind", choices=list(IMPORT_KINDS), required=True)
+    load.add_argument("file")
+
+    args = parser.parse_args()
+    store = make_storage_from_env(args.backend, args.path)
+
+    if args.command == "export":
+        if args.out:
+            with open(args.out, "wb") as out:
+                export_history(store, args.table, args.player, args.format, out)
+        else:
+            export_history(store, args.table, args.player, args.format, sys.stdout.buffer)
+        return
+
+    from engine import run_actions
+
+    try:
+        with open(args.file, "rb") as f:
+            items = parse_import(f, args.file, args.kind)
+    except ImportFileError as e:
+        print("\n".join(e.errors), file=sys.stderr)
+        sys.exit(1)
+
+    result = run_actions(store, args.player, [{"type": f"add_{args.kind}", "args": {args.kind: items}}])
+    print(f"Đã nhập {len(items)} {args.kind} (event #{result['seq']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from eventlog import SNAPSHOT_EVERY, apply_event, new_event, replay
+from migrations import needs_migration
+from storage import SCAN_BATCH, make_storage_from_env
+
+# ================= WORKER BẢO TRÌ =================
+# Chạy các hiệu ứng theo thời gian cho mọi player, ngoài luồng request:
+#   maintain    – hết Choáng thì gộp energy và bỏ khoá, bỏ debuff đã hết lượt,
+#                 boss hết máu thì hồi (game.action_maintain)
+#   boss_reset  – (tuỳ chọn, --reset-boss) sự kiện hồi máu boss cho tất cả
+# Mỗi thay đổi được ghi thành event như action của người chơi, nên session
+# đang mở thấy ngay và replay vẫn đúng. Duyệt players theo id từng batch:
+# đọc event của cả batch trong một query, ghi event mới của cả batch trong
+# một lần append_events_many. Con trỏ được lưu vào --state, chạy lại là
+# tiếp tục từ batch dở.
+#
+#   python worker.py --backend sqlite --path grind.db
+#   python worker.py --every 300 --state worker.json          # chạy mãi, 5 phút / lượt
+#   python worker.py --reset-boss                             # vd. cron 0h mỗi ngày
+
+
+def load_cursor(path):
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f).get("after_id", "")
+    return ""
+
+
+def save_cursor(path, after_id):
+    # ghi file tạm rồi rename để dừng đột ngột cũng không hỏng file
+    if not path:
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"after_id": after_id, "at": time.time()}, f)
+    os.replace(tmp, path)
+
+
+def maintain_batch(store, rows, event_types, stats):
+    events = store.read_events_many({pid: version for pid, _, version in rows})
+    pending = {}  # player_id → (data, version, head, event mới)
+
+    for player_id, data, version in rows:
+        stats["scanned"] += 1
+
+        # document chưa migrate: để lần tải / migrate_players.py lo trước
+        if needs_migration(data):
+            stats["skipped"] += 1
+            continue
+
+        player_events = events.get(player_id, [])
+        replay(store, player_id, data, player_events)
+        head = player_events[-1]["seq"] if player_events else version
+
+        # như commit_event: event không đổi gì thì không ghi
+        written = []
+        for type_ in event_types:
+            event = new_event(type_)
+            before = json.dumps(data, sort_keys=True)
+            apply_event(store, player_id, data, event)
+            if json.dumps(data, sort_keys=True) != before:
+                data["last_updated"] = event["ts"]
+                written.append({**event, "seq": head + len(written) + 1})
+
+        if written:
+            pending[player_id] = (data, version, head, written)
+
+    ok = store.append_events_many({pid: p[3] for pid, p in pending.items()})
+
+    for player_id, (data, version, head, written) in pending.items():
+        # player vừa chơi ở session khác → lượt sau làm
+        if player_id not in ok:
+            stats["skipped"] += 1
+            continue
+
+        stats["events"] += len(written)
+        seq = head + len(written)
+        if seq // SNAPSHOT_EVERY > head // SNAPSHOT_EVERY:
+            if store.update_player(player_id, data, version, seq):
+                store.save_snapshot(player_id, seq, data)
+
+
+def run(store, event_types, batch=SCAN_BATCH, state=None):
+    stats = {"scanned": 0, "events": 0, "skipped": 0}
+    after_id = load_cursor(state)
+
+    while True:
+        rows = store.scan_players(after_id, batch)
+        if not rows:
+            # hết bảng: lượt sau bắt đầu lại từ đầu
+            save_cursor(state, "")
+            return stats
+
+        maintain_batch(store, rows, event_types, stats)
+        after_id = rows[-1][0]
+        save_cursor(state, after_id)
+
+        print(
+            f"… {stats['scanned']} player, {stats['events']} event, đến id {after_id}",
+            file=sys.stderr
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker bảo trì định kỳ cho mọi player")
+    parser.add_argument("--backend", choices=["supabase", "sqlite"], default="supabase")
+    parser.add_argument("--path", default="grind.db", help="file SQLite (backend sqlite)")
+    parser.add_argument("--batch", type=int, default=SCAN_BATCH)
+    parser.add_argument("--state", help="file JSON lưu con trỏ để chạy tiếp khi bị dừng")
+    parser.add_argument("--reset-boss", action="store_true", help="hồi máu boss cho mọi player")
+    parser.add_argument("--every", type=float, help="chạy lặp lại mỗi N giây (mặc định: chạy 1 lượt)")
+    args = parser.parse_args()
+
+    store = make_storage_from_env(args.backend, args.path)
+    event_types = ["maintain"] + (["boss_reset"] if args.reset_boss else [])
+
+    while True:
+        start = time.perf_counter()
+        stats = run(store, event_types, args.batch, args.state)
+        print(
+            f"Xong: {stats['scanned']} player, {stats['events']} event, "
+            f"{stats['skipped']} bỏ qua ({time.perf_counter() - start:.1f}s)"
+        )
+
+        if not args.every:
+            return
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()